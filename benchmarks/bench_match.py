@@ -0,0 +1,224 @@
+"""
+Scoring, caching and end-to-end match benchmarks on synthetic Last.fm data.
+
+    python -m benchmarks.bench_match --output bench.json
+    python -m benchmarks.bench_match --baseline bench.json --tolerance 0.25
+
+Times build_vector, cosine_similarity and compute_match on generated
+charts (benchmarks.payloads), then run_match against a local fake Last.fm
+server with configurable latency and 429 injection: cold (every call
+fetched), warm (snapshots cached, scored again) and cached (stored result).
+Writes one JSON document with latency percentiles per benchmark; with
+--baseline it also compares p50s and exits with status 1 on a regression.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "taste_matchmaker.settings")
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from matchmaker.models import LastfmUser, MatchRequest  # noqa: E402
+from matchmaker.services.scoring import build_vector, compute_match, cosine_similarity  # noqa: E402
+from matchmaker.tasks import run_match  # noqa: E402
+
+from .payloads import PayloadFactory  # noqa: E402
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def summarize(samples: List[float], **extra) -> Dict:
+    return {
+        "n": len(samples),
+        "p50_ms": round(_percentile(samples, 50), 3),
+        "p95_ms": round(_percentile(samples, 95), 3),
+        "mean_ms": round(sum(samples) / len(samples), 3),
+        "max_ms": round(max(samples), 3),
+        **extra,
+    }
+
+
+def measure(fn: Callable[[int], object], repeat: int, warmup: int = 1) -> List[float]:
+    """Milliseconds per ``fn(i)`` call, after ``warmup`` untimed calls."""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def scoring_benchmarks(factory: PayloadFactory, users: int, repeat: int) -> Dict[str, Dict]:
+    profiles = [factory.profile(f"user{i}") for i in range(users)]
+    charts = [profile["overall"] for profile in profiles]
+    vectors = [build_vector(chart) for chart in charts]
+
+    def pair(i: int):
+        return i % users, (i * 7 + 1) % users
+
+    return {
+        "build_vector": summarize(measure(lambda i: build_vector(charts[i % users]), repeat)),
+        "cosine_similarity": summarize(
+            measure(lambda i: cosine_similarity(vectors[pair(i)[0]], vectors[pair(i)[1]]), repeat)
+        ),
+        "compute_match": summarize(
+            measure(lambda i: compute_match(profiles[pair(i)[0]], profiles[pair(i)[1]]), repeat)
+        ),
+    }
+
+
+def _stage_means(matches: List[MatchRequest]) -> Dict[str, float]:
+    keys = sorted({key for match in matches for key in match.timings or {} if key.endswith("_ms")})
+    return {key: round(sum((m.timings or {}).get(key, 0) for m in matches) / len(matches), 3) for key in keys}
+
+
+def match_benchmarks(factory: PayloadFactory, repeat: int, latency: float, rate_limit_ratio: float) -> Dict[str, Dict]:
+    # Imported here so the scoring benchmarks run without the test helpers on the path.
+    from tests.fake_lastfm import FakeLastfm
+
+    def run(username_a: str, username_b: str) -> MatchRequest:
+        match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.get_or_create(username=username_a)[0],
+            user_b=LastfmUser.objects.get_or_create(username=username_b)[0],
+        )
+        run_match.apply(args=[str(match.uuid)])
+        match.refresh_from_db()
+        if match.status != "READY":
+            raise RuntimeError(f"run_match failed: {match.error_message}")
+        return match
+
+    results = {}
+    fake_lastfm = FakeLastfm(latency=latency, rate_limit_ratio=rate_limit_ratio, seed=factory.seed, reply=factory.api_reply)
+    with fake_lastfm as fake:
+        with override_settings(LASTFM_BASE_URL=fake.url, LASTFM_API_KEY="bench"):
+            scenarios = {
+                # New users every time: two profiles and six charts fetched.
+                "run_match_cold": (lambda i: run(f"cold{i}a", f"cold{i}b"), None),
+                # Cached snapshots, result cache cleared: load vectors and score.
+                "run_match_warm": (lambda i: run("warm-a", "warm-b"), cache.clear),
+                # Everything cached: the stored result is reused.
+                "run_match_cached": (lambda i: run("warm-a", "warm-b"), None),
+            }
+            for name, (scenario, before_each) in scenarios.items():
+                matches: List[MatchRequest] = []
+
+                def step(i: int, scenario=scenario, before_each=before_each, matches=matches):
+                    if before_each is not None:
+                        before_each()
+                    matches.append(scenario(i))
+
+                step(-1)  # warm up outside the call count
+                calls_before = len(fake.requests)
+                samples = measure(step, repeat, warmup=0)
+                results[name] = summarize(
+                    samples,
+                    lastfm_calls=len(fake.requests) - calls_before,
+                    stages_mean_ms=_stage_means(matches[1:]),
+                )
+    return results
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> Dict[str, Dict]:
+    """p50 ratios against the baseline; ``regression`` when slower by more than ``tolerance``."""
+    comparison = {}
+    for name, result in current["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before or not before.get("p50_ms"):
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        comparison[name] = {
+            "baseline_p50_ms": before["p50_ms"],
+            "p50_ms": result["p50_ms"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + tolerance,
+        }
+    return comparison
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=200, help="timed calls per scoring benchmark")
+    parser.add_argument("--match-repeat", type=int, default=20, help="timed run_match calls per scenario")
+    parser.add_argument("--users", type=int, default=50, help="synthetic users for the scoring benchmarks")
+    parser.add_argument("--artists", type=int, default=300)
+    parser.add_argument("--mbid-ratio", type=float, default=0.7)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Last.fm response delay (seconds)")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of calls answered with a 429")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-match", action="store_true", help="only run the scoring benchmarks")
+    parser.add_argument("--output", help="write the results here as well as to stdout")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown before a regression")
+    args = parser.parse_args()
+
+    factory = PayloadFactory(seed=args.seed, artists=args.artists, mbid_ratio=args.mbid_ratio)
+    results: Dict = {
+        "meta": {
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "args": vars(args),
+        },
+        "benchmarks": scoring_benchmarks(factory, args.users, args.repeat),
+    }
+
+    if not args.skip_match:
+        # A throwaway test database and a limiter that never throttles, so
+        # runs measure the code rather than the quota or leftover state.
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(
+                LASTFM_RATE_LIMIT_PER_SECOND=10_000, LASTFM_RATE_LIMIT_BURST=10_000, LASTFM_RATE_LIMIT_REDIS_URL=""
+            ):
+                results["benchmarks"].update(
+                    match_benchmarks(factory, args.match_repeat, args.latency, args.rate_limit_ratio)
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    regressions = False
+    if args.baseline:
+        with open(args.baseline) as fh:
+            results["comparison"] = compare(results, json.load(fh), args.tolerance)
+        regressions = any(entry["regression"] for entry in results["comparison"].values())
+
+    document = json.dumps(results, indent=2)
+    print(document)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(document + "\n")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
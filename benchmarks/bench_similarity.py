@@ -0,0 +1,75 @@
+"""
+One-vs-all similarity benchmark on synthetic users.
+
+    python -m benchmarks.bench_similarity --users 10000 100000
+
+Prints one JSON object per user count with index build time and query
+latency percentiles.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+
+import django
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "taste_matchmaker.settings")
+django.setup()
+
+from matchmaker.services.scoring import PERIODS  # noqa: E402
+from matchmaker.services.similarity import PeriodIndex, SimilarityIndex  # noqa: E402
+
+
+def synthetic_rows(rng: np.random.Generator, users: int, artists_per_user: int, catalog: int):
+    """Zipf-popular artists and Zipf playcounts, like real Last.fm charts."""
+    rows = []
+    for user_id in range(users):
+        ids = np.unique(rng.zipf(1.2, size=artists_per_user * 2) % catalog)[:artists_per_user]
+        weights = np.log1p(np.sort(rng.zipf(1.6, size=len(ids)))[::-1]).astype(np.float32)
+        rows.append((user_id, (ids.astype(np.int32), weights / np.linalg.norm(weights)), 0.0))
+    return rows
+
+
+def run(users: int, artists_per_user: int, catalog: int, queries: int, top_k: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    rows = {p: synthetic_rows(rng, users, artists_per_user, catalog) for p in PERIODS}
+    started = time.perf_counter()
+    index = SimilarityIndex({p: PeriodIndex.from_rows(rows[p]) for p in PERIODS})
+    build_seconds = time.perf_counter() - started
+
+    timings = []
+    for user_id in rng.integers(0, users, size=queries):
+        query = {p: rows[p][user_id][1] for p in PERIODS}
+        started = time.perf_counter()
+        index.best_matches(int(user_id), query, fresh_after=0.0, top_k=top_k)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "benchmark": "one_vs_all",
+        "users": users,
+        "artists_per_user": artists_per_user,
+        "postings": int(sum(p.posting_count for p in index.periods.values())),
+        "build_seconds": round(build_seconds, 3),
+        "query_ms_p50": round(float(np.percentile(timings, 50)), 3),
+        "query_ms_p95": round(float(np.percentile(timings, 95)), 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--artists-per-user", type=int, default=300)
+    parser.add_argument("--catalog", type=int, default=500_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for users in args.users:
+        print(json.dumps(run(users, args.artists_per_user, args.catalog, args.queries, args.top_k, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
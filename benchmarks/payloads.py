@@ -0,0 +1,76 @@
+"""
+Synthetic Last.fm data for benchmarks.
+
+Artists are drawn from a shared catalog with Zipf popularity, so users
+overlap like real ones do, and each chart has Zipf-distributed playcounts.
+A fixed share of artists has an MBID; the rest are keyed by name, as on
+Last.fm. Everything is derived from ``(seed, username, period)``, so a
+user's chart is the same in every run and every process.
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import uuid
+from typing import Dict, List
+
+from matchmaker.services.scoring import PERIODS
+
+# Chart length and playcount scale per period; older windows hold more plays.
+PERIOD_SCALE = {"3month": 0.15, "12month": 0.5, "overall": 1.0}
+
+
+class PayloadFactory:
+    def __init__(self, seed: int = 1, artists: int = 300, catalog: int = 50_000, mbid_ratio: float = 0.7):
+        self.seed = seed
+        self.artists = artists
+        self.catalog = catalog
+        self.mbid_ratio = mbid_ratio
+
+    def _random(self, *parts: object) -> random.Random:
+        digest = hashlib.sha256(":".join(str(p) for p in (self.seed, *parts)).encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def artist(self, artist_id: int) -> Dict:
+        rng = self._random("artist", artist_id)
+        has_mbid = rng.random() < self.mbid_ratio
+        return {
+            "name": f"Artist {artist_id}",
+            "mbid": str(uuid.UUID(int=rng.getrandbits(128))) if has_mbid else "",
+            "url": f"https://www.last.fm/music/Artist+{artist_id}",
+        }
+
+    def top_artists(self, username: str, period: str, limit: int = 300) -> List[Dict]:
+        """A chart in the trimmed client format, playcounts descending."""
+        rng = self._random("chart", username, period)
+        count = min(limit, self.artists)
+        ids: List[int] = []
+        seen = set()
+        while len(ids) < count:
+            # Zipf-like popularity over the catalog (Pareto rank, clipped).
+            artist_id = int(rng.paretovariate(1.1)) % self.catalog
+            if artist_id not in seen:
+                seen.add(artist_id)
+                ids.append(artist_id)
+        scale = PERIOD_SCALE.get(period, 1.0)
+        # Zipf's law over rank with some per-user noise.
+        plays = sorted(
+            (max(1, int(5000 * scale / rank**0.9 * rng.uniform(0.8, 1.25))) for rank in range(1, count + 1)),
+            reverse=True,
+        )
+        return [{**self.artist(artist_id), "playcount": playcount} for artist_id, playcount in zip(ids, plays)]
+
+    def profile(self, username: str, limit: int = 300) -> Dict[str, List[Dict]]:
+        return {period: self.top_artists(username, period, limit) for period in PERIODS}
+
+    def api_reply(self, params: Dict) -> Dict:
+        """Raw API bodies, for tests.fake_lastfm.FakeLastfm(reply=...)."""
+        method = params.get("method")
+        if method == "user.getInfo":
+            return {"user": {"name": params["user"], "playcount": "123456", "country": "Nowhere", "image": []}}
+        if method == "user.getTopArtists":
+            chart = self.top_artists(params["user"], params["period"], int(params.get("limit", 50)))
+            return {"topartists": {"artist": [{**a, "playcount": str(a["playcount"])} for a in chart]}}
+        if method == "user.getRecentTracks":
+            return {"recenttracks": {"track": [], "@attr": {"total": "0"}}}
+        return {"error": 3, "message": "Invalid Method"}
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import LastfmUser, MatchRequest, TopArtistSnapshot
+from .models import GroupMatchRequest, LastfmUser, MatchRequest, TopArtistSnapshot
 
 
 @admin.register(LastfmUser)
@@ -11,7 +11,7 @@ class LastfmUserAdmin(admin.ModelAdmin):
 
 @admin.register(TopArtistSnapshot)
 class TopArtistSnapshotAdmin(admin.ModelAdmin):
-    list_display = ("user", "period", "limit", "fetched_at")
+    list_display = ("user", "period", "limit", "fetched_at", "full_fetched_at")
     list_filter = ("period",)
     search_fields = ("user__username",)
 
@@ -21,3 +21,9 @@ class MatchRequestAdmin(admin.ModelAdmin):
     list_display = ("uuid", "user_a", "user_b", "status", "created_at")
     list_filter = ("status",)
     search_fields = ("user_a__username", "user_b__username")
+
+
+@admin.register(GroupMatchRequest)
+class GroupMatchRequestAdmin(admin.ModelAdmin):
+    list_display = ("uuid", "status", "created_at")
+    list_filter = ("status",)
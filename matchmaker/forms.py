@@ -2,6 +2,8 @@ import re
 from django import forms
 
 USERNAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+GROUP_MIN_USERS = 2
+GROUP_MAX_USERS = 50
 
 
 class MatchForm(forms.Form):
@@ -27,6 +29,33 @@ class MatchForm(forms.Form):
         value = self.cleaned_data.get(field_name, "").strip()
         if not value:
             raise forms.ValidationError("Username cannot be empty.")
-        if not USERNAME_RE.match(value):
-            raise forms.ValidationError("Only letters, numbers, underscores, and hyphens are allowed.")
-        return value
+        return validate_username(value)
+
+
+def validate_username(value: str) -> str:
+    if not USERNAME_RE.match(value):
+        raise forms.ValidationError("Only letters, numbers, underscores, and hyphens are allowed.")
+    return value
+
+
+class GroupMatchForm(forms.Form):
+    usernames = forms.CharField(
+        label="Usernames",
+        widget=forms.Textarea(attrs={"rows": 4}),
+        help_text=f"{GROUP_MIN_USERS} to {GROUP_MAX_USERS} usernames, separated by commas, spaces or new lines.",
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["usernames"].widget.attrs.update(
+            {"placeholder": "alice, bob, carol", "autocomplete": "off"}
+        )
+
+    def clean_usernames(self):
+        names = list(dict.fromkeys(re.split(r"[\s,]+", self.cleaned_data.get("usernames", "").strip())))
+        names = [validate_username(name) for name in names if name]
+        if len(names) < GROUP_MIN_USERS:
+            raise forms.ValidationError(f"Enter at least {GROUP_MIN_USERS} different usernames.")
+        if len(names) > GROUP_MAX_USERS:
+            raise forms.ValidationError(f"A group can have at most {GROUP_MAX_USERS} usernames.")
+        return names
@@ -0,0 +1,89 @@
+import math
+import sys
+from array import array
+
+from django.db import migrations, models
+
+# Frozen copies of the vector format as of this migration, so later changes
+# to matchmaker.services do not change what it writes.
+
+
+def _pack(values, typecode):
+    packed = array(typecode, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def ranked_weights(payload):
+    """``(key, name, weight)`` per artist in rank order, log-weighted and deduplicated."""
+    weights = {}
+    for artist in payload:
+        weight = math.log(int(artist.get("playcount", 0)) + 1)
+        if weight <= 0:
+            continue
+        key = artist.get("mbid") or artist.get("name", "").lower()
+        weights[key] = (artist.get("name") or key, weight)
+    return [(key, name, weight) for key, (name, weight) in weights.items()]
+
+
+def encode_vector(artist_ids, weights):
+    packed_weights = _pack(weights, "f")
+    stored = array("f")
+    stored.frombytes(packed_weights)
+    if sys.byteorder != "little":
+        stored.byteswap()
+    return {
+        "vector_ids": _pack(artist_ids, "i"),
+        "vector_weights": packed_weights,
+        "vector_norm": math.sqrt(sum(w * w for w in stored)),
+    }
+
+
+def backfill_vectors(apps, schema_editor):
+    Artist = apps.get_model("matchmaker", "Artist")
+    TopArtistSnapshot = apps.get_model("matchmaker", "TopArtistSnapshot")
+    for snapshot in TopArtistSnapshot.objects.filter(vector_ids__isnull=True).iterator():
+        ranked = ranked_weights(snapshot.payload or [])
+        names = {key: name for key, name, _ in ranked}
+        Artist.objects.bulk_create(
+            [Artist(key=key, name=name) for key, name in names.items()], ignore_conflicts=True
+        )
+        ids = dict(Artist.objects.filter(key__in=names).values_list("key", "id"))
+        fields = encode_vector([ids[key] for key, _, _ in ranked], [weight for _, _, weight in ranked])
+        # update() so fetched_at (auto_now) keeps its value.
+        TopArtistSnapshot.objects.filter(pk=snapshot.pk).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matchmaker", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Artist",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("key", models.CharField(max_length=512, unique=True)),
+                ("name", models.CharField(max_length=512)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="vector_ids",
+            field=models.BinaryField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="vector_weights",
+            field=models.BinaryField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="vector_norm",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_vectors, migrations.RunPython.noop),
+    ]
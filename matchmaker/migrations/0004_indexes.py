@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matchmaker", "0003_groupmatchrequest"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="matchrequest",
+            index=models.Index(fields=["status", "created_at"], name="match_status_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="topartistsnapshot",
+            index=models.Index(fields=["user", "period", "fetched_at"], name="snapshot_user_period_fetch_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="topartistsnapshot",
+            index=models.Index(fields=["limit", "fetched_at"], name="snapshot_limit_fetched_idx"),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matchmaker", "0004_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="full_fetched_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matchmaker", "0005_snapshot_full_fetched_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="matchrequest",
+            name="timings",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
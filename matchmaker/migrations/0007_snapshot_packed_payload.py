@@ -0,0 +1,131 @@
+import sys
+from array import array
+from urllib.parse import quote_plus
+
+from django.db import migrations, models
+
+# Frozen copies of the payload format as of this migration, so later changes
+# to matchmaker.services do not change what it writes.
+ARTIST_URL = "https://www.last.fm/music/"
+
+
+def _pack(values, typecode):
+    packed = array(typecode, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data, typecode):
+    unpacked = array(typecode)
+    unpacked.frombytes(bytes(data))
+    if sys.byteorder != "little":
+        unpacked.byteswap()
+    return unpacked
+
+
+def artist_identifier(artist):
+    return artist.get("mbid") or artist.get("name", "").lower()
+
+
+def artist_url(name):
+    return ARTIST_URL + quote_plus(name)
+
+
+def encode_payload(payload, artists):
+    ids, plays = [], []
+    names, urls = {}, {}
+    for index, artist in enumerate(payload):
+        artist_id, stored_name = artists[artist_identifier(artist)]
+        name = artist.get("name") or ""
+        ids.append(artist_id)
+        plays.append(int(artist.get("playcount", 0)))
+        if name != stored_name:
+            names[str(index)] = name
+        if artist.get("url") != artist_url(name):
+            urls[str(index)] = artist.get("url")
+    extra = {field: values for field, values in (("names", names), ("urls", urls)) if values}
+    return {"payload_ids": _pack(ids, "i"), "payload_plays": _pack(plays, "I"), "payload_extra": extra or None}
+
+
+def decode_payload(artist_ids, plays, extra, artists):
+    names = (extra or {}).get("names", {})
+    urls = (extra or {}).get("urls", {})
+    payload = []
+    for index, (artist_id, playcount) in enumerate(zip(artist_ids, _unpack(plays, "I"))):
+        key, stored_name = artists[artist_id]
+        name = names.get(str(index), stored_name)
+        payload.append(
+            {
+                "name": name,
+                "mbid": "" if key == name.lower() else key,
+                "playcount": playcount,
+                "url": urls.get(str(index), artist_url(name)),
+            }
+        )
+    return payload
+
+
+def pack_payloads(apps, schema_editor):
+    Artist = apps.get_model("matchmaker", "Artist")
+    TopArtistSnapshot = apps.get_model("matchmaker", "TopArtistSnapshot")
+    for snapshot in TopArtistSnapshot.objects.exclude(payload__isnull=True).iterator():
+        payload = snapshot.payload or []
+        names = {}
+        for artist in payload:
+            key = artist_identifier(artist)
+            names.setdefault(key, artist.get("name") or key)
+        Artist.objects.bulk_create(
+            [Artist(key=key, name=name) for key, name in names.items()], ignore_conflicts=True
+        )
+        artists = {
+            key: (pk, name) for key, pk, name in Artist.objects.filter(key__in=names).values_list("key", "id", "name")
+        }
+        # update() so fetched_at (auto_now) keeps its value.
+        TopArtistSnapshot.objects.filter(pk=snapshot.pk).update(**encode_payload(payload, artists))
+
+
+def unpack_payloads(apps, schema_editor):
+    Artist = apps.get_model("matchmaker", "Artist")
+    TopArtistSnapshot = apps.get_model("matchmaker", "TopArtistSnapshot")
+    for snapshot in TopArtistSnapshot.objects.iterator():
+        ids = _unpack(snapshot.payload_ids, "i")
+        artists = {pk: (key, name) for pk, key, name in Artist.objects.filter(id__in=set(ids)).values_list("id", "key", "name")}
+        payload = decode_payload(ids, snapshot.payload_plays, snapshot.payload_extra, artists)
+        TopArtistSnapshot.objects.filter(pk=snapshot.pk).update(payload=payload)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matchmaker", "0006_matchrequest_timings"),
+    ]
+
+    operations = [
+        # Nullable first, so unapplying the removal below can re-add the column.
+        migrations.AlterField(
+            model_name="topartistsnapshot",
+            name="payload",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="payload_ids",
+            field=models.BinaryField(default=b"", editable=False),
+        ),
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="payload_plays",
+            field=models.BinaryField(default=b"", editable=False),
+        ),
+        migrations.AddField(
+            model_name="topartistsnapshot",
+            name="payload_extra",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(pack_payloads, unpack_payloads),
+        migrations.RemoveField(
+            model_name="topartistsnapshot",
+            name="payload",
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+def consolidate_snapshots(apps, schema_editor):
+    """Keep one snapshot per user and period: the largest, then the most recent."""
+    TopArtistSnapshot = apps.get_model("matchmaker", "TopArtistSnapshot")
+    kept = set()
+    duplicates = []
+    rows = TopArtistSnapshot.objects.order_by("user_id", "period", "-limit", "-fetched_at").values_list(
+        "pk", "user_id", "period"
+    )
+    for pk, user_id, period in rows.iterator():
+        if (user_id, period) in kept:
+            duplicates.append(pk)
+        else:
+            kept.add((user_id, period))
+    for start in range(0, len(duplicates), 500):
+        TopArtistSnapshot.objects.filter(pk__in=duplicates[start : start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matchmaker", "0007_snapshot_packed_payload"),
+    ]
+
+    operations = [
+        migrations.RunPython(consolidate_snapshots, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name="topartistsnapshot",
+            name="unique_snapshot_per_user_period_limit",
+        ),
+        migrations.AddConstraint(
+            model_name="topartistsnapshot",
+            constraint=models.UniqueConstraint(fields=("user", "period"), name="unique_snapshot_per_user_period"),
+        ),
+    ]
@@ -1,4 +1,6 @@
 import uuid
+from typing import Dict, Iterable, List, Optional
+
 from django.db import models
 from django.utils import timezone
 
@@ -15,6 +17,9 @@ STATUS_CHOICES = [
     ("FAILED", "Failed"),
 ]
 
+# Columns behind TopArtistSnapshot.payload; deferred when only vectors are needed.
+PAYLOAD_FIELDS = ["payload_ids", "payload_plays", "payload_extra"]
+
 
 class LastfmUser(models.Model):
     username = models.CharField(max_length=50, unique=True, db_index=True)
@@ -28,28 +33,103 @@ class LastfmUser(models.Model):
         return self.username
 
 
+class Artist(models.Model):
+    """Shared artist identity; ``key`` is the MBID or lowercased name."""
+
+    key = models.CharField(max_length=512, unique=True)
+    name = models.CharField(max_length=512)
+
+    def __str__(self) -> str:
+        return self.name
+
+
 class TopArtistSnapshot(models.Model):
     user = models.ForeignKey(
         LastfmUser, on_delete=models.CASCADE, related_name="artist_snapshots"
     )
     period = models.CharField(max_length=20, choices=PERIOD_CHOICES)
     limit = models.PositiveIntegerField()
-    payload = models.JSONField()
+    # The top-artists payload, packed by services.vectors.encode_payload:
+    # Artist ids and playcounts in rank order, plus the names and urls that
+    # differ from the Artist row's. Read and write it through ``payload``.
+    payload_ids = models.BinaryField(default=b"", editable=False)
+    payload_plays = models.BinaryField(default=b"", editable=False)
+    payload_extra = models.JSONField(null=True, blank=True, editable=False)
+    # Precomputed taste vector (see services.vectors): packed Artist ids and
+    # float32 log-playcount weights in rank order, plus the vector's L2 norm.
+    vector_ids = models.BinaryField(null=True, editable=False)
+    vector_weights = models.BinaryField(null=True, editable=False)
+    vector_norm = models.FloatField(null=True, editable=False)
     fetched_at = models.DateTimeField(auto_now=True)
+    # Last full download; in between, refreshes patch the payload (services.delta).
+    full_fetched_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(
-                fields=["user", "period", "limit"],
-                name="unique_snapshot_per_user_period_limit",
-            )
+            # One snapshot per user and period, holding the largest ``limit``
+            # requested so far; smaller requests are served from its head.
+            models.UniqueConstraint(fields=["user", "period"], name="unique_snapshot_per_user_period")
+        ]
+        indexes = [
+            # Freshness lookups per user and period.
+            models.Index(fields=["user", "period", "fetched_at"], name="snapshot_user_period_fetch_idx"),
+            # Similarity index builds and overlays scan recent snapshots.
+            models.Index(fields=["limit", "fetched_at"], name="snapshot_limit_fetched_idx"),
         ]
 
+    # Decoded payload, and whether it changed since the packed fields were set.
+    _payload: Optional[List[Dict]] = None
+    payload_pending = False
+
+    @property
+    def payload(self) -> List[Dict]:
+        """Top artists as the Last.fm client returns them, decoded on first access."""
+        if self._payload is None:
+            from .services.snapshots import load_payloads  # services import the models
+
+            load_payloads([self])
+        return self._payload
+
+    @payload.setter
+    def payload(self, value: Iterable[Dict]) -> None:
+        self._payload = list(value)
+        self.payload_pending = True
+
+    @property
+    def payload_loaded(self) -> bool:
+        return self._payload is not None
+
+    def save(self, *args, **kwargs):
+        if self.payload_pending:
+            from .services.snapshots import encode_snapshots
+
+            encode_snapshots([self], with_vectors=False)
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        fields = kwargs.get("fields")
+        if fields is None or set(fields) & set(PAYLOAD_FIELDS):
+            self._payload = None
+            self.payload_pending = False
+
+    def covers(self, limit: int) -> bool:
+        """Whether the first ``limit`` artists can be served from this snapshot."""
+        return self.limit >= limit
+
     def is_fresh(self, ttl_hours: int = 12) -> bool:
         if not self.fetched_at:
             return False
         return self.fetched_at >= timezone.now() - timezone.timedelta(hours=ttl_hours)
 
+    def freshness(self, ttl_hours: int = 12, hard_ttl_hours: int = 72) -> str:
+        """"fresh" within the soft TTL, "stale" up to the hard TTL, else "expired"."""
+        if self.is_fresh(ttl_hours=ttl_hours):
+            return "fresh"
+        if self.is_fresh(ttl_hours=hard_ttl_hours):
+            return "stale"
+        return "expired"
+
     def __str__(self) -> str:
         return f"{self.user.username} {self.period} (limit {self.limit})"
 
@@ -66,8 +146,30 @@ class MatchRequest(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
     error_message = models.TextField(blank=True)
     result = models.JSONField(null=True, blank=True)
+    # Per-stage milliseconds of the run that produced ``result`` (services.metrics.StageTimer).
+    timings = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="match_status_created_idx"),
+        ]
+
     def __str__(self) -> str:
         return f"{self.user_a.username} vs {self.user_b.username}"
+
+
+class GroupMatchRequest(models.Model):
+    """Pairwise compatibility for a group of 2-50 users, computed in one task."""
+
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usernames = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
+    error_message = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return ", ".join(self.usernames)
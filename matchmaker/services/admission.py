@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, MatchRequest
+
+from .ratelimit import get_rate_limiter
+
+PREFIX = "matchmaker:submit:"
+
+
+def client_address(request: HttpRequest) -> str:
+    """
+    The submitting client's IP address.
+
+    Behind ``TRUSTED_PROXY_COUNT`` reverse proxies it is read from that far
+    from the right of ``X-Forwarded-For``; entries further left are
+    client-supplied and not trusted.
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
+    forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+    if proxies and forwarded:
+        return forwarded[-min(proxies, len(forwarded))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _window(client: str, now: float):
+    window = settings.MATCH_SUBMIT_WINDOW_SECONDS
+    return f"{PREFIX}{client}:{int(now // window)}", window - now % window
+
+
+def submission_retry_after(client: str, clock=time.time) -> Optional[float]:
+    """
+    Seconds until ``client`` may queue work again, or None if it may now.
+
+    Clients get ``MATCH_SUBMIT_LIMIT`` queued submissions per
+    ``MATCH_SUBMIT_WINDOW_SECONDS``, counted by ``count_submission`` in
+    fixed windows in the shared cache. Only reads the counter, so it can run
+    before a submission touches the database.
+    """
+    limit = settings.MATCH_SUBMIT_LIMIT
+    if limit <= 0:
+        return None
+    key, remaining = _window(client, clock())
+    return remaining if (cache.get(key) or 0) >= limit else None
+
+
+def count_submission(client: str, clock=time.time) -> None:
+    """Count one submission that queued work for ``client``."""
+    if settings.MATCH_SUBMIT_LIMIT <= 0:
+        return
+    key, _ = _window(client, clock())
+    cache.add(key, 0, timeout=int(settings.MATCH_SUBMIT_WINDOW_SECONDS) + 1)
+    try:
+        cache.incr(key)
+    except ValueError:  # expired in between
+        cache.add(key, 1, timeout=int(settings.MATCH_SUBMIT_WINDOW_SECONDS) + 1)
+
+
+def pending_match(user_a: LastfmUser, user_b: LastfmUser) -> Optional[MatchRequest]:
+    """
+    A PENDING match for the same pair, to hand out instead of queueing another.
+
+    Only matches created within ``MATCH_DEDUPE_SECONDS`` count, so one whose
+    task was lost does not capture the pair for good.
+    """
+    window = settings.MATCH_DEDUPE_SECONDS
+    if window <= 0:
+        return None
+    since = timezone.now() - timezone.timedelta(seconds=window)
+    return (
+        MatchRequest.objects.filter(user_a=user_a, user_b=user_b, status="PENDING", created_at__gte=since)
+        .order_by("-created_at")
+        .first()
+    )
+
+
+def quota_tight() -> bool:
+    """
+    Whether Last.fm quota should be left to interactive matches.
+
+    True while the shared rate limiter holds less than
+    ``LASTFM_BACKGROUND_MIN_QUOTA`` of its capacity (or is paused by a
+    ``Retry-After``); background refreshes then step aside.
+    """
+    return get_rate_limiter().available() < settings.LASTFM_BACKGROUND_MIN_QUOTA
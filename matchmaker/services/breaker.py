@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "matchmaker:breaker:"
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker per call name, held in the Django cache.
+
+    ``failure_threshold`` consecutive failures open the circuit: calls are
+    refused with CircuitOpenError for ``cooldown`` seconds. After that the
+    circuit is half-open and a single caller, picked with ``cache.add``, is
+    let through as a probe; its success closes the circuit and its failure
+    opens it again. With a shared cache (Redis) every process sees the same
+    state; a threshold of 0 disables the breaker.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        cooldown: float,
+        probe_timeout: float = 30.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self._clock = clock
+
+    @staticmethod
+    def _keys(name: str):
+        return PREFIX + name + ":open_until", PREFIX + name + ":failures", PREFIX + name + ":probe"
+
+    def before(self, name: str) -> bool:
+        """
+        Raise CircuitOpenError unless a call may go ahead.
+
+        Returns whether the call's outcome has to be recorded, so that calls
+        in a healthy closed circuit cost one cache read and nothing else.
+        """
+        if self.failure_threshold <= 0:
+            return False
+        open_key, failures_key, probe_key = self._keys(name)
+        state = cache.get_many([open_key, failures_key])
+        opened_until = state.get(open_key)
+        if opened_until is None:
+            return bool(state.get(failures_key))
+        remaining = opened_until - self._clock()
+        if remaining > 0:
+            raise CircuitOpenError(name, remaining)
+        if not cache.add(probe_key, 1, timeout=self.probe_timeout):
+            raise CircuitOpenError(name, self.probe_timeout)
+        return True
+
+    def success(self, name: str) -> None:
+        open_key, failures_key, probe_key = self._keys(name)
+        if cache.get(open_key) is not None:
+            logger.info("Circuit for %s closed", name)
+        cache.delete_many([open_key, failures_key, probe_key])
+
+    def failure(self, name: str) -> None:
+        if self.failure_threshold <= 0:
+            return
+        open_key, failures_key, probe_key = self._keys(name)
+        cache.add(failures_key, 0, timeout=max(self.cooldown * 10, 600))
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:  # expired in between
+            failures = 1
+        if failures < self.failure_threshold and cache.get(open_key) is None:
+            return
+        # Kept past the cooldown so the half-open state stays visible.
+        cache.set(open_key, self._clock() + self.cooldown, timeout=self.cooldown + 3600)
+        cache.delete_many([failures_key, probe_key])
+        metrics.incr("lastfm_circuit_opened_total", method=name)
+        logger.warning("Circuit for %s opened for %ss after %s failures", name, self.cooldown, failures)
+
+    def state(self, name: str) -> str:
+        opened_until = cache.get(self._keys(name)[0])
+        if opened_until is None:
+            return CLOSED
+        return OPEN if opened_until > self._clock() else HALF_OPEN
+
+    def states(self, names: Iterable[str]) -> Dict[str, str]:
+        """State per name, read in one cache round trip."""
+        names = list(names)
+        keys = {self._keys(name)[0]: name for name in names}
+        opened = cache.get_many(list(keys))
+        now = self._clock()
+        states = {name: CLOSED for name in names}
+        for key, opened_until in opened.items():
+            states[keys[key]] = OPEN if opened_until > now else HALF_OPEN
+        return states
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """The Last.fm breaker configured from settings; its state is shared through the cache."""
+    return CircuitBreaker(
+        failure_threshold=settings.LASTFM_BREAKER_FAILURES,
+        cooldown=settings.LASTFM_BREAKER_COOLDOWN_SECONDS,
+        probe_timeout=settings.LASTFM_CONNECT_TIMEOUT + settings.LASTFM_READ_TIMEOUT,
+    )
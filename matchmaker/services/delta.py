@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from collections import Counter
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from matchmaker.models import TopArtistSnapshot
+
+from .lastfm import artist_identifier
+
+# user.getRecentTracks returns at most 200 scrobbles per page.
+RECENT_TRACKS_PAGE = 200
+
+
+def can_refresh(snapshot: TopArtistSnapshot) -> bool:
+    """
+    Whether ``snapshot`` may be patched instead of downloaded again.
+
+    Only snapshots with a full download within ``LASTFM_FULL_REFRESH_HOURS``
+    and an update within ``LASTFM_DELTA_MAX_AGE_HOURS`` qualify; windowed
+    periods also need a chart longer than the head page that patches them.
+    Does not touch the payload, so it can be checked on deferred rows.
+    """
+    if snapshot.full_fetched_at is None or snapshot.fetched_at is None:
+        return False
+    now = timezone.now()
+    if snapshot.full_fetched_at < now - timezone.timedelta(hours=settings.LASTFM_FULL_REFRESH_HOURS):
+        return False
+    if snapshot.fetched_at < now - timezone.timedelta(hours=settings.LASTFM_DELTA_MAX_AGE_HOURS):
+        return False
+    return snapshot.period == "overall" or snapshot.limit > settings.LASTFM_DELTA_PAGE_SIZE
+
+
+def refresh(client, username: str, snapshot: TopArtistSnapshot) -> Optional[List[Dict]]:
+    """
+    The snapshot's payload brought up to date from a small Last.fm request.
+
+    Returns None when the change is too large to patch reliably; the caller
+    then downloads the full chart.
+    """
+    if snapshot.period == "overall":
+        since = int(snapshot.fetched_at.timestamp())
+        scrobbles, total = client.get_recent_tracks(username, since=since, limit=RECENT_TRACKS_PAGE)
+        if total > len(scrobbles):
+            return None  # more than one page of listening since the last sync
+        return merge_recent_plays(snapshot.payload, scrobbles, snapshot.limit)
+    head = client.get_top_artists(username, period=snapshot.period, limit=settings.LASTFM_DELTA_PAGE_SIZE)
+    return merge_head_page(
+        snapshot.payload, head, snapshot.limit, settings.LASTFM_DELTA_PAGE_SIZE, settings.LASTFM_DELTA_MAX_DRIFT
+    )
+
+
+def _ranked(artists: List[Dict], limit: int) -> List[Dict]:
+    # Stable, so artists with equal playcounts keep their Last.fm order.
+    return sorted(artists, key=lambda artist: artist["playcount"], reverse=True)[:limit]
+
+
+def merge_recent_plays(payload: List[Dict], scrobbles: List[Dict], limit: int) -> Optional[List[Dict]]:
+    """
+    Add newly scrobbled plays to an all-time chart.
+
+    All-time playcounts only grow, so charted artists get exact counts. An
+    unseen artist is appended while the chart is not full (the chart then
+    holds every artist ever played); in a full chart one is ignored unless
+    its new plays alone beat the lowest charted count, in which case its true
+    count is unknown and None (drift) is returned.
+    """
+    if not scrobbles:
+        return payload
+    merged = [dict(artist) for artist in payload]
+    by_key = {artist_identifier(artist): artist for artist in merged}
+    by_name = {(artist.get("name") or "").lower(): artist for artist in merged}
+    plays = Counter()
+    seen: Dict[str, Dict] = {}
+    for scrobble in scrobbles:
+        key = artist_identifier(scrobble)
+        plays[key] += 1
+        seen.setdefault(key, scrobble)
+
+    cutoff = merged[-1]["playcount"] if len(merged) >= limit else 0
+    for key, count in plays.items():
+        # Scrobbles and charts do not always agree on MBIDs; fall back to the name.
+        artist = by_key.get(key) or by_name.get((seen[key].get("name") or "").lower())
+        if artist is not None:
+            artist["playcount"] += count
+        elif len(payload) < limit:
+            scrobble = seen[key]
+            merged.append({"name": scrobble["name"], "mbid": scrobble.get("mbid") or "", "playcount": count, "url": ""})
+        elif count > cutoff:
+            return None
+    return _ranked(merged, limit)
+
+
+def merge_head_page(
+    payload: List[Dict], head: List[Dict], limit: int, page_size: int, max_drift: float
+) -> Optional[List[Dict]]:
+    """
+    Replace the top of a windowed chart with a freshly fetched head page.
+
+    The head has exact counts; the rest keeps its stored order with counts
+    capped at the head's lowest, since plays leave a sliding window as well
+    as enter it. Returns None (drift) when more than ``max_drift`` of the head
+    was not in the stored head, as the tail is then unlikely to hold.
+    """
+    if len(head) < page_size:
+        return head  # the whole chart fits in one page
+    stored_head = {artist_identifier(artist) for artist in payload[: len(head)]}
+    head_keys = {artist_identifier(artist) for artist in head}
+    if len(head_keys - stored_head) > max_drift * len(head):
+        return None
+    floor = head[-1]["playcount"]
+    tail = [
+        dict(artist, playcount=min(artist["playcount"], floor))
+        for artist in payload
+        if artist_identifier(artist) not in head_keys
+    ]
+    return (list(head) + tail)[:limit]
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .scoring import DEFAULT_TOP_K, PERIOD_WEIGHTS, PERIODS, ArtistVector, pick_source_period, score_vectors
+
+UserVectors = Dict[str, ArtistVector]
+
+
+def cosine_matrix(vectors: List[ArtistVector]) -> np.ndarray:
+    """
+    N x N cosine similarity of sparse vectors in one matrix product.
+
+    Rows are scattered into a dense matrix over the union of their artist ids,
+    which stays small for a group (at most N * limit columns).
+    """
+    n = len(vectors)
+    lengths = [len(vec) for vec in vectors]
+    if not sum(lengths):
+        return np.zeros((n, n))
+    ids = np.concatenate([np.asarray(vec.ids, dtype=np.int64) for vec in vectors if len(vec)])
+    columns, inverse = np.unique(ids, return_inverse=True)
+    rows = np.repeat(np.arange(n), lengths)
+    weights = np.concatenate([np.asarray(vec.weights, dtype=np.float64) for vec in vectors if len(vec)])
+
+    norms = np.array([vec.norm if len(vec) else 0.0 for vec in vectors])
+    scale = np.divide(1.0, norms, out=np.zeros(n), where=norms > 0)
+    dense = np.zeros((n, len(columns)))
+    dense[rows, inverse] = weights * scale[rows]
+    return dense @ dense.T
+
+
+def score_group(
+    usernames: List[str],
+    vectors: Dict[str, UserVectors],
+    names: Callable[[List[int]], Dict[int, str]],
+    top_k: int = DEFAULT_TOP_K,
+    source_period: Optional[str] = None,
+) -> Dict:
+    """
+    Pairwise match results for a group, same semantics as ``compute_match``.
+
+    Per-period cosines for every pair come from one matrix product; overlap
+    and recommendations are then picked per pair from the loaded vectors.
+    """
+    empty = ArtistVector()
+    n = len(usernames)
+    period_scores = {
+        p: np.round(cosine_matrix([vectors[u].get(p, empty) for u in usernames]), 4) for p in PERIODS
+    }
+    final = sum(PERIOD_WEIGHTS[p] * period_scores[p] for p in PERIODS)
+
+    pairs = []
+    for i in range(n):
+        vectors_a = vectors[usernames[i]]
+        source = pick_source_period(lambda p: bool(vectors_a.get(p)), source_period)
+        for j in range(i + 1, n):
+            scores = {p: float(period_scores[p][i, j]) for p in PERIODS}
+            result = score_vectors(vectors_a, vectors[usernames[j]], source, names, scores=scores, top_k=top_k)
+            pairs.append({"user_a": usernames[i], "user_b": usernames[j], **result})
+    pairs.sort(key=lambda pair: pair["final_score"], reverse=True)
+
+    matrix = np.round(final * 100, 1)
+    np.fill_diagonal(matrix, 100.0)
+    return {
+        "usernames": usernames,
+        "matrix": matrix.tolist(),
+        "pairs": pairs,
+    }
+
+
+def cached_names(resolve: Callable[[List[int]], Dict[int, str]]) -> Callable[[List[int]], Dict[int, str]]:
+    """Wrap a name resolver so each artist id is looked up at most once."""
+    known: Dict[int, str] = {}
+
+    def names(artist_ids: List[int]) -> Dict[int, str]:
+        missing = [artist_id for artist_id in artist_ids if artist_id not in known]
+        if missing:
+            known.update(dict.fromkeys(missing, ""))
+            known.update(resolve(missing))
+        return {artist_id: known[artist_id] for artist_id in artist_ids}
+
+    return names
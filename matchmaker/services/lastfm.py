@@ -1,15 +1,32 @@
 from __future__ import annotations
 
+import asyncio
 import math
+import threading
 import time
-from typing import Dict, List, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import partial
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
+import httpx
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
 from django.utils import timezone
 
 from matchmaker.models import LastfmUser, TopArtistSnapshot
 
-LASTFM_BASE_URL = "https://ws.audioscrobbler.com/2.0/"
+from . import metrics, transport
+from .breaker import OPEN, CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from .ratelimit import TokenBucket, get_rate_limiter
+from .singleflight import FetchLease, SingleFlight
+from .snapshots import encode_snapshots, load_payloads, load_snapshots, load_users, save_snapshots, save_users
 
 
 class LastfmError(Exception):
@@ -20,7 +37,49 @@ class LastfmError(Exception):
 
 
 class LastfmRateLimitError(LastfmError):
-    pass
+    def __init__(self, code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(code, message)
+        self.retry_after = retry_after
+
+
+class LastfmUnavailableError(LastfmError):
+    """Refused without a request because the method's circuit breaker is open."""
+
+    def __init__(self, code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(code, message)
+        self.retry_after = retry_after
+
+
+# Last.fm reports "Rate limit exceeded" as API error 29.
+RATE_LIMIT_ERROR_CODES = {29, 429}
+# "Operation failed", "Service Offline" and "Temporary error processing".
+OUTAGE_ERROR_CODES = {8, 11, 16}
+
+
+def is_outage(exc: Exception) -> bool:
+    """Whether an error says Last.fm is down rather than the request being wrong."""
+    if isinstance(exc, LastfmRateLimitError):
+        return False
+    if isinstance(exc, LastfmError):
+        return exc.code in OUTAGE_ERROR_CODES
+    if isinstance(exc, (requests.HTTPError, httpx.HTTPStatusError)):
+        return exc.response is None or exc.response.status_code >= 500
+    return isinstance(exc, (requests.RequestException, httpx.TransportError, ValueError))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a ``Retry-After`` header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - timezone.now()).total_seconds())
 
 
 def artist_identifier(artist: Dict) -> str:
@@ -30,33 +89,118 @@ def artist_identifier(artist: Dict) -> str:
     return artist.get("name", "").lower()
 
 
-class LastfmClient:
-    def __init__(self, api_key: str, session: Optional[requests.Session] = None):
+class _LastfmClientBase:
+    """Request building and response/error mapping shared by both clients."""
+
+    def __init__(
+        self,
+        api_key: str,
+        rate_limiter: Optional[TokenBucket] = None,
+        base_url: Optional[str] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
         self.api_key = api_key
-        self.session = session or requests.Session()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter()
+        self.base_url = base_url or settings.LASTFM_BASE_URL
+        self.breaker = breaker if breaker is not None else get_circuit_breaker()
 
-    def _request(self, params: Dict) -> Dict:
-        params = {**params, "api_key": self.api_key, "format": "json"}
-        response = self.session.get(LASTFM_BASE_URL, params=params, timeout=15)
-        if response.status_code == 429:
-            raise LastfmRateLimitError(429, "Rate limited by Last.fm")
-        response.raise_for_status()
-        data = response.json()
+    def _params(self, params: Dict) -> Dict:
+        return {**params, "api_key": self.api_key, "format": "json"}
+
+    def _exhausted(self, method: str) -> LastfmRateLimitError:
+        # Waiting longer would only tie up the worker; let the caller reschedule.
+        metrics.incr("lastfm_requests_total", method=method, outcome="throttled")
+        return LastfmRateLimitError(
+            429, "Client-side Last.fm rate limit exhausted", retry_after=self.rate_limiter.delay()
+        )
+
+    def _before(self, method: str) -> bool:
+        """Fail fast while the method's circuit is open; whether to record the outcome."""
+        try:
+            return self.breaker.before(method)
+        except CircuitOpenError as exc:
+            metrics.incr("lastfm_requests_total", method=method, outcome="circuit_open")
+            raise LastfmUnavailableError(
+                503, f"Last.fm {method} is unavailable", retry_after=exc.retry_after
+            ) from None
+
+    def _after(self, method: str, record: bool, exc: Optional[BaseException] = None) -> None:
+        """
+        Feed the method's circuit the outcome of a call.
+
+        Only outages (5xx, network errors, Last.fm's own outage codes) count
+        as failures; rate limits say nothing about Last.fm's health.
+        """
+        if exc is not None and is_outage(exc):
+            self.breaker.failure(method)
+        elif record and not isinstance(exc, LastfmRateLimitError):
+            self.breaker.success(method)
+
+    @contextmanager
+    def _guard(self, method: str) -> Iterator[None]:
+        record = self._before(method)
+        try:
+            yield
+        except Exception as exc:
+            self._after(method, record, exc)
+            raise
+        self._after(method, record)
+
+    @staticmethod
+    def _record_wait(seconds: float) -> None:
+        if seconds > 0.001:
+            metrics.observe("lastfm_rate_limit_wait_seconds", seconds)
+
+    @staticmethod
+    def _observe(method: str, started: float, exc: Optional[BaseException] = None) -> None:
+        """Count and time one API call by outcome."""
+        if exc is None:
+            outcome = "ok"
+        elif isinstance(exc, LastfmRateLimitError):
+            outcome = "rate_limited"
+        elif isinstance(exc, LastfmError):
+            outcome = "error"
+        else:
+            outcome = "http_error"
+        metrics.incr("lastfm_requests_total", method=method, outcome=outcome)
+        metrics.observe("lastfm_request_seconds", time.perf_counter() - started, method=method)
+
+    @contextmanager
+    def _measure(self, method: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            self._observe(method, started, exc)
+            raise
+        self._observe(method, started)
+
+    def _rate_limited(self, headers) -> LastfmRateLimitError:
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after:
+            self.rate_limiter.pause(retry_after)
+        return LastfmRateLimitError(429, "Rate limited by Last.fm", retry_after=retry_after)
+
+    @staticmethod
+    def _check(data: Dict) -> Dict:
         if "error" in data:
             code = data.get("error", -1)
             message = data.get("message", "Unknown error")
-            if code == 429:
+            if code in RATE_LIMIT_ERROR_CODES:
                 raise LastfmRateLimitError(code, message)
             raise LastfmError(code, message)
         return data
 
-    def get_user_info(self, username: str) -> Dict:
-        return self._request({"method": "user.getInfo", "user": username}).get("user", {})
+    @staticmethod
+    def _user_info_params(username: str) -> Dict:
+        return {"method": "user.getInfo", "user": username}
 
-    def get_top_artists(self, username: str, period: str, limit: int = 300) -> List[Dict]:
-        data = self._request(
-            {"method": "user.getTopArtists", "user": username, "period": period, "limit": limit}
-        )
+    @staticmethod
+    def _top_artists_params(username: str, period: str, limit: int) -> Dict:
+        return {"method": "user.getTopArtists", "user": username, "period": period, "limit": limit}
+
+    @staticmethod
+    def _trim_top_artists(data: Dict) -> List[Dict]:
         artists = data.get("topartists", {}).get("artist", [])
         trimmed = []
         for artist in artists:
@@ -70,15 +214,223 @@ class LastfmClient:
             )
         return trimmed
 
+    @staticmethod
+    def _recent_tracks_params(username: str, since: int, limit: int) -> Dict:
+        return {"method": "user.getRecentTracks", "user": username, "from": since, "limit": limit}
+
+    @staticmethod
+    def _trim_recent_tracks(data: Dict) -> Tuple[List[Dict], int]:
+        recent = data.get("recenttracks", {})
+        tracks = recent.get("track", [])
+        if isinstance(tracks, dict):  # a single track is not wrapped in a list
+            tracks = [tracks]
+        scrobbles = []
+        for track in tracks:
+            if track.get("@attr", {}).get("nowplaying"):
+                continue  # not scrobbled yet
+            artist = track.get("artist") or {}
+            scrobbles.append({"name": artist.get("#text") or artist.get("name"), "mbid": artist.get("mbid")})
+        total = int(recent.get("@attr", {}).get("total") or len(scrobbles))
+        return scrobbles, total
+
+
+class LastfmClient(_LastfmClientBase):
+    """
+    Blocking client on a process-wide pooled ``requests`` session.
 
-def get_or_fetch_user(client: LastfmClient, username: str, ttl_hours: int = 24) -> LastfmUser:
-    user, _ = LastfmUser.objects.get_or_create(username=username)
-    if user.last_synced_at and user.last_synced_at >= timezone.now() - timezone.timedelta(
-        hours=ttl_hours
+    Clients are cheap to create; connections are kept alive in the shared
+    session (see services.transport) rather than per client.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        session: Optional[requests.Session] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        base_url: Optional[str] = None,
+        breaker: Optional[CircuitBreaker] = None,
     ):
-        return user
+        super().__init__(api_key, rate_limiter=rate_limiter, base_url=base_url, breaker=breaker)
+        self.session = session or transport.get_session()
+
+    def _request(self, params: Dict) -> Dict:
+        method = params["method"]
+        with self._guard(method):
+            started = time.perf_counter()
+            acquired = self.rate_limiter.acquire(max_wait=settings.LASTFM_RATE_LIMIT_MAX_WAIT)
+            self._record_wait(time.perf_counter() - started)
+            if not acquired:
+                raise self._exhausted(method)
+            with self._measure(method):
+                response = self.session.get(self.base_url, params=self._params(params), timeout=transport.timeouts())
+                if response.status_code == 429:
+                    raise self._rate_limited(response.headers)
+                response.raise_for_status()
+                return self._check(response.json())
+
+    def get_user_info(self, username: str) -> Dict:
+        return self._request(self._user_info_params(username)).get("user", {})
+
+    def get_top_artists(self, username: str, period: str, limit: int = 300) -> List[Dict]:
+        return self._trim_top_artists(self._request(self._top_artists_params(username, period, limit)))
+
+    def get_recent_tracks(self, username: str, since: int, limit: int = 200) -> Tuple[List[Dict], int]:
+        """Artists of the first ``limit`` scrobbles since the Unix time ``since``, and the total count."""
+        return self._trim_recent_tracks(self._request(self._recent_tracks_params(username, since, limit)))
+
+
+class AsyncLastfmClient(_LastfmClientBase):
+    """
+    asyncio counterpart of LastfmClient on a shared httpx connection pool.
+
+    Same methods and errors; rate-limit waits are awaited instead of slept,
+    and breaker, limiter and metrics updates run via ``sync_to_async``.
+    HTTP/2 is used when ``LASTFM_HTTP2`` is set and ``h2`` is installed.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        client: Optional[httpx.AsyncClient] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        base_url: Optional[str] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        super().__init__(api_key, rate_limiter=rate_limiter, base_url=base_url, breaker=breaker)
+        self.client = client
+
+    def _admit(self, method: str) -> Tuple[bool, float]:
+        """The breaker check and a rate-limit reservation: ``(record, wait)``."""
+        record = self._before(method)
+        try:
+            wait = self.rate_limiter.reserve(max_wait=settings.LASTFM_RATE_LIMIT_MAX_WAIT)
+            if wait is None:
+                raise self._exhausted(method)
+        except Exception as exc:
+            self._after(method, record, exc)
+            raise
+        self._record_wait(wait)
+        return record, wait
+
+    def _settle(self, method: str, record: bool, started: float, exc: Optional[BaseException] = None) -> None:
+        self._observe(method, started, exc)
+        self._after(method, record, exc)
+
+    async def _request(self, params: Dict) -> Dict:
+        # Breaker, limiter and metrics state live in the cache (or Redis);
+        # their blocking calls run off the event loop.
+        method = params["method"]
+        record, wait = await sync_to_async(self._admit)(method)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        client = self.client or transport.get_async_client()
+        started = time.perf_counter()
+        try:
+            response = await client.get(self.base_url, params=self._params(params))
+            if response.status_code == 429:
+                raise await sync_to_async(self._rate_limited)(response.headers)
+            response.raise_for_status()
+            data = self._check(response.json())
+        except Exception as exc:
+            await sync_to_async(self._settle)(method, record, started, exc)
+            raise
+        await sync_to_async(self._settle)(method, record, started)
+        return data
+
+    async def get_user_info(self, username: str) -> Dict:
+        return (await self._request(self._user_info_params(username))).get("user", {})
+
+    async def get_top_artists(self, username: str, period: str, limit: int = 300) -> List[Dict]:
+        return self._trim_top_artists(await self._request(self._top_artists_params(username, period, limit)))
+
+    async def get_recent_tracks(self, username: str, since: int, limit: int = 200) -> Tuple[List[Dict], int]:
+        return self._trim_recent_tracks(await self._request(self._recent_tracks_params(username, since, limit)))
+
+
+def _unavailable_methods() -> Set[str]:
+    """Last.fm methods whose circuit is open: expired data is served stale rather than refetched."""
+    states = get_circuit_breaker().states(metrics.LASTFM_METHODS)
+    return {method for method, state in states.items() if state == OPEN}
+
+
+def _user_is_fresh(user: LastfmUser, ttl_hours: int) -> bool:
+    return bool(
+        user.last_synced_at
+        and user.last_synced_at >= timezone.now() - timezone.timedelta(hours=ttl_hours)
+    )
+
+
+def _user_freshness(user: LastfmUser, ttl_hours: int, hard_ttl_hours: int) -> str:
+    if _user_is_fresh(user, ttl_hours):
+        return "fresh"
+    if _user_is_fresh(user, hard_ttl_hours):
+        return "stale"
+    return "expired"
+
+
+def marker_key(key: Tuple) -> Tuple:
+    """
+    The part of a miss key that cache markers go by.
+
+    There is one snapshot per user and period whatever its size, so top-artist
+    markers leave the limit out: a warmer refresh of a 500-artist snapshot
+    and a 300-artist lookup of it share their markers.
+    """
+    return key[:3] if key[0] == "top" else key
+
+
+def cache_marker(kind: str, key: Tuple) -> str:
+    """Cache key flagging a miss key, e.g. ``refresh`` while a refresh is queued."""
+    return f"matchmaker:{kind}:" + ":".join(str(part) for part in marker_key(key))
+
+
+def claim_refresh(key: Tuple) -> bool:
+    """True for the first caller to schedule a refresh of ``key`` in the next 5 minutes."""
+    return cache.add(cache_marker("refresh", key), 1, timeout=300)
+
+
+def refresh_pending(stale: Iterable[Tuple[str, str]], limit: int) -> bool:
+    """Whether a refresh is queued for any ``(username, period)`` entry fetch_match_data served stale."""
+    keys = [
+        cache_marker("refresh", ("info", username) if period == "info" else ("top", username, period, limit))
+        for username, period in stale
+    ]
+    return bool(keys) and bool(cache.get_many(keys))
+
+
+def _refresh_in_thread(task, args: Tuple) -> None:
+    def run() -> None:
+        try:
+            task.apply(args=args)
+        finally:
+            connections.close_all()  # this thread's own connections
+
+    threading.Thread(target=run, name=f"refresh-{task.name}", daemon=True).start()
+
 
-    info = client.get_user_info(username)
+def _enqueue_refresh(key: Tuple) -> None:
+    """
+    Queue a background refresh for a stale cache entry, once per key.
+
+    When Celery runs tasks eagerly, ``delay`` would refresh inline and cost
+    the caller the round trip that serving stale data saves, so the task
+    runs on a thread of its own instead.
+    """
+    from matchmaker import tasks  # tasks import this module
+
+    if not claim_refresh(key):
+        return
+    if key[0] == "info":
+        task, args = tasks.refresh_user, (key[1],)
+    else:
+        task, args = tasks.refresh_top_artists, key[1:]
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        transaction.on_commit(lambda: _refresh_in_thread(task, args))
+    else:
+        transaction.on_commit(lambda: task.delay(*args))
+
+
+def _apply_user_info(user: LastfmUser, info: Dict) -> None:
     user.playcount = int(info.get("playcount") or 0)
     user.realname = info.get("realname") or ""
     user.country = info.get("country") or ""
@@ -89,28 +441,472 @@ def get_or_fetch_user(client: LastfmClient, username: str, ttl_hours: int = 24)
         avatar = images[-1].get("#text") or ""
     user.avatar_url = avatar
     user.last_synced_at = timezone.now()
-    user.save()
-    return user
+
+
+class _Miss:
+    """A cache miss: how to fetch it, build its row, and re-check the cache for it."""
+
+    def __init__(
+        self,
+        key: Tuple,
+        fetch: Callable[[], object],
+        build: Callable[[object], Union[LastfmUser, TopArtistSnapshot]],
+        reload: Callable[[], Optional[object]],
+    ):
+        self.key = key
+        self.fetch = fetch
+        # build(value) applies the fetched value to an unsaved model instance;
+        # _fetch_and_store writes all of them in one batch.
+        self.build = build
+        # reload() returns the cached value if another process filled it.
+        self.reload = reload
+
+
+_flights = SingleFlight()
+# How long a single-flight follower waits for the leader's batch to be written.
+_STORE_WAIT_SECONDS = 30
+
+
+def _user_miss(client: LastfmClient, user: LastfmUser, ttl_hours: int) -> _Miss:
+    def build(info: Dict) -> LastfmUser:
+        _apply_user_info(user, info)
+        return user
+
+    def reload() -> Optional[LastfmUser]:
+        user.refresh_from_db()
+        return user if _user_is_fresh(user, ttl_hours) else None
+
+    return _Miss(
+        ("info", user.username),
+        lambda: client.get_user_info(user.username),
+        build,
+        reload,
+    )
+
+
+def _top_artists_miss(
+    client: LastfmClient,
+    user: LastfmUser,
+    period: str,
+    limit: int,
+    ttl_hours: int,
+    previous: Optional[TopArtistSnapshot] = None,
+) -> _Miss:
+    """
+    Miss for a top-artists snapshot covering ``limit``.
+
+    The stored snapshot is never shrunk: a ``previous`` one larger than
+    ``limit`` is refreshed at its own size, a smaller one is replaced by a
+    full chart of ``limit`` artists. When services.delta may patch
+    ``previous``, the fetch tries a small delta request first and falls
+    back to the full chart on drift. Its payload is decoded here unless
+    already loaded (see snapshots.load_payloads), since fetches run on
+    worker threads.
+    """
+    from . import delta  # delta imports this module
+
+    size = limit
+    if previous is not None:
+        size = max(limit, previous.limit)
+        if not previous.covers(limit) or not delta.can_refresh(previous):
+            previous = None
+    if previous is not None:
+        load_payloads([previous])
+
+    # The fetched value carries everything taken from ``previous``: a
+    # single-flight follower builds from it with its own, maybe None, previous.
+    def fetch() -> Tuple[List[Dict], int, Optional[datetime], Optional[Dict]]:
+        if previous is not None:
+            payload = delta.refresh(client, user.username, previous)
+            if payload is not None:
+                return payload, size, previous.full_fetched_at, previous.payload_artists
+        return client.get_top_artists(user.username, period=period, limit=size), size, None, None
+
+    def build(value: Tuple[List[Dict], int, Optional[datetime], Optional[Dict]]) -> TopArtistSnapshot:
+        payload, fetched_limit, full_fetched_at, known_artists = value
+        now = timezone.now()
+        snapshot = TopArtistSnapshot(
+            user=user,
+            period=period,
+            limit=fetched_limit,
+            payload=payload,
+            fetched_at=now,
+            full_fetched_at=full_fetched_at or now,
+        )
+        if known_artists is not None:
+            snapshot.known_artists = known_artists
+        return snapshot
+
+    def reload() -> Optional[TopArtistSnapshot]:
+        snapshot = TopArtistSnapshot.objects.filter(user=user, period=period).first()
+        return snapshot if snapshot and snapshot.covers(limit) and snapshot.is_fresh(ttl_hours=ttl_hours) else None
+
+    return _Miss(("top", user.username, period, limit), fetch, build, reload)
+
+
+def _fetch_and_store(
+    misses: List[_Miss], max_workers: int, on_fetched: Optional[Callable[[Tuple], None]] = None
+) -> Tuple[Dict, Dict]:
+    if not misses:
+        return {}, {}
+
+    def fetch(miss: _Miss):
+        # The leader's event is set once its batch is written, so followers
+        # can re-read the stored row instead of keeping an unsaved copy.
+        (value, stored), shared = _flights.do(miss.key, lambda: (miss.fetch(), threading.Event()))
+        if on_fetched is not None:
+            on_fetched(miss.key)
+        return value, shared, stored
+
+    fetched, errors = run_concurrently(
+        {miss.key: partial(fetch, miss) for miss in misses},
+        max_workers=max_workers,
+    )
+    results = {}
+    # Values another thread fetched (shared) are written by that thread.
+    written: List[Union[LastfmUser, TopArtistSnapshot]] = []
+    followed: List[Tuple[_Miss, threading.Event]] = []
+    leading: List[threading.Event] = []
+    for miss in misses:
+        if miss.key in fetched:
+            value, shared, stored = fetched[miss.key]
+            results[miss.key] = miss.build(value)
+            if shared:
+                followed.append((miss, stored))
+            else:
+                written.append(results[miss.key])
+                leading.append(stored)
+
+    # Our own rows are written before waiting on anyone else's, so two
+    # batches following each other cannot wait on one another.
+    try:
+        _store(written)
+    finally:
+        for stored in leading:
+            stored.set()
+
+    unsaved = []
+    for miss, stored in followed:
+        stored.wait(_STORE_WAIT_SECONDS)
+        row = miss.reload()
+        if row is None:
+            # The leader did not store it (it failed, or is still writing).
+            unsaved.append(results[miss.key])
+        else:
+            results[miss.key] = row
+    _store(unsaved)
+    return results, errors
+
+
+def _store(written: List[Union[LastfmUser, TopArtistSnapshot]]) -> None:
+    if not written:
+        return
+    snapshots = [obj for obj in written if isinstance(obj, TopArtistSnapshot)]
+    # One short write transaction per batch keeps SQLite lock hold times down.
+    with transaction.atomic():
+        encode_snapshots(snapshots)
+        save_users([obj for obj in written if isinstance(obj, LastfmUser)])
+        save_snapshots(snapshots)
+
+
+def fill_misses(
+    misses: List[_Miss], max_workers: int = 8, on_fetched: Optional[Callable[[Tuple], None]] = None
+) -> Dict[Tuple, object]:
+    """
+    Fetch and store cache misses once, however many callers want them.
+
+    Identical in-flight fetches in this process are coalesced through a
+    single-flight map. With ``LASTFM_FETCH_LEASE_SECONDS`` set, a lease in the
+    shared cache also makes other processes wait for the fetch and re-read
+    the stored result instead of calling Last.fm themselves.
+
+    ``on_fetched(key)`` is called from the fetching thread as each miss arrives.
+    """
+    lease_timeout = settings.LASTFM_FETCH_LEASE_SECONDS
+    leases: Dict[Tuple, FetchLease] = {}
+    waiting: List[Tuple[_Miss, FetchLease]] = []
+    ours: List[_Miss] = []
+    for miss in misses:
+        if lease_timeout:
+            lease = FetchLease(miss.key, lease_timeout)
+            if not lease.acquire():
+                waiting.append((miss, lease))
+                continue
+            leases[miss.key] = lease
+        ours.append(miss)
+
+    try:
+        results, errors = _fetch_and_store(ours, max_workers, on_fetched)
+    finally:
+        for lease in leases.values():
+            lease.release()
+
+    leftovers = []
+    for miss, lease in waiting:
+        lease.wait()
+        value = miss.reload()
+        if value is None:
+            leftovers.append(miss)
+        else:
+            results[miss.key] = value
+            if on_fetched is not None:
+                on_fetched(miss.key)
+    if leftovers:
+        more_results, more_errors = _fetch_and_store(leftovers, max_workers, on_fetched)
+        results.update(more_results)
+        errors.update(more_errors)
+
+    if errors:
+        raise next(iter(errors.values()))
+    return results
+
+
+def get_or_fetch_user(
+    client: LastfmClient,
+    username: str,
+    ttl_hours: int = 24,
+    hard_ttl_hours: Optional[int] = None,
+) -> LastfmUser:
+    """
+    Return the cached user, refreshing from Last.fm when needed.
+
+    Between ``ttl_hours`` and ``hard_ttl_hours`` the cached row is returned at
+    once with ``is_stale`` set and a background refresh is queued. While the
+    circuit breaker for ``user.getInfo`` is open, a synced user is returned
+    stale past the hard TTL as well.
+    """
+    if hard_ttl_hours is None:
+        hard_ttl_hours = settings.LASTFM_USER_HARD_TTL_HOURS
+    user = load_users([username])[username]
+    state = _user_freshness(user, ttl_hours, hard_ttl_hours)
+    _record_lookups(Counter({("profile", state): 1}))
+    user.is_stale = state == "stale"
+    if state == "stale":
+        _enqueue_refresh(("info", username))
+    if state != "expired":
+        return user
+    if user.last_synced_at and "user.getInfo" in _unavailable_methods():
+        user.is_stale = True
+        return user
+
+    return fill_misses([_user_miss(client, user, ttl_hours)])[("info", username)]
 
 
 def get_top_artists_with_cache(
-    client: LastfmClient, user: LastfmUser, period: str, limit: int = 300, ttl_hours: int = 12
+    client: LastfmClient,
+    user: LastfmUser,
+    period: str,
+    limit: int = 300,
+    ttl_hours: int = 12,
+    hard_ttl_hours: Optional[int] = None,
 ) -> List[Dict]:
+    """
+    Return the user's top ``limit`` artists, serving stale snapshots while they refresh.
+
+    Any stored snapshot at least ``limit`` long answers by its head. Only a
+    missing or smaller snapshot, or one past ``hard_ttl_hours``, blocks on
+    Last.fm, and the latter not while Last.fm's circuit breaker is open.
+    """
+    if hard_ttl_hours is None:
+        hard_ttl_hours = settings.LASTFM_SNAPSHOT_HARD_TTL_HOURS
+    snapshot = TopArtistSnapshot.objects.filter(user=user, period=period).first()
+    usable = snapshot is not None and snapshot.covers(limit)
+    state = snapshot.freshness(ttl_hours=ttl_hours, hard_ttl_hours=hard_ttl_hours) if usable else "expired"
+    key = ("top", user.username, period, limit)
+    _record_lookups(Counter({(period, state): 1}), [key] if state == "fresh" else [])
+    if state == "stale":
+        _enqueue_refresh(key)
+    if state != "expired" or (usable and "user.getTopArtists" in _unavailable_methods()):
+        return snapshot.payload[:limit]
+
+    miss = _top_artists_miss(client, user, period, limit, ttl_hours, previous=snapshot)
+    return fill_misses([miss])[miss.key].payload[:limit]
+
+
+def refresh_user(client: LastfmClient, user: LastfmUser) -> LastfmUser:
+    """Refetch a user's profile regardless of cache state."""
+    miss = _user_miss(client, user, ttl_hours=0)
+    return fill_misses([miss])[miss.key]
+
+
+def refresh_top_artists(
+    client: LastfmClient, user: LastfmUser, period: str, limit: int = 300
+) -> List[Dict]:
+    """Refresh and store a top-artists snapshot regardless of cache state."""
+    previous = TopArtistSnapshot.objects.filter(user=user, period=period).first()
+    miss = _top_artists_miss(client, user, period, limit, ttl_hours=0, previous=previous)
+    return fill_misses([miss])[miss.key].payload[:limit]
+
+
+def refresh_snapshots(
+    client: LastfmClient, snapshots: List[TopArtistSnapshot], ttl_hours: float = 0, max_workers: int = 8
+) -> Dict[Tuple, TopArtistSnapshot]:
+    """
+    Refresh stored snapshots in one batch, keyed like their misses.
+
+    Load the payloads (``snapshots.load_payloads``) of those services.delta
+    can patch first. A snapshot another process refreshed meanwhile is
+    reused if it is within ``ttl_hours``.
+    """
+    misses = [_top_artists_miss(client, s.user, s.period, s.limit, ttl_hours, previous=s) for s in snapshots]
+    return fill_misses(misses, max_workers=max_workers)
+
+
+def run_concurrently(
+    jobs: Dict[Hashable, Callable[[], object]], max_workers: int = 8
+) -> Tuple[Dict[Hashable, object], Dict[Hashable, Exception]]:
+    """
+    Run independent zero-argument callables on a bounded thread pool.
+
+    Returns ``(results, errors)`` keyed like ``jobs`` so callers can keep the
+    successful results even when some calls failed.
+    """
+    results: Dict[Hashable, object] = {}
+    errors: Dict[Hashable, Exception] = {}
+    if len(jobs) == 1:
+        # Not worth a pool; run the single call on the caller's thread.
+        [(key, fn)] = jobs.items()
+        try:
+            results[key] = fn()
+        except Exception as exc:
+            errors[key] = exc
+        return results, errors
+    if not jobs:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        futures = {key: pool.submit(fn) for key, fn in jobs.items()}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as exc:
+                errors[key] = exc
+    return results, errors
+
+
+def _record_lookups(states: Counter, fresh_keys: Iterable[Tuple] = ()) -> None:
+    """
+    Count cache outcomes, keyed ``(period, state)``, for TTL tuning.
+
+    A fresh hit on a snapshot the warmer refreshed (services.warmer) counts
+    once as a warm hit.
+    """
     try:
-        snapshot = TopArtistSnapshot.objects.get(user=user, period=period, limit=limit)
-        if snapshot.is_fresh(ttl_hours=ttl_hours):
-            return snapshot.payload
-    except TopArtistSnapshot.DoesNotExist:
-        snapshot = None
-
-    payload = client.get_top_artists(user.username, period=period, limit=limit)
-    TopArtistSnapshot.objects.update_or_create(
-        user=user,
-        period=period,
-        limit=limit,
-        defaults={"payload": payload, "fetched_at": timezone.now()},
+        markers = [cache_marker("warmed", key) for key in fresh_keys]
+        warmed = cache.get_many(markers) if markers else {}
+        if warmed:
+            cache.delete_many(list(warmed))
+    except Exception:  # metrics are best effort
+        warmed = {}
+    for (period, state), count in states.items():
+        metrics.incr("cache_lookups_total", count, period=period, state=state)
+    metrics.incr("snapshot_warm_hits_total", len(warmed))
+
+
+def fetch_match_data(
+    client: LastfmClient,
+    usernames: Iterable[str],
+    periods: Iterable[str],
+    limit: int = 300,
+    user_ttl_hours: Optional[int] = None,
+    ttl_hours: Optional[int] = None,
+    max_workers: int = 8,
+    on_fetched: Optional[Callable[[Tuple], None]] = None,
+) -> Tuple[Dict[str, LastfmUser], Dict[str, Dict[str, TopArtistSnapshot]], Set[Tuple[str, str]]]:
+    """
+    Load users and their top-artist snapshots, fetching every cache miss in parallel.
+
+    Cache lookups and DB writes stay on the calling thread; only the Last.fm
+    round trips run in the pool. Whatever was fetched successfully is stored
+    before the first error is re-raised, so a retry only refetches the rest.
+
+    Entries past their soft TTL but within the hard TTL are served as-is and
+    refreshed in the background; they are returned in the ``stale`` set as
+    ``(username, period)``, with ``"info"`` standing in for the profile.
+    While a method's circuit breaker is open, entries past the hard TTL are
+    served stale too, and only data never fetched fails fast.
+
+    Cached snapshots are loaded without their payload and may hold more
+    than ``limit`` artists; score them from the precomputed vector
+    (``services.vectors.load_vector(snapshot, limit)``).
+
+    ``on_fetched`` is passed through to ``fill_misses`` for progress reporting.
+    Expired snapshots that services.delta can patch have their payloads
+    loaded in one extra query.
+    """
+    periods = list(periods)
+    if user_ttl_hours is None:
+        user_ttl_hours = settings.LASTFM_USER_TTL_HOURS
+    if ttl_hours is None:
+        ttl_hours = settings.LASTFM_SNAPSHOT_TTL_HOURS
+    user_hard_ttl = settings.LASTFM_USER_HARD_TTL_HOURS
+    snapshot_hard_ttl = settings.LASTFM_SNAPSHOT_HARD_TTL_HOURS
+
+    users = load_users(usernames)
+    cached = load_snapshots(users.values(), periods)
+    snapshots: Dict[str, Dict[str, TopArtistSnapshot]] = {}
+    stale: Set[Tuple[str, str]] = set()
+    misses: List[_Miss] = []
+    expired_users: List[LastfmUser] = []
+    expired: List[Tuple[LastfmUser, str, Optional[TopArtistSnapshot]]] = []
+    states: Counter = Counter()
+    fresh_keys: List[Tuple] = []
+    for username, user in users.items():
+        snapshots[username] = {}
+        state = _user_freshness(user, user_ttl_hours, user_hard_ttl)
+        states["profile", state] += 1
+        if state == "stale":
+            stale.add((username, "info"))
+            _enqueue_refresh(("info", username))
+        elif state == "expired":
+            expired_users.append(user)
+        for period in periods:
+            snapshot = cached.get((user.pk, period))
+            # A snapshot shorter than ``limit`` has to be upgraded first.
+            usable = snapshot is not None and snapshot.covers(limit)
+            state = snapshot.freshness(ttl_hours, snapshot_hard_ttl) if usable else "expired"
+            states[period, state] += 1
+            if state == "fresh":
+                fresh_keys.append(("top", username, period, limit))
+            if state == "expired":
+                expired.append((user, period, snapshot))
+                continue
+            if state == "stale":
+                stale.add((username, period))
+                _enqueue_refresh(("top", username, period, limit))
+            snapshots[username][period] = snapshot
+
+    unavailable = _unavailable_methods() if expired_users or expired else set()
+    for user in expired_users:
+        if user.last_synced_at and "user.getInfo" in unavailable:
+            stale.add((user.username, "info"))
+        else:
+            misses.append(_user_miss(client, user, user_ttl_hours))
+    if "user.getTopArtists" in unavailable:
+        for user, period, snapshot in expired:
+            if snapshot is not None and snapshot.covers(limit):
+                stale.add((user.username, period))
+                snapshots[user.username][period] = snapshot
+        expired = [entry for entry in expired if entry[2] is None or not entry[2].covers(limit)]
+
+    from . import delta  # delta imports this module
+
+    load_payloads(
+        [
+            snapshot
+            for _, _, snapshot in expired
+            if snapshot is not None and snapshot.covers(limit) and delta.can_refresh(snapshot)
+        ]
     )
-    return payload
+    for user, period, snapshot in expired:
+        misses.append(_top_artists_miss(client, user, period, limit, ttl_hours, previous=snapshot))
+
+    _record_lookups(states, fresh_keys)
+    results = fill_misses(misses, max_workers=max_workers, on_fetched=on_fetched)
+    for key, value in results.items():
+        if key[0] == "top":
+            _, username, period, _ = key
+            snapshots[username][period] = value
+    return users, snapshots, stale
 
 
 def retryable_call(fn, max_attempts: int = 3, base_delay: float = 5.0):
@@ -118,15 +914,19 @@ def retryable_call(fn, max_attempts: int = 3, base_delay: float = 5.0):
     while True:
         try:
             return fn()
-        except LastfmRateLimitError:
+        except LastfmUnavailableError:
+            raise  # sleeping through an outage would only hold the worker
+        except LastfmRateLimitError as exc:
             attempt += 1
             if attempt >= max_attempts:
                 raise
-            delay = base_delay * math.pow(3, attempt - 1)
+            delay = exc.retry_after or base_delay * math.pow(3, attempt - 1)
+            metrics.observe("lastfm_backoff_seconds", delay)
             time.sleep(delay)
         except LastfmError:
             attempt += 1
             if attempt >= max_attempts:
                 raise
             delay = base_delay * math.pow(3, attempt - 1)
+            metrics.observe("lastfm_backoff_seconds", delay)
             time.sleep(delay)
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from itertools import product
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+PREFIX = "matchmaker:metrics:"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LASTFM_METHODS = ("user.getInfo", "user.getTopArtists", "user.getRecentTracks")
+# Periods of cached lookups; "profile" is the user.getInfo row.
+LOOKUP_PERIODS = ("3month", "12month", "overall", "profile")
+MATCH_STAGES = ("fetch", "result_cache", "vectors", "scoring", "total")
+
+
+class Metric:
+    """
+    A metric family with a fixed set of label values.
+
+    Values live in the ``metrics`` cache, which cannot list its keys, so every
+    series that may be exported has to be known up front.
+    """
+
+    def __init__(self, name: str, kind: str, help: str, labels: Optional[Dict[str, Sequence[str]]] = None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels or {}
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        names = list(self.labels)
+        return [dict(zip(names, values)) for values in product(*self.labels.values())]
+
+
+REGISTRY: Dict[str, Metric] = {}
+
+
+def _register(name: str, kind: str, help: str, labels: Optional[Dict[str, Sequence[str]]] = None) -> None:
+    REGISTRY[name] = Metric(name, kind, help, labels)
+
+
+_register(
+    "lastfm_requests_total",
+    "counter",
+    "Last.fm API calls by outcome; throttled calls were refused by the client-side rate limiter, "
+    "circuit_open ones by the circuit breaker.",
+    {"method": LASTFM_METHODS, "outcome": ("ok", "error", "rate_limited", "http_error", "throttled", "circuit_open")},
+)
+_register(
+    "lastfm_circuit_opened_total", "counter", "Times a Last.fm method's circuit breaker opened.", {"method": LASTFM_METHODS}
+)
+_register("lastfm_request_seconds", "histogram", "Last.fm API call latency.", {"method": LASTFM_METHODS})
+_register("lastfm_rate_limit_wait_seconds", "histogram", "Waits for the client-side rate limiter.")
+_register("lastfm_backoff_seconds", "histogram", "Sleeps between retryable_call attempts.")
+_register(
+    "cache_lookups_total",
+    "counter",
+    "Cached Last.fm data looked up, by period and freshness.",
+    {"period": LOOKUP_PERIODS, "state": ("fresh", "stale", "expired")},
+)
+_register("snapshot_warm_hits_total", "counter", "First fresh hits on snapshots refreshed by the cache warmer.")
+_register("warm_refreshes_total", "counter", "Snapshots refreshed by the cache warmer.")
+_register("match_stage_seconds", "histogram", "Wall time per run_match stage.", {"stage": MATCH_STAGES})
+_register("match_scoring_cpu_seconds", "histogram", "CPU time spent scoring a match.")
+_register("match_retry_countdown_seconds", "histogram", "Countdowns of rescheduled match tasks.")
+_register(
+    "match_submissions_total",
+    "counter",
+    "Match form submissions by outcome: queued, answered by a pending or cached match, or throttled.",
+    {"outcome": ("queued", "deduplicated", "cached", "throttled")},
+)
+_register(
+    "background_shed_total",
+    "counter",
+    "Background Last.fm work deferred or cut short because the rate limiter was low.",
+    {"task": ("refresh_user", "refresh_top_artists", "warm_snapshot_cache")},
+)
+_register(
+    "matches_total", "counter", "Finished match and group match tasks by status.", {"status": ("READY", "FAILED")}
+)
+
+
+def _series(name: str, labels: Dict[str, object]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+def incr(name: str, amount: int = 1, **labels) -> None:
+    """
+    Add to a counter in the ``metrics`` cache; best effort, never fails the caller.
+
+    Counters never expire, so with Redis they add up across processes.
+    """
+    _incr_many({_series(name, labels): amount})
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record a duration in a histogram (sum in microseconds, per-bucket counts)."""
+    bucket = next((str(bound) for bound in LATENCY_BUCKETS if seconds <= bound), "+Inf")
+    _incr_many(
+        {
+            _series(name + "_count", labels): 1,
+            _series(name + "_sum_us", labels): int(seconds * 1_000_000),
+            _series(name + "_bucket", {**labels, "le": bucket}): 1,
+        }
+    )
+
+
+def _incr_many(amounts: Dict[str, int]) -> None:
+    backend = caches["metrics"]
+    amounts = {PREFIX + series: amount for series, amount in amounts.items() if amount}
+    try:
+        if isinstance(backend, RedisCache):
+            # INCRBY creates missing keys, so all series take one round trip
+            # (the generic incr() checks that the key exists first).
+            pipeline = backend._cache.get_client(write=True).pipeline(transaction=False)
+            for key, amount in amounts.items():
+                pipeline.incrby(backend.make_and_validate_key(key), amount)
+            pipeline.execute()
+            return
+        for key, amount in amounts.items():
+            try:
+                backend.incr(key, amount)
+            except ValueError:  # first use
+                if not backend.add(key, amount, timeout=None):
+                    backend.incr(key, amount)
+    except Exception:  # a lost increment is harmless
+        pass
+
+
+class StageTimer:
+    """
+    Times the stages of one run into a histogram and a per-run breakdown.
+
+    ``timings`` maps ``<stage>_ms`` to milliseconds, plus ``<stage>_cpu_ms``
+    for stages timed with ``cpu_metric`` (CPU time of the calling thread).
+    """
+
+    def __init__(self, metric: str):
+        self.metric = metric
+        self.timings: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, cpu_metric: Optional[str] = None) -> Iterator[None]:
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self._add(name, time.perf_counter() - started)
+            if cpu_metric:
+                cpu = time.thread_time() - cpu_started
+                observe(cpu_metric, cpu)
+                self.timings[f"{name}_cpu_ms"] = round(cpu * 1000, 1)
+
+    def _add(self, name: str, seconds: float) -> None:
+        observe(self.metric, seconds, stage=name)
+        self.timings[f"{name}_ms"] = round(self.timings.get(f"{name}_ms", 0) + seconds * 1000, 1)
+
+    def finish(self, **extra) -> Dict:
+        """The breakdown with the ``total`` stage added, plus ``extra`` fields."""
+        self._add("total", time.perf_counter() - self.started)
+        return {**self.timings, **extra}
+
+
+def total(name: str, **labels) -> int:
+    """Sum of a counter over every series matching ``labels``; a tuple matches any of its values."""
+    metric = REGISTRY[name]
+    wanted = {key: (value,) if isinstance(value, str) else tuple(value) for key, value in labels.items()}
+    keys = [
+        PREFIX + _series(name, label_set)
+        for label_set in metric.label_sets()
+        if all(label_set[key] in allowed for key, allowed in wanted.items())
+    ]
+    return sum(int(v) for v in caches["metrics"].get_many(keys).values())
+
+
+def ratio(numerator: int, denominator: int) -> float:
+    return round(numerator / denominator, 4) if denominator else 0.0
+
+
+def _histogram_keys(metric: Metric, labels: Dict[str, str]) -> List[Tuple[str, str]]:
+    bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+    return [(bound, _series(metric.name + "_bucket", {**labels, "le": bound})) for bound in bounds]
+
+
+def render_prometheus() -> str:
+    """Every registered series in the Prometheus text format, read in one cache round trip."""
+    keys = []
+    for metric in REGISTRY.values():
+        for labels in metric.label_sets():
+            if metric.kind == "histogram":
+                keys += [_series(metric.name + "_count", labels), _series(metric.name + "_sum_us", labels)]
+                keys += [key for _, key in _histogram_keys(metric, labels)]
+            else:
+                keys.append(_series(metric.name, labels))
+    stored = caches["metrics"].get_many([PREFIX + key for key in keys])
+
+    def get(key: str) -> int:
+        return int(stored.get(PREFIX + key, 0))
+
+    lines = []
+    for metric in REGISTRY.values():
+        lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+        for labels in metric.label_sets():
+            if metric.kind != "histogram":
+                lines.append(f"{_series(metric.name, labels)} {get(_series(metric.name, labels))}")
+                continue
+            cumulative = 0
+            for bound, key in _histogram_keys(metric, labels):
+                cumulative += get(key)
+                lines.append(f"{_series(metric.name + '_bucket', {**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{_series(metric.name + '_sum', labels)} {get(_series(metric.name + '_sum_us', labels)) / 1e6}")
+            lines.append(f"{_series(metric.name + '_count', labels)} {get(_series(metric.name + '_count', labels))}")
+    return "\n".join(lines) + "\n"
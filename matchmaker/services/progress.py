@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Last event per match, for subscribers that connect after it was published.
+LAST_EVENT_TIMEOUT = 600
+
+
+def _channel(match_id: str) -> str:
+    return f"matchmaker:progress:{match_id}"
+
+
+class _LocalSubscription:
+    def __init__(self, notifier: "LocalNotifier", channel: str):
+        self.notifier = notifier
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def deliver(self, event: Dict) -> None:
+        # Called from whichever thread published.
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:  # loop already closed
+            pass
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self) -> None:
+        self.notifier.unsubscribe(self)
+
+
+class LocalNotifier:
+    """
+    In-process pub/sub: thread-safe publish, asyncio subscribers.
+
+    Only reaches subscribers in the same process, i.e. eager tasks or a
+    worker embedded in the web process; use Redis otherwise.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[_LocalSubscription]] = {}
+
+    def publish(self, channel: str, event: Dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    async def subscribe(self, channel: str) -> _LocalSubscription:
+        subscription = _LocalSubscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: _LocalSubscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.channel, None)
+
+
+class _RedisSubscription:
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message["data"]) if message else None
+
+    async def close(self) -> None:
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+class RedisNotifier:
+    """Redis pub/sub, so progress from Celery workers reaches every web process."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, event: Dict) -> None:
+        self.client.publish(channel, json.dumps(event))
+
+    async def subscribe(self, channel: str) -> _RedisSubscription:
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        return _RedisSubscription(client, pubsub)
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                url = settings.PROGRESS_REDIS_URL
+                _notifier = RedisNotifier(url) if url else LocalNotifier()
+    return _notifier
+
+
+def reaches_workers() -> bool:
+    """
+    Whether events published by match tasks reach subscribers here.
+
+    True with Redis, or when tasks run eagerly in this process; otherwise
+    a worker's events go to its own LocalNotifier and are never seen.
+    """
+    return isinstance(get_notifier(), RedisNotifier) or settings.CELERY_TASK_ALWAYS_EAGER
+
+
+def publish_progress(match_id: str, **event) -> None:
+    """
+    Record and broadcast a progress event for a match.
+
+    Events default to ``status="PENDING"``; progress is best effort and never
+    fails the caller.
+    """
+    event.setdefault("status", "PENDING")
+    try:
+        cache.set(_channel(match_id), event, timeout=LAST_EVENT_TIMEOUT)
+        get_notifier().publish(_channel(match_id), event)
+    except Exception:  # a lost progress event is harmless
+        pass
+
+
+async def last_progress(match_id: str) -> Optional[Dict]:
+    return await cache.aget(_channel(match_id))
+
+
+async def subscribe(match_id: str):
+    """Subscription whose ``await get(timeout)`` returns the next event or None."""
+    return await get_notifier().subscribe(_channel(match_id))
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+
+# Reservation-style bucket shared by every process that talks to Redis. Time
+# comes from the Redis server so hosts with skewed clocks agree on refills.
+_REDIS_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local pause = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked_until')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+local blocked = tonumber(state[3]) or 0
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = -1
+if pause > 0 then
+    blocked = math.max(blocked, now + pause)
+    wait = 0
+else
+    local needed = 0
+    if tokens < 1 then
+        needed = (1 - tokens) / rate
+    end
+    needed = math.max(needed, blocked - now)
+    if needed <= max_wait then
+        tokens = tokens - 1
+        wait = needed
+    end
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'blocked_until', blocked)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate + math.max(0, blocked - now)) + 60)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at ``rate`` tokens per second.
+
+    Tokens are reserved up front, so concurrent callers queue up behind each
+    other instead of all waking at once when the bucket refills.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float = float("inf")) -> Optional[float]:
+        """
+        Reserve one token and return how long to wait before using it.
+
+        Returns None, reserving nothing, if the wait would exceed ``max_wait``.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            wait = max(wait, self._blocked_until - now)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def acquire(self, max_wait: float = float("inf")) -> bool:
+        wait = self.reserve(max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            self._sleep(wait)
+        return True
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for ``seconds`` (e.g. a ``Retry-After``)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+    def delay(self) -> float:
+        """Seconds until a token could be used, without reserving one."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            return max(wait, self._blocked_until - now)
+
+    def available(self) -> float:
+        """Current token count as a fraction of capacity (0 while paused)."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self._blocked_until > now:
+                return 0.0
+            return max(0.0, self._tokens) / self.capacity
+
+
+class RedisTokenBucket(TokenBucket):
+    """Token bucket stored in Redis so gunicorn and Celery processes share it."""
+
+    def __init__(
+        self,
+        redis_client,
+        rate: float,
+        capacity: Optional[float] = None,
+        key: str = "matchmaker:lastfm:bucket",
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        super().__init__(rate, capacity, sleep=sleep)
+        self.key = key
+        self._redis = redis_client
+        self._script = redis_client.register_script(_REDIS_BUCKET_SCRIPT)
+
+    def _call(self, max_wait: float, pause: float) -> float:
+        max_wait = min(max_wait, 1e9)
+        return float(self._script(keys=[self.key], args=[self.rate, self.capacity, max_wait, pause]))
+
+    def reserve(self, max_wait: float = float("inf")) -> Optional[float]:
+        wait = self._call(max_wait, 0)
+        return None if wait < 0 else wait
+
+    def pause(self, seconds: float) -> None:
+        if seconds > 0:
+            self._call(0, seconds)
+
+    def _state(self):
+        tokens, updated, blocked = self._redis.hmget(self.key, "tokens", "ts", "blocked_until")
+        if tokens is None:
+            return self.capacity, 0.0
+        now = time.time()
+        tokens = float(tokens) + max(0.0, now - float(updated or now)) * self.rate
+        return min(self.capacity, tokens), max(0.0, float(blocked or 0) - now)
+
+    def delay(self) -> float:
+        tokens, blocked_for = self._state()
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+        return max(wait, blocked_for)
+
+    def available(self) -> float:
+        tokens, blocked_for = self._state()
+        if blocked_for > 0:
+            return 0.0
+        return max(0.0, tokens) / self.capacity
+
+
+_default_limiter: Optional[TokenBucket] = None
+_default_limiter_lock = threading.Lock()
+
+
+def build_rate_limiter() -> TokenBucket:
+    rate = settings.LASTFM_RATE_LIMIT_PER_SECOND
+    burst = settings.LASTFM_RATE_LIMIT_BURST
+    if settings.LASTFM_RATE_LIMIT_REDIS_URL:
+        import redis
+
+        client = redis.Redis.from_url(settings.LASTFM_RATE_LIMIT_REDIS_URL)
+        return RedisTokenBucket(client, rate=rate, capacity=burst)
+    return TokenBucket(rate=rate, capacity=burst)
+
+
+def get_rate_limiter() -> TokenBucket:
+    """Process-wide limiter shared by every LastfmClient."""
+    global _default_limiter
+    if _default_limiter is None:
+        with _default_limiter_lock:
+            if _default_limiter is None:
+                _default_limiter = build_rate_limiter()
+    return _default_limiter
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Dict, Mapping, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from matchmaker.models import LastfmUser, TopArtistSnapshot
+
+from .scoring import PERIODS, pick_source_period
+
+
+def _has_data(snapshot: Optional[TopArtistSnapshot]) -> bool:
+    # Stored vectors of an empty payload have a zero norm.
+    return bool(snapshot is not None and snapshot.vector_norm)
+
+
+def _is_keyable(*snapshot_maps: Mapping[str, TopArtistSnapshot]) -> bool:
+    # Versions name stored rows, and without stored vectors the source
+    # period cannot be told from the row.
+    return all(
+        s.pk is not None and s.vector_norm is not None for snapshots in snapshot_maps for s in snapshots.values()
+    )
+
+
+def _version(snapshot: Optional[TopArtistSnapshot]) -> str:
+    if snapshot is None or snapshot.fetched_at is None:
+        return "-"
+    return f"{snapshot.pk}@{snapshot.fetched_at.timestamp():.6f}"
+
+
+def result_cache_key(
+    username_a: str,
+    username_b: str,
+    snapshots_a: Mapping[str, TopArtistSnapshot],
+    snapshots_b: Mapping[str, TopArtistSnapshot],
+    limit: int = 300,
+) -> str:
+    """
+    Cache key for a pair scored from the first ``limit`` artists of exactly these snapshots.
+
+    The pair is unordered, but the source period (picked from user A's data)
+    and MATCH_TOP_K are part of the key since they decide overlap and
+    recommendations.
+    """
+    source_period = pick_source_period(lambda p: _has_data(snapshots_a.get(p)), settings.MATCH_SOURCE_PERIOD)
+    sides = sorted(
+        [
+            (username_a, ",".join(_version(snapshots_a.get(p)) for p in PERIODS)),
+            (username_b, ",".join(_version(snapshots_b.get(p)) for p in PERIODS)),
+        ]
+    )
+    raw = "|".join(f"{username}:{versions}" for username, versions in sides) + f"|{source_period}|{settings.MATCH_TOP_K}|{limit}"
+    return "matchmaker:result:" + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _swap(result: Dict) -> Dict:
+    swapped = dict(result)
+    swapped["recs_for_a"], swapped["recs_for_b"] = result["recs_for_b"], result["recs_for_a"]
+    swapped["overlap"] = [
+        {**item, "a_weight": item["b_weight"], "b_weight": item["a_weight"]} for item in result["overlap"]
+    ]
+    return swapped
+
+
+def get_cached_result(
+    username_a: str,
+    username_b: str,
+    snapshots_a: Mapping[str, TopArtistSnapshot],
+    snapshots_b: Mapping[str, TopArtistSnapshot],
+    limit: int = 300,
+) -> Optional[Dict]:
+    """A cached score_vectors result oriented as A vs B, or None."""
+    if not _is_keyable(snapshots_a, snapshots_b):
+        return None
+    entry = cache.get(result_cache_key(username_a, username_b, snapshots_a, snapshots_b, limit))
+    if entry is None:
+        return None
+    if entry["user_a"] == username_a:
+        return entry["result"]
+    return _swap(entry["result"])
+
+
+def cache_result(
+    username_a: str,
+    username_b: str,
+    snapshots_a: Mapping[str, TopArtistSnapshot],
+    snapshots_b: Mapping[str, TopArtistSnapshot],
+    result: Dict,
+    limit: int = 300,
+) -> None:
+    if not _is_keyable(snapshots_a, snapshots_b):
+        return
+    cache.set(
+        result_cache_key(username_a, username_b, snapshots_a, snapshots_b, limit),
+        {"user_a": username_a, "result": result},
+        timeout=settings.MATCH_RESULT_CACHE_SECONDS,
+    )
+
+
+def _fresh_snapshots(user: LastfmUser, limit: int, ttl_hours: int) -> Optional[Dict[str, TopArtistSnapshot]]:
+    snapshots = {
+        s.period: s
+        for s in TopArtistSnapshot.objects.filter(user=user, period__in=PERIODS)
+        .only("pk", "user_id", "period", "limit", "vector_norm", "fetched_at")
+    }
+    if len(snapshots) < len(PERIODS) or not all(s.covers(limit) and s.is_fresh(ttl_hours) for s in snapshots.values()):
+        return None
+    return snapshots
+
+
+def cached_match(
+    user_a: LastfmUser, user_b: LastfmUser, limit: int = 300, ttl_hours: Optional[int] = None
+) -> Optional[Dict]:
+    """
+    The stored result for a pair whose snapshots are all still fresh.
+
+    Used before enqueueing ``run_match``: a hit needs neither Last.fm nor scoring.
+    """
+    if ttl_hours is None:
+        ttl_hours = settings.LASTFM_SNAPSHOT_TTL_HOURS
+    snapshots_a = _fresh_snapshots(user_a, limit, ttl_hours)
+    snapshots_b = _fresh_snapshots(user_b, limit, ttl_hours) if snapshots_a is not None else None
+    if snapshots_b is None:
+        return None
+    return get_cached_result(user_a.username, user_b.username, snapshots_a, snapshots_b, limit)
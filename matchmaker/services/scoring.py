@@ -1,97 +1,287 @@
 from __future__ import annotations
 
+import heapq
 import math
-from typing import Dict, Iterable, List
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
 
 from .lastfm import artist_identifier
 
 
-def build_vector(top_artists_payload: Iterable[Dict]) -> Dict[str, float]:
-    vector: Dict[str, float] = {}
+class ArtistInterner:
+    """
+    Maps artist identifiers (MBID or lowercased name) to small integer ids.
+
+    Ids are only comparable between vectors built with the same interner;
+    create one per scoring call so the table goes away with it.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._keys: List[str] = []
+
+    def intern(self, key: str) -> int:
+        artist_id = self._ids.get(key)
+        if artist_id is None:
+            artist_id = self._ids[key] = len(self._keys)
+            self._keys.append(key)
+        return artist_id
+
+    def key(self, artist_id: int) -> str:
+        return self._keys[artist_id]
+
+
+class ArtistVector:
+    """
+    Sparse taste vector: sorted artist ids with parallel weights.
+
+    The L2 norm is computed once and cached, and dot products walk both id
+    arrays in a single merge pass instead of hashing artist strings.
+    ``ranked_ids`` and ``ranked_weights`` keep the Last.fm rank order for
+    tie-breaking.
+    """
+
+    __slots__ = ("ids", "weights", "_norm", "_ranked_ids", "_ranked_weights")
+
+    def __init__(
+        self,
+        ids: Iterable[int] = (),
+        weights: Iterable[float] = (),
+        norm: Optional[float] = None,
+        ranked_ids: Optional[Iterable[int]] = None,
+        ranked_weights: Optional[Iterable[float]] = None,
+    ):
+        self.ids = array("q", ids)
+        self.weights = array("d", weights)
+        self._norm = norm
+        self._ranked_ids = ranked_ids
+        self._ranked_weights = ranked_weights
+
+    @classmethod
+    def from_weights(cls, weights: Mapping[int, float]) -> "ArtistVector":
+        """Build from ``{artist_id: weight}``; iteration order is taken as rank order."""
+        ids = sorted(weights)
+        return cls(ids, [weights[i] for i in ids], ranked_ids=list(weights), ranked_weights=list(weights.values()))
+
+    @classmethod
+    def from_mapping(cls, mapping: Mapping[str, float], interner: ArtistInterner) -> "ArtistVector":
+        return cls.from_weights({interner.intern(key): weight for key, weight in mapping.items()})
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, artist_id: int) -> bool:
+        i = bisect_left(self.ids, artist_id)
+        return i < len(self.ids) and self.ids[i] == artist_id
+
+    def get(self, artist_id: int, default: float = 0.0) -> float:
+        i = bisect_left(self.ids, artist_id)
+        if i < len(self.ids) and self.ids[i] == artist_id:
+            return self.weights[i]
+        return default
+
+    def items(self) -> Iterator[Tuple[int, float]]:
+        return zip(self.ids, self.weights)
+
+    @property
+    def ranked_ids(self) -> Iterable[int]:
+        return self.ids if self._ranked_ids is None else self._ranked_ids
+
+    @property
+    def ranked_weights(self) -> Iterable[float]:
+        if self._ranked_weights is None:
+            self._ranked_weights = self.weights if self._ranked_ids is None else [self.get(i) for i in self._ranked_ids]
+        return self._ranked_weights
+
+    @property
+    def norm(self) -> float:
+        if self._norm is None:
+            self._norm = math.sqrt(sum(w * w for w in self.weights))
+        return self._norm
+
+    def intersect(self, other: "ArtistVector") -> Iterator[Tuple[int, float, float]]:
+        """Yield ``(artist_id, self_weight, other_weight)`` for shared artists."""
+        ids_a, ids_b = self.ids, other.ids
+        i = j = 0
+        len_a, len_b = len(ids_a), len(ids_b)
+        while i < len_a and j < len_b:
+            a, b = ids_a[i], ids_b[j]
+            if a == b:
+                yield a, self.weights[i], other.weights[j]
+                i += 1
+                j += 1
+            elif a < b:
+                i += 1
+            else:
+                j += 1
+
+    def dot(self, other: "ArtistVector") -> float:
+        return sum(wa * wb for _, wa, wb in self.intersect(other))
+
+
+VectorLike = Union[ArtistVector, Mapping[str, float]]
+
+
+def _as_vector(vec: VectorLike, interner: ArtistInterner) -> ArtistVector:
+    return vec if isinstance(vec, ArtistVector) else ArtistVector.from_mapping(vec, interner)
+
+
+def build_vector(top_artists_payload: Iterable[Dict], interner: Optional[ArtistInterner] = None) -> ArtistVector:
+    """Vector of a payload; pass the same ``interner`` for vectors that are compared."""
+    if interner is None:
+        interner = ArtistInterner()
+    weights: Dict[int, float] = {}
     for artist in top_artists_payload:
         plays = int(artist.get("playcount", 0))
         weight = math.log(plays + 1)
         if weight <= 0:
             continue
-        key = artist_identifier(artist)
-        vector[key] = weight
-    return vector
-
-
-def _l2_norm(vec: Dict[str, float]) -> float:
-    return math.sqrt(sum(v * v for v in vec.values()))
+        weights[interner.intern(artist_identifier(artist))] = weight
+    return ArtistVector.from_weights(weights)
 
 
-def cosine_similarity(vec_a: Dict[str, float], vec_b: Dict[str, float]) -> float:
+def cosine_similarity(vec_a: VectorLike, vec_b: VectorLike) -> float:
+    interner = ArtistInterner()
+    vec_a, vec_b = _as_vector(vec_a, interner), _as_vector(vec_b, interner)
     if not vec_a or not vec_b:
         return 0.0
-    dot = sum(vec_a.get(k, 0) * vec_b.get(k, 0) for k in vec_a.keys())
-    norm_a = _l2_norm(vec_a)
-    norm_b = _l2_norm(vec_b)
+    norm_a = vec_a.norm
+    norm_b = vec_b.norm
     if norm_a == 0 or norm_b == 0:
         return 0.0
-    return dot / (norm_a * norm_b)
+    return vec_a.dot(vec_b) / (norm_a * norm_b)
 
 
-def _artist_name_map(payloads: List[Dict]) -> Dict[str, str]:
+def _artist_name_map(payloads: List[Dict], interner: ArtistInterner) -> Dict[int, str]:
+    """Interned id -> display name, in payload (rank) order."""
     mapping = {}
     for artist in payloads:
         key = artist_identifier(artist)
-        mapping[key] = artist.get("name") or key
+        mapping[interner.intern(key)] = artist.get("name") or key
     return mapping
 
 
-def compute_match(
-    user_a_payloads: Dict[str, List[Dict]], user_b_payloads: Dict[str, List[Dict]]
-) -> Dict:
-    periods = ["3month", "12month", "overall"]
-    vectors_a = {p: build_vector(user_a_payloads.get(p, [])) for p in periods}
-    vectors_b = {p: build_vector(user_b_payloads.get(p, [])) for p in periods}
-
-    scores = {p: round(cosine_similarity(vectors_a[p], vectors_b[p]), 4) for p in periods}
-    final_score = (
-        0.55 * scores["3month"] + 0.30 * scores["12month"] + 0.15 * scores["overall"]
-    )
-
-    primary_period = "overall"
-    source_period = primary_period if user_a_payloads.get(primary_period) else "12month"
-    if not user_a_payloads.get(source_period):
+PERIODS = ["3month", "12month", "overall"]
+PERIOD_WEIGHTS = {"3month": 0.55, "12month": 0.30, "overall": 0.15}
+# Shared artists and recommendations listed per match.
+DEFAULT_TOP_K = 10
+
+
+def pick_source_period(has_data: Callable[[str], bool], preferred: Optional[str] = None) -> str:
+    """
+    Period used for overlap and recommendations.
+
+    ``preferred`` when it has data, else overall, else 12month, else 3month.
+    """
+    if preferred and has_data(preferred):
+        return preferred
+    source_period = "overall" if has_data("overall") else "12month"
+    if not has_data(source_period):
         source_period = "3month"
+    return source_period
 
-    name_map_a = _artist_name_map(user_a_payloads.get(source_period, []))
-    name_map_b = _artist_name_map(user_b_payloads.get(source_period, []))
 
-    vec_a = vectors_a.get(source_period, {})
-    vec_b = vectors_b.get(source_period, {})
+def _combined(item: Tuple[int, float, float]) -> float:
+    return item[1] + item[2]
+
+
+def top_overlap(vec_a: ArtistVector, vec_b: ArtistVector, k: int) -> Tuple[List[Tuple[int, float, float]], Set[int]]:
+    """
+    The ``k`` shared artists with the highest combined weight, and all shared ids.
+
+    One merge pass over both vectors feeds a bounded heap; ties keep id order
+    like a stable sort would.
+    """
+    shared: Set[int] = set()
+
+    def stream() -> Iterator[Tuple[int, float, float]]:
+        for item in vec_a.intersect(vec_b):
+            shared.add(item[0])
+            yield item
+
+    return heapq.nlargest(k, stream(), key=_combined), shared
+
+
+def top_missing(source: ArtistVector, exclude: Set[int], k: int) -> List[Tuple[int, float]]:
+    """The ``k`` heaviest artists of ``source`` not in ``exclude``; ties keep Last.fm rank order."""
+    ranked = zip(source.ranked_ids, source.ranked_weights)
+    return heapq.nlargest(k, ((a, w) for a, w in ranked if a not in exclude), key=itemgetter(1))
 
-    overlap = []
-    for key in set(vec_a.keys()).intersection(vec_b.keys()):
-        overlap.append(
-            {
-                "artist": name_map_a.get(key) or name_map_b.get(key) or key,
-                "a_weight": vec_a.get(key, 0.0),
-                "b_weight": vec_b.get(key, 0.0),
-                "combined": vec_a.get(key, 0.0) + vec_b.get(key, 0.0),
-            }
-        )
-    overlap.sort(key=lambda x: x["combined"], reverse=True)
-    overlap = overlap[:10]
 
-    def missing_recs(source_vec: Dict[str, float], target_vec: Dict[str, float], name_map: Dict):
-        recs = []
-        for key, weight in source_vec.items():
-            if key not in target_vec:
-                recs.append({"artist": name_map.get(key, key), "weight": weight})
-        recs.sort(key=lambda x: x["weight"], reverse=True)
-        return recs[:10]
+def score_vectors(
+    vectors_a: Dict[str, ArtistVector],
+    vectors_b: Dict[str, ArtistVector],
+    source_period: str,
+    names: Callable[[List[int]], Dict[int, str]],
+    scores: Optional[Dict[str, float]] = None,
+    top_k: int = DEFAULT_TOP_K,
+) -> Dict:
+    """
+    Blend per-period cosine scores and pick overlap and recommendations.
+
+    ``names`` resolves display names for the ``top_k`` artist ids per list
+    that make the cut; only those get result dicts. Pass ``scores`` (rounded
+    per-period cosines) if they are already known.
+    """
+    empty = ArtistVector()
+    if scores is None:
+        scores = {
+            p: round(cosine_similarity(vectors_a.get(p, empty), vectors_b.get(p, empty)), 4)
+            for p in PERIODS
+        }
+    final_score = sum(PERIOD_WEIGHTS[p] * scores[p] for p in PERIODS)
+
+    vec_a = vectors_a.get(source_period, empty)
+    vec_b = vectors_b.get(source_period, empty)
+
+    overlap, shared = top_overlap(vec_a, vec_b, top_k)
+    # An artist of one side is missing from the other exactly when it is not shared.
+    recs_a = top_missing(vec_b, shared, top_k)
+    recs_b = top_missing(vec_a, shared, top_k)
 
-    recs_for_a = missing_recs(vec_b, vec_a, name_map_b)
-    recs_for_b = missing_recs(vec_a, vec_b, name_map_a)
+    name_map = names([x[0] for x in overlap] + [x[0] for x in recs_a] + [x[0] for x in recs_b])
+
+    def name_of(artist_id: int) -> str:
+        return name_map.get(artist_id) or str(artist_id)
 
     return {
         "scores": scores,
         "final_score": round(final_score * 100, 1),
-        "overlap": overlap,
-        "recs_for_a": recs_for_a,
-        "recs_for_b": recs_for_b,
+        "overlap": [
+            {
+                "artist": name_of(artist_id),
+                "a_weight": weight_a,
+                "b_weight": weight_b,
+                "combined": weight_a + weight_b,
+            }
+            for artist_id, weight_a, weight_b in overlap
+        ],
+        "recs_for_a": [{"artist": name_of(artist_id), "weight": weight} for artist_id, weight in recs_a],
+        "recs_for_b": [{"artist": name_of(artist_id), "weight": weight} for artist_id, weight in recs_b],
     }
+
+
+def compute_match(
+    user_a_payloads: Dict[str, List[Dict]],
+    user_b_payloads: Dict[str, List[Dict]],
+    top_k: int = DEFAULT_TOP_K,
+    source_period: Optional[str] = None,
+) -> Dict:
+    """Score two users from raw payloads; ``source_period`` is a preference (see pick_source_period)."""
+    interner = ArtistInterner()
+    vectors_a = {p: build_vector(user_a_payloads.get(p, []), interner) for p in PERIODS}
+    vectors_b = {p: build_vector(user_b_payloads.get(p, []), interner) for p in PERIODS}
+
+    source_period = pick_source_period(lambda p: bool(user_a_payloads.get(p)), source_period)
+    name_map_a = _artist_name_map(user_a_payloads.get(source_period, []), interner)
+    name_map_b = _artist_name_map(user_b_payloads.get(source_period, []), interner)
+
+    def names(artist_ids: List[int]) -> Dict[int, str]:
+        return {
+            artist_id: name_map_a.get(artist_id) or name_map_b.get(artist_id) or interner.key(artist_id)
+            for artist_id in artist_ids
+        }
+
+    return score_vectors(vectors_a, vectors_b, source_period, names, top_k=top_k)
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, TopArtistSnapshot
+
+from .scoring import PERIOD_WEIGHTS, PERIODS
+from .vectors import truncate_vector
+
+# (user_id, period, packed artist ids, packed float32 weights, norm, fetched_at)
+VectorRow = Tuple[int, str, bytes, bytes, float, datetime]
+# (artist ids, row-normalized weights)
+SparseRow = Tuple[np.ndarray, np.ndarray]
+
+
+def normalized_row(ids: bytes, weights: bytes, norm: float) -> Optional[SparseRow]:
+    if not norm:
+        return None
+    artist_ids = np.frombuffer(ids, dtype="<i4")
+    if not len(artist_ids):
+        return None
+    return artist_ids, np.frombuffer(weights, dtype="<f4") / np.float32(norm)
+
+
+class PeriodIndex:
+    """
+    Inverted artist -> (user, weight) posting lists for one period.
+
+    Cosine similarity is zero unless two users share an artist, so a query
+    only gathers the posting lists of its own artists and accumulates dot
+    products for those candidates: cost scales with posting-list length,
+    not with the number of users.
+    """
+
+    def __init__(
+        self,
+        artists: np.ndarray,
+        artist_ptr: np.ndarray,
+        posting_users: np.ndarray,
+        posting_weights: np.ndarray,
+        user_ids: np.ndarray,
+        user_fetched_at: np.ndarray,
+    ):
+        self.artists = artists
+        self.artist_ptr = artist_ptr
+        self.posting_users = posting_users
+        self.posting_weights = posting_weights
+        self.user_ids = user_ids
+        self.user_fetched_at = user_fetched_at
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, SparseRow, float]]) -> "PeriodIndex":
+        """Build from ``(user_id, (artist_ids, weights), fetched_at_timestamp)`` rows."""
+        user_ids, fetched, all_artists, all_users, all_weights = [], [], [], [], []
+        for user_id, (artist_ids, weights), fetched_at in rows:
+            position = len(user_ids)
+            user_ids.append(user_id)
+            fetched.append(fetched_at)
+            all_artists.append(artist_ids.astype(np.int32, copy=False))
+            all_users.append(np.full(len(artist_ids), position, dtype=np.int32))
+            all_weights.append(weights.astype(np.float32, copy=False))
+        if not user_ids:
+            empty_i, empty_f = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+            return cls(empty_i, np.zeros(1, dtype=np.int64), empty_i, empty_f, np.zeros(0, dtype=np.int64), np.zeros(0))
+
+        artists = np.concatenate(all_artists)
+        order = np.argsort(artists, kind="stable")
+        artists = artists[order]
+        unique_artists, starts = np.unique(artists, return_index=True)
+        return cls(
+            unique_artists,
+            np.append(starts, len(artists)).astype(np.int64),
+            np.concatenate(all_users)[order],
+            np.concatenate(all_weights)[order],
+            np.asarray(user_ids, dtype=np.int64),
+            np.asarray(fetched, dtype=np.float64),
+        )
+
+    @property
+    def posting_count(self) -> int:
+        return len(self.posting_users)
+
+    def accumulate(self, query: SparseRow, fresh_after: float) -> Tuple[np.ndarray, np.ndarray]:
+        """``(user_ids, cosine scores)`` for every fresh user sharing an artist with ``query``."""
+        query_ids, query_weights = query
+        pos = np.searchsorted(self.artists, query_ids)
+        pos = np.minimum(pos, max(len(self.artists) - 1, 0))
+        hit = (self.artists[pos] == query_ids) if len(self.artists) else np.zeros(len(query_ids), bool)
+        if not hit.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        starts = self.artist_ptr[pos[hit]]
+        lengths = self.artist_ptr[pos[hit] + 1] - starts
+        # Flat indices of every posting in the matched lists.
+        offsets = np.repeat(starts - np.cumsum(np.append(0, lengths[:-1])), lengths)
+        postings = offsets + np.arange(lengths.sum())
+        contributions = self.posting_weights[postings] * np.repeat(query_weights[hit], lengths)
+
+        candidates, inverse = np.unique(self.posting_users[postings], return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions.astype(np.float64), minlength=len(candidates))
+        fresh = self.user_fetched_at[candidates] >= fresh_after
+        return self.user_ids[candidates[fresh]], scores[fresh]
+
+
+class SimilarityIndex:
+    """
+    One PeriodIndex per period plus a small overlay of recently written rows.
+
+    Rows written after the base index was built live in the overlay and mask
+    their older postings, so snapshot writes show up without a rebuild.
+    """
+
+    def __init__(self, periods: Dict[str, PeriodIndex]):
+        self.periods = periods
+        self.overlay: Dict[str, Dict[int, Tuple[Optional[SparseRow], float]]] = {p: {} for p in PERIODS}
+
+    @classmethod
+    def from_vector_rows(cls, rows: Iterable[VectorRow]) -> "SimilarityIndex":
+        by_period: Dict[str, list] = {p: [] for p in PERIODS}
+        for user_id, period, ids, weights, norm, fetched_at in rows:
+            row = normalized_row(ids, weights, norm)
+            if row is not None:
+                by_period[period].append((user_id, row, fetched_at.timestamp()))
+        return cls({p: PeriodIndex.from_rows(by_period[p]) for p in PERIODS})
+
+    def apply(self, rows: Iterable[VectorRow], fresh_after: float = 0.0) -> None:
+        """Overlay newer snapshot vectors on top of the base index, dropping entries older than ``fresh_after``."""
+        overlay = {
+            period: {user_id: entry for user_id, entry in entries.items() if entry[1] >= fresh_after}
+            for period, entries in self.overlay.items()
+        }
+        for user_id, period, ids, weights, norm, fetched_at in rows:
+            overlay[period][user_id] = (normalized_row(ids, weights, norm), fetched_at.timestamp())
+        # Swapped in whole: queries on other threads may be reading the old one.
+        self.overlay = overlay
+
+    @property
+    def overlay_size(self) -> int:
+        return sum(len(rows) for rows in self.overlay.values())
+
+    def _period_scores(
+        self, period: str, query: SparseRow, fresh_after: float, overlay: Dict[int, Tuple[Optional[SparseRow], float]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        users, scores = self.periods[period].accumulate(query, fresh_after)
+        if overlay:
+            keep = ~np.isin(users, np.fromiter(overlay, dtype=np.int64, count=len(overlay)))
+            users, scores = [users[keep]], [scores[keep]]
+            query_ids, query_weights = query
+            for user_id, (row, fetched_at) in overlay.items():
+                if row is None or fetched_at < fresh_after:
+                    continue
+                _, qi, ri = np.intersect1d(query_ids, row[0], assume_unique=True, return_indices=True)
+                if len(qi):
+                    users.append(np.array([user_id], dtype=np.int64))
+                    scores.append(np.array([np.dot(query_weights[qi].astype(np.float64), row[1][ri])]))
+            users, scores = np.concatenate(users), np.concatenate(scores)
+        return users, scores
+
+    def best_matches(self, user_id: int, queries: Dict[str, SparseRow], fresh_after: float, top_k: int = 20) -> List[Dict]:
+        """
+        Top-K users sharing at least one artist with ``queries``, by blended score.
+
+        ``queries`` holds the querying user's normalized vector per period.
+        """
+        overlay = self.overlay
+        found = {p: self._period_scores(p, queries[p], fresh_after, overlay[p]) for p in PERIODS if p in queries}
+        if not found:
+            return []
+        candidates = np.unique(np.concatenate([users for users, _ in found.values()]))
+        candidates = candidates[candidates != user_id]
+        if not len(candidates):
+            return []
+
+        totals = np.zeros(len(candidates))
+        per_period = {}
+        for period in PERIODS:
+            scores = np.zeros(len(candidates))
+            if period in found:
+                users, period_scores = found[period]
+                keep = users != user_id
+                # compute_match rounds each period before blending.
+                scores[np.searchsorted(candidates, users[keep])] = np.round(period_scores[keep], 4)
+            per_period[period] = scores
+            totals += PERIOD_WEIGHTS[period] * scores
+
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [
+            {
+                "user_id": int(candidates[i]),
+                "final_score": round(float(totals[i]) * 100, 1),
+                "scores": {p: float(per_period[p][i]) for p in PERIODS},
+            }
+            for i in top
+        ]
+
+
+def load_vector_rows(limit: int = 300, **filters) -> Iterable[VectorRow]:
+    """Stored vectors of snapshots covering ``limit``, cut to their first ``limit`` artists."""
+    rows = (
+        TopArtistSnapshot.objects.filter(limit__gte=limit, vector_ids__isnull=False, **filters)
+        .values_list("user_id", "period", "vector_ids", "vector_weights", "vector_norm", "fetched_at")
+        .iterator(chunk_size=2000)
+    )
+    for user_id, period, ids, weights, norm, fetched_at in rows:
+        yield (user_id, period, *truncate_vector(ids, weights, norm, limit), fetched_at)
+
+
+# Rows committed late can carry a fetched_at slightly older than the newest
+# row already seen; re-reading this window makes the overlay catch them.
+WATERMARK_OVERLAP = timezone.timedelta(seconds=60)
+
+
+class _IndexState:
+    def __init__(self):
+        self.lock = threading.Lock()  # guards the fields below
+        self.build_lock = threading.Lock()  # held by the one thread rebuilding
+        self.index: Optional[SimilarityIndex] = None
+        self.built_at = 0.0
+        self.watermark: Optional[datetime] = None
+
+
+_index_lock = threading.Lock()
+# One index per (limit, ttl_hours): rows and their cut differ between them.
+_index_states: Dict[Tuple[int, int], _IndexState] = {}
+
+
+def clear_similarity_index() -> None:
+    with _index_lock:
+        _index_states.clear()
+
+
+def get_similarity_index(
+    limit: int = 300, ttl_hours: int = 12, max_age: float = 3600.0, max_overlay_ratio: float = 0.1
+) -> SimilarityIndex:
+    """
+    Process-wide index over every user with fresh snapshots, per ``limit`` and ``ttl_hours``.
+
+    Snapshots written since the last call (by any process) are read by
+    ``fetched_at`` and overlaid; the base is rebuilt when the overlay grows
+    past ``max_overlay_ratio`` of it or after ``max_age`` seconds. One thread
+    rebuilds, outside the locks, while the others keep using the old index.
+    """
+    with _index_lock:
+        state = _index_states.setdefault((limit, ttl_hours), _IndexState())
+    with state.lock:
+        index = state.index
+        now = timezone.now()
+        if index is not None and time.monotonic() - state.built_at <= max_age:
+            cutoff = now - timezone.timedelta(hours=ttl_hours)
+            changed = list(load_vector_rows(limit, fetched_at__gt=state.watermark - WATERMARK_OVERLAP))
+            index.apply(changed, fresh_after=cutoff.timestamp())
+            if changed:
+                state.watermark = max(state.watermark, max(row[5] for row in changed))
+            base_size = max(1, sum(len(p.user_ids) for p in index.periods.values()))
+            if index.overlay_size <= max_overlay_ratio * base_size:
+                return index
+
+    if not state.build_lock.acquire(blocking=index is None):
+        return index
+    try:
+        with state.lock:
+            if state.index is not index:  # rebuilt while we waited
+                return state.index
+        cutoff = now - timezone.timedelta(hours=ttl_hours)
+        rows = list(load_vector_rows(limit, fetched_at__gte=cutoff))
+        rebuilt = SimilarityIndex.from_vector_rows(rows)
+        with state.lock:
+            state.index = rebuilt
+            state.built_at = time.monotonic()
+            state.watermark = max((row[5] for row in rows), default=now)
+        return rebuilt
+    finally:
+        state.build_lock.release()
+
+
+def best_matches_for(user: LastfmUser, top_k: int = 20, limit: int = 300, ttl_hours: int = 12) -> Optional[List[Dict]]:
+    """Ranked matches with usernames, or None if ``user`` has no fresh snapshots."""
+    cutoff = timezone.now() - timezone.timedelta(hours=ttl_hours)
+    queries = {}
+    for period, ids, weights, norm in TopArtistSnapshot.objects.filter(
+        user=user, limit__gte=limit, fetched_at__gte=cutoff, vector_ids__isnull=False
+    ).values_list("period", "vector_ids", "vector_weights", "vector_norm"):
+        row = normalized_row(*truncate_vector(ids, weights, norm, limit))
+        if row is not None:
+            queries[period] = row
+    if not queries:
+        return None
+
+    index = get_similarity_index(limit=limit, ttl_hours=ttl_hours)
+    matches = index.best_matches(user.pk, queries, fresh_after=cutoff.timestamp(), top_k=top_k)
+    usernames = dict(
+        LastfmUser.objects.filter(pk__in=[m["user_id"] for m in matches]).values_list("pk", "username")
+    )
+    for match in matches:
+        match["username"] = usernames.get(match.pop("user_id"), "")
+    return matches
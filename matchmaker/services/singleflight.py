@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Hashable, Tuple, TypeVar
+
+from django.core.cache import cache
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key within this process.
+
+    The first caller (the leader) runs ``fn``; anyone arriving while it is in
+    flight waits for it and gets the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """Return ``(value, shared)``; ``shared`` is True for followers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+
+class FetchLease:
+    """
+    Best-effort cross-process lock held in the Django cache.
+
+    Only meaningful with a shared cache backend (Redis); the lease expires on
+    its own after ``timeout`` seconds if the holder dies.
+    """
+
+    def __init__(self, key: Hashable, timeout: float):
+        self.cache_key = "matchmaker:lease:" + ":".join(str(part) for part in _as_tuple(key))
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+
+    def acquire(self) -> bool:
+        return cache.add(self.cache_key, self.token, timeout=self.timeout)
+
+    def release(self) -> None:
+        if cache.get(self.cache_key) == self.token:
+            cache.delete(self.cache_key)
+
+    def wait(self, poll_interval: float = 0.1) -> bool:
+        """Block until the current holder releases; False if it timed out."""
+        deadline = time.monotonic() + self.timeout
+        while cache.get(self.cache_key) is not None:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+
+def _as_tuple(key: Hashable) -> tuple:
+    return key if isinstance(key, tuple) else (key,)
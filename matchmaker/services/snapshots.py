@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple
+
+from matchmaker.models import PAYLOAD_FIELDS, Artist, LastfmUser, TopArtistSnapshot
+
+SnapshotKey = Tuple[int, str]
+
+USER_INFO_FIELDS = ["playcount", "realname", "country", "avatar_url", "last_synced_at"]
+SNAPSHOT_FIELDS = ["limit", *PAYLOAD_FIELDS, "vector_ids", "vector_weights", "vector_norm", "fetched_at", "full_fetched_at"]
+
+
+def load_users(usernames: Iterable[str]) -> Dict[str, LastfmUser]:
+    """Users by username, creating missing rows; one query when they all exist."""
+    usernames = list(dict.fromkeys(usernames))
+    users = {user.username: user for user in LastfmUser.objects.filter(username__in=usernames)}
+    missing = [username for username in usernames if username not in users]
+    if missing:
+        LastfmUser.objects.bulk_create([LastfmUser(username=username) for username in missing], ignore_conflicts=True)
+        users.update((user.username, user) for user in LastfmUser.objects.filter(username__in=missing))
+    return {username: users[username] for username in usernames}
+
+
+def load_snapshots(
+    users: Iterable[LastfmUser], periods: Iterable[str], with_payload: bool = False
+) -> Dict[SnapshotKey, TopArtistSnapshot]:
+    """
+    Every snapshot of ``users`` for ``periods`` in one query, keyed by (user_id, period).
+
+    Whatever their ``limit``; check TopArtistSnapshot.covers before serving one.
+    """
+    queryset = TopArtistSnapshot.objects.filter(user__in=list(users), period__in=list(periods))
+    if not with_payload:
+        queryset = queryset.defer(*PAYLOAD_FIELDS)
+    return {(s.user_id, s.period): s for s in queryset}
+
+
+def load_payloads(snapshots: List[TopArtistSnapshot]) -> None:
+    """
+    Decode the payloads of ``snapshots`` not decoded yet.
+
+    One query for the columns of deferred rows and one for their artists,
+    which are kept as ``payload_artists`` for encoding a patched payload.
+    """
+    from .vectors import decode_payload, payload_artist_ids  # vectors imports lastfm, which imports this module
+
+    pending = [s for s in snapshots if not s.payload_loaded]
+    if not pending:
+        return
+    deferred = [s for s in pending if s.get_deferred_fields() & set(PAYLOAD_FIELDS)]
+    if deferred:
+        rows = TopArtistSnapshot.objects.filter(pk__in=[s.pk for s in deferred]).values_list("pk", *PAYLOAD_FIELDS)
+        columns = {pk: values for pk, *values in rows}
+        for snapshot in deferred:
+            for name, value in zip(PAYLOAD_FIELDS, columns[snapshot.pk]):
+                setattr(snapshot, name, value)
+
+    ids = [payload_artist_ids(s.payload_ids) for s in pending]
+    wanted = {artist_id for artist_ids in ids for artist_id in artist_ids}
+    artists = {pk: (key, name) for pk, key, name in Artist.objects.filter(id__in=wanted).values_list("id", "key", "name")}
+    for snapshot, artist_ids in zip(pending, ids):
+        snapshot.payload = decode_payload(artist_ids, snapshot.payload_plays, snapshot.payload_extra, artists)
+        snapshot.payload_pending = False
+        snapshot.payload_artists = {artists[pk][0]: (pk, artists[pk][1]) for pk in artist_ids}
+
+
+def encode_snapshots(snapshots: List[TopArtistSnapshot], with_vectors: bool = True) -> None:
+    """
+    Fill the packed payload fields, and the vector fields, of unsaved snapshots.
+
+    Patched snapshots carry ``known_artists`` (the ``payload_artists`` of
+    the row they replace), so only artists new to them are resolved.
+    """
+    from .vectors import encode_payload, payload_artists, snapshot_vector_fields_many  # see load_payloads
+
+    known: Dict[str, Tuple[int, str]] = {}
+    for snapshot in snapshots:
+        known.update(getattr(snapshot, "known_artists", {}))
+    payloads = [s.payload for s in snapshots]
+    artists = payload_artists(payloads, known)
+    vectors = snapshot_vector_fields_many(payloads, artists) if with_vectors else [{}] * len(snapshots)
+    for snapshot, payload, fields in zip(snapshots, payloads, vectors):
+        for name, value in {**encode_payload(payload, artists), **fields}.items():
+            setattr(snapshot, name, value)
+        snapshot.payload_pending = False
+
+
+def save_snapshots(snapshots: List[TopArtistSnapshot]) -> None:
+    """Insert or overwrite snapshots in one statement, setting their primary keys."""
+    if snapshots:
+        TopArtistSnapshot.objects.bulk_create(
+            snapshots,
+            update_conflicts=True,
+            unique_fields=["user", "period"],
+            update_fields=SNAPSHOT_FIELDS,
+        )
+
+
+def save_users(users: List[LastfmUser]) -> None:
+    if users:
+        LastfmUser.objects.bulk_update(users, USER_INFO_FIELDS)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import h2  # type: ignore  # noqa: F401
+except ImportError:  # pragma: no cover - optional, enables HTTP/2
+    h2 = None
+
+# Connection failures are retried at the transport level; HTTP errors and
+# rate limits are left to LastfmClient and the task retry schedule.
+CONNECT_RETRIES = 2
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def timeouts() -> tuple:
+    """``(connect, read)`` timeouts in seconds for Last.fm calls."""
+    return settings.LASTFM_CONNECT_TIMEOUT, settings.LASTFM_READ_TIMEOUT
+
+
+def build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.LASTFM_HTTP_POOL_SIZE,
+        max_retries=Retry(
+            total=CONNECT_RETRIES,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=0.2,
+            # 429 + Retry-After is handled by LastfmClient, which pauses the
+            # shared rate limiter instead of sleeping here.
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Process-wide keep-alive session shared by every sync LastfmClient."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def build_async_client() -> httpx.AsyncClient:
+    connect, read = timeouts()
+    pool = settings.LASTFM_HTTP_POOL_SIZE
+    transport = httpx.AsyncHTTPTransport(
+        http2=bool(settings.LASTFM_HTTP2 and h2 is not None),
+        limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool, keepalive_expiry=30),
+        retries=CONNECT_RETRIES,
+    )
+    return httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(read, connect=connect))
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Shared async client for the running event loop.
+
+    httpx connections belong to the loop that opened them, so there is one
+    pool per loop (normally just the ASGI server's).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _async_clients[loop] = build_async_client()
+    return client
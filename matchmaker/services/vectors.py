@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import math
+import sys
+from array import array
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import quote_plus
+
+from matchmaker.models import Artist, TopArtistSnapshot
+
+from .lastfm import artist_identifier
+from .scoring import ArtistVector
+
+# Persisted vectors are little-endian int32 artist ids and float32 weights,
+# stored in Last.fm rank order so ties keep their original ordering.
+ID_TYPECODE = "i"
+WEIGHT_TYPECODE = "f"
+# Persisted payloads are columnar: int32 Artist ids and uint32 playcounts in
+# rank order. Names and MBIDs come from the Artist rows and urls are rebuilt
+# from names; ``payload_extra`` only keeps the entries that differ.
+PLAYS_TYPECODE = "I"
+ARTIST_URL = "https://www.last.fm/music/"
+
+# key -> (Artist id, stored name)
+ArtistRows = Dict[str, Tuple[int, str]]
+
+
+def _pack(values: Iterable, typecode: str) -> bytes:
+    packed = array(typecode, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data: bytes, typecode: str) -> array:
+    unpacked = array(typecode)
+    unpacked.frombytes(bytes(data))
+    if sys.byteorder != "little":
+        unpacked.byteswap()
+    return unpacked
+
+
+def ranked_weights(payload: Iterable[Dict]) -> List[Tuple[str, str, float]]:
+    """``(key, name, weight)`` per artist in rank order, deduplicated like build_vector."""
+    weights: Dict[str, Tuple[str, float]] = {}
+    for artist in payload:
+        plays = int(artist.get("playcount", 0))
+        weight = math.log(plays + 1)
+        if weight <= 0:
+            continue
+        key = artist_identifier(artist)
+        weights[key] = (artist.get("name") or key, weight)
+    return [(key, name, weight) for key, (name, weight) in weights.items()]
+
+
+def encode_vector(artist_ids: List[int], weights: List[float]) -> Dict:
+    """Model field values for a vector given in rank order."""
+    packed_weights = _pack(weights, WEIGHT_TYPECODE)
+    # Norm of the float32 weights actually stored, so self-similarity is exact.
+    norm = math.sqrt(sum(w * w for w in _unpack(packed_weights, WEIGHT_TYPECODE)))
+    return {
+        "vector_ids": _pack(artist_ids, ID_TYPECODE),
+        "vector_weights": packed_weights,
+        "vector_norm": norm,
+    }
+
+
+def ensure_artists(entries: Iterable[Tuple[str, str]]) -> ArtistRows:
+    """Artist ids and stored names for ``(key, name)`` pairs, creating missing rows."""
+    names = dict(entries)
+    if not names:
+        return {}
+    Artist.objects.bulk_create(
+        [Artist(key=key, name=name) for key, name in names.items()], ignore_conflicts=True
+    )
+    return {key: (pk, name) for key, pk, name in Artist.objects.filter(key__in=names).values_list("key", "id", "name")}
+
+
+def payload_artists(payloads: Iterable[Iterable[Dict]], known: Optional[ArtistRows] = None) -> ArtistRows:
+    """
+    Artist rows for every artist in ``payloads``, resolved in one batch.
+
+    Artists in ``known`` (see TopArtistSnapshot.payload_artists) are not looked up again.
+    """
+    artists = dict(known or {})
+    wanted = {}
+    for payload in payloads:
+        for artist in payload:
+            key = artist_identifier(artist)
+            if key not in artists:
+                wanted.setdefault(key, artist.get("name") or key)
+    artists.update(ensure_artists(wanted.items()))
+    return artists
+
+
+def snapshot_vector_fields(payload: Iterable[Dict]) -> Dict:
+    """Compute the persisted vector fields for a freshly fetched payload."""
+    return snapshot_vector_fields_many([payload])[0]
+
+
+def snapshot_vector_fields_many(payloads: List[Iterable[Dict]], artists: Optional[ArtistRows] = None) -> List[Dict]:
+    """Vector fields for several payloads; artists missing from ``artists`` are resolved in one batch."""
+    ranked = [ranked_weights(payload) for payload in payloads]
+    artists = dict(artists or {})
+    artists.update(ensure_artists((key, name) for entries in ranked for key, name, _ in entries if key not in artists))
+    return [
+        encode_vector([artists[key][0] for key, _, _ in entries], [weight for _, _, weight in entries])
+        for entries in ranked
+    ]
+
+
+def artist_url(name: str) -> str:
+    return ARTIST_URL + quote_plus(name)
+
+
+def encode_payload(payload: Iterable[Dict], artists: ArtistRows) -> Dict:
+    """Model field values for a payload whose artists are all in ``artists``."""
+    ids, plays = [], []
+    names: Dict[str, str] = {}
+    urls: Dict[str, Optional[str]] = {}
+    for index, artist in enumerate(payload):
+        artist_id, stored_name = artists[artist_identifier(artist)]
+        name = artist.get("name") or ""
+        ids.append(artist_id)
+        plays.append(int(artist.get("playcount", 0)))
+        if name != stored_name:
+            names[str(index)] = name
+        if artist.get("url") != artist_url(name):
+            urls[str(index)] = artist.get("url")
+    extra = {field: values for field, values in (("names", names), ("urls", urls)) if values}
+    return {
+        "payload_ids": _pack(ids, ID_TYPECODE),
+        "payload_plays": _pack(plays, PLAYS_TYPECODE),
+        "payload_extra": extra or None,
+    }
+
+
+def payload_artist_ids(payload_ids: bytes) -> array:
+    return _unpack(payload_ids, ID_TYPECODE)
+
+
+def decode_payload(
+    artist_ids: Iterable[int], plays: bytes, extra: Optional[Dict], artists: Mapping[int, Tuple[str, str]]
+) -> List[Dict]:
+    """
+    The stored payload as the client returns it; ``artists`` maps ids to ``(key, name)``.
+
+    An artist keyed by anything but its lowercased name is keyed by its MBID.
+    """
+    names = (extra or {}).get("names", {})
+    urls = (extra or {}).get("urls", {})
+    payload = []
+    for index, (artist_id, playcount) in enumerate(zip(artist_ids, _unpack(plays, PLAYS_TYPECODE))):
+        key, stored_name = artists[artist_id]
+        name = names.get(str(index), stored_name)
+        payload.append(
+            {
+                "name": name,
+                "mbid": "" if key == name.lower() else key,
+                "playcount": playcount,
+                "url": urls.get(str(index), artist_url(name)),
+            }
+        )
+    return payload
+
+
+def truncate_vector(artist_ids: bytes, weights: bytes, norm: Optional[float], limit: int) -> Tuple[bytes, bytes, float]:
+    """
+    Stored vector fields cut to their first ``limit`` entries, with their norm.
+
+    Vectors are in rank order but skip artists without plays and list each
+    artist once (see ranked_weights), so this is the vector of the first
+    ``limit`` distinct artists with plays. That is the vector of
+    ``payload[:limit]`` unless the chart repeats an artist or holds one
+    with no plays; the cut then reaches further down the chart, which is
+    cheaper than loading the payload to find its exact position.
+    """
+    size = array(ID_TYPECODE).itemsize
+    if norm is None or len(artist_ids) <= limit * size:
+        return artist_ids, weights, norm
+    weights = bytes(weights)[: limit * size]
+    norm = math.sqrt(sum(w * w for w in _unpack(weights, WEIGHT_TYPECODE)))
+    return bytes(artist_ids)[: limit * size], weights, norm
+
+
+def decode_vector(artist_ids: bytes, weights: bytes, norm: float) -> ArtistVector:
+    ranked_ids = _unpack(artist_ids, ID_TYPECODE)
+    ranked_weights_ = _unpack(weights, WEIGHT_TYPECODE)
+    order = sorted(range(len(ranked_ids)), key=ranked_ids.__getitem__)
+    return ArtistVector(
+        (ranked_ids[i] for i in order),
+        (ranked_weights_[i] for i in order),
+        norm=norm,
+        ranked_ids=ranked_ids,
+        ranked_weights=ranked_weights_,
+    )
+
+
+def load_vector(snapshot: TopArtistSnapshot, limit: Optional[int] = None) -> ArtistVector:
+    """
+    The snapshot's stored vector, computing and saving it first if missing.
+
+    With ``limit``, only its first ``limit`` entries (see truncate_vector).
+    """
+    if snapshot.vector_ids is None:
+        fields = snapshot_vector_fields(snapshot.payload)
+        TopArtistSnapshot.objects.filter(pk=snapshot.pk).update(**fields)
+        for name, value in fields.items():
+            setattr(snapshot, name, value)
+    fields = (snapshot.vector_ids, snapshot.vector_weights, snapshot.vector_norm)
+    if limit is not None and limit < snapshot.limit:
+        fields = truncate_vector(*fields, limit)
+    return decode_vector(*fields)
+
+
+def artist_names(artist_ids: Iterable[int]) -> Dict[int, str]:
+    return dict(Artist.objects.filter(id__in=list(artist_ids)).values_list("id", "name"))
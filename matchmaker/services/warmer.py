@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from matchmaker.models import PAYLOAD_FIELDS, MatchRequest, TopArtistSnapshot
+
+from . import admission, delta, metrics
+from .lastfm import LastfmClient, LastfmError, LastfmRateLimitError, cache_marker, claim_refresh, refresh_snapshots
+from .snapshots import load_payloads
+
+logger = logging.getLogger(__name__)
+
+# Most-matched users considered per run; the API budget is far smaller anyway.
+MAX_CANDIDATE_USERS = 1000
+
+
+def match_counts(since: datetime) -> Counter:
+    """Matches per user id created since ``since``, counting both sides."""
+    counts: Counter = Counter()
+    recent = MatchRequest.objects.filter(created_at__gte=since)
+    for field in ("user_a", "user_b"):
+        for row in recent.values(field).annotate(matches=Count("pk")):
+            counts[row[field]] += row["matches"]
+    return counts
+
+
+def warm_candidates(now: Optional[datetime] = None) -> List[TopArtistSnapshot]:
+    """
+    Snapshots of frequently matched users due to go stale within the horizon.
+
+    Most matched users first, then oldest snapshots first; payloads deferred.
+    """
+    now = now or timezone.now()
+    since = now - timezone.timedelta(hours=settings.CACHE_WARM_LOOKBACK_HOURS)
+    popularity = {
+        user_id: matches
+        for user_id, matches in match_counts(since).most_common(MAX_CANDIDATE_USERS)
+        if matches >= settings.CACHE_WARM_MIN_MATCHES
+    }
+    if not popularity:
+        return []
+    due = now - timezone.timedelta(hours=settings.LASTFM_SNAPSHOT_TTL_HOURS - settings.CACHE_WARM_HORIZON_HOURS)
+    snapshots = (
+        TopArtistSnapshot.objects.filter(user_id__in=list(popularity), fetched_at__lt=due)
+        .select_related("user")
+        .defer(*PAYLOAD_FIELDS)
+    )
+    return sorted(snapshots, key=lambda s: (-popularity[s.user_id], s.fetched_at))
+
+
+def _miss_key(snapshot: TopArtistSnapshot) -> Tuple:
+    # Keyed like refresh_snapshots' results; cache_marker drops the limit.
+    return ("top", snapshot.user.username, snapshot.period, snapshot.limit)
+
+
+def _stored_since(batch: List[TopArtistSnapshot]) -> Dict[Tuple, TopArtistSnapshot]:
+    """The snapshots of ``batch`` rewritten since they were loaded, keyed like refresh_snapshots' results."""
+    fetched_at = dict(TopArtistSnapshot.objects.filter(pk__in=[s.pk for s in batch]).values_list("pk", "fetched_at"))
+    return {_miss_key(s): s for s in batch if fetched_at.get(s.pk, s.fetched_at) > s.fetched_at}
+
+
+class _CallCounter:
+    """Proxy for a client that counts the Last.fm calls made through it."""
+
+    def __init__(self, client: LastfmClient):
+        self._client = client
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not name.startswith("get_"):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                self.calls += 1
+            return attr(*args, **kwargs)
+
+        return call
+
+
+def warm(client: LastfmClient, budget: Optional[int] = None) -> Dict:
+    """
+    Refresh due snapshots of popular users before their next match.
+
+    Takes ``warm_candidates`` in order until ``budget`` Last.fm calls
+    (``CACHE_WARM_API_BUDGET``) are spent: one per refresh, or two when a
+    delta patch drifts, so the last batch may overshoot a little. Snapshots
+    with a refresh already queued are skipped. The rest go through the usual
+    rate limiter, single-flight map and fetch lease, in batches of
+    ``LASTFM_FETCH_CONCURRENCY``; a rate limit ends the run, and so does a
+    rate limiter running low (``admission.quota_tight``), which leaves the
+    rest of the quota to interactive matches.
+    """
+    budget = settings.CACHE_WARM_API_BUDGET if budget is None else budget
+    counter = _CallCounter(client)
+    candidates = warm_candidates()
+    remaining = iter(candidates)
+    ttl_hours = settings.LASTFM_SNAPSHOT_TTL_HOURS
+    batch_size = max(1, settings.LASTFM_FETCH_CONCURRENCY)
+    refreshed = 0
+    while counter.calls < budget:
+        if admission.quota_tight():
+            metrics.incr("background_shed_total", task="warm_snapshot_cache")
+            logger.info("Cache warming stopped early: Last.fm quota is low")
+            break
+        # Claimed a batch at a time, so a run that stops early leaves the
+        # rest to lazy refreshes instead of holding their markers.
+        batch = []
+        for snapshot in remaining:
+            if claim_refresh(_miss_key(snapshot)):
+                batch.append(snapshot)
+                if len(batch) >= min(batch_size, budget - counter.calls):
+                    break
+        if not batch:
+            break
+        load_payloads([snapshot for snapshot in batch if delta.can_refresh(snapshot)])
+        results: Dict[Tuple, TopArtistSnapshot] = {}
+        rate_limited = False
+        try:
+            results = refresh_snapshots(
+                counter, batch, ttl_hours=ttl_hours - settings.CACHE_WARM_HORIZON_HOURS, max_workers=len(batch)
+            )
+        except LastfmError as exc:
+            # Snapshots fetched before the error were stored all the same.
+            results = _stored_since(batch)
+            rate_limited = isinstance(exc, LastfmRateLimitError)
+            if rate_limited:
+                logger.info("Cache warming stopped by rate limit: %s", exc)
+            else:
+                logger.warning("Cache warming batch failed: %s", exc)
+        finally:
+            unrefreshed = [_miss_key(snapshot) for snapshot in batch if _miss_key(snapshot) not in results]
+            if unrefreshed:
+                cache.delete_many([cache_marker("refresh", key) for key in unrefreshed])
+        # Consumed by the first fresh hit (lastfm._record_lookups).
+        cache.set_many({cache_marker("warmed", key): 1 for key in results}, timeout=int(ttl_hours * 3600))
+        refreshed += len(results)
+        if rate_limited:
+            break
+
+    metrics.incr("warm_refreshes_total", refreshed)
+    return {"due": len(candidates), "refreshed": refreshed, **warm_stats()}
+
+
+def warm_stats() -> Dict:
+    """
+    Cumulative snapshot cache counters and their ratios.
+
+    ``hit_ratio`` is the share of match snapshot lookups served fresh;
+    ``warm_hit_ratio`` the share of warmer refreshes a match then used.
+    """
+    periods = [period for period in metrics.LOOKUP_PERIODS if period != "profile"]
+    values = {
+        f"snapshot_{state}": metrics.total("cache_lookups_total", period=periods, state=state)
+        for state in ("fresh", "stale", "expired")
+    }
+    values["snapshot_warm_hits"] = metrics.total("snapshot_warm_hits_total")
+    values["warm_refreshes"] = metrics.total("warm_refreshes_total")
+    lookups = values["snapshot_fresh"] + values["snapshot_stale"] + values["snapshot_expired"]
+    return {
+        **values,
+        "hit_ratio": metrics.ratio(values["snapshot_fresh"], lookups),
+        "warm_hit_ratio": metrics.ratio(values["snapshot_warm_hits"], values["warm_refreshes"]),
+    }
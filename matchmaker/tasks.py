@@ -1,26 +1,64 @@
 from __future__ import annotations
 
-import time
+import logging
 
+from celery import shared_task
 from django.conf import settings
-from django.db import transaction
 
-from .models import MatchRequest
+from .models import GroupMatchRequest, LastfmUser, MatchRequest
+from .services import admission, lastfm, metrics, warmer
 from .services.lastfm import (
     LastfmClient,
     LastfmError,
     LastfmRateLimitError,
-    get_or_fetch_user,
-    get_top_artists_with_cache,
+    fetch_match_data,
 )
-from .services.scoring import compute_match
+from .services.group import cached_names, score_group
+from .services.progress import publish_progress
+from .services.results import cache_result, get_cached_result
+from .services.scoring import PERIODS, pick_source_period, score_vectors
+from .services.vectors import artist_names, load_vector
 
+logger = logging.getLogger(__name__)
 
-def run_match(match_id: str) -> None:
+RETRY_BACKOFFS = [5, 15, 45]
+# Times a background refresh steps aside for interactive matches before it is dropped.
+BACKGROUND_MAX_DEFERRALS = 5
+
+
+def _mark_failed(match, exc: Exception) -> None:
+    match.status = "FAILED"
+    match.error_message = str(exc)
+    match.save(update_fields=["status", "error_message", "updated_at"])
+    metrics.incr("matches_total", status="FAILED")
+    publish_progress(str(match.uuid), status="FAILED", error=match.error_message)
+
+
+def _retry_or_fail(task, match, exc: LastfmError) -> None:
     """
-    No-Celery dev mode: run match computation inline in the web request.
+    Reschedule after a Last.fm error, or mark the match failed.
 
-    Retries rate limits with simple sleep backoff (5s, 15s, 45s).
+    Eager tasks fail at once: their retries would rerun immediately, inside
+    the request, without the countdown a rate limit asks for.
+    """
+    attempt = task.request.retries
+    if not settings.CELERY_TASK_ALWAYS_EAGER and attempt < len(RETRY_BACKOFFS):
+        countdown = max(RETRY_BACKOFFS[attempt], getattr(exc, "retry_after", None) or 0)
+        metrics.observe("match_retry_countdown_seconds", countdown)
+        publish_progress(str(match.uuid), step="retrying", countdown=countdown)
+        raise task.retry(exc=exc, countdown=countdown)
+    _mark_failed(match, exc)
+
+
+@shared_task(bind=True, max_retries=len(RETRY_BACKOFFS))
+def run_match(self, match_id: str) -> None:
+    """
+    Fetch both users from Last.fm and store the computed match result.
+
+    Rate limits and API errors are retried by rescheduling the task with a
+    countdown (5s, 15s, 45s) instead of sleeping, so a throttled match never
+    holds a worker slot. With CELERY_TASK_ALWAYS_EAGER the task runs inline
+    and fails on the first such error instead.
     """
     try:
         match = MatchRequest.objects.select_related("user_a", "user_b").get(uuid=match_id)
@@ -30,44 +68,163 @@ def run_match(match_id: str) -> None:
     client = LastfmClient(api_key=settings.LASTFM_API_KEY)
     periods = ["3month", "12month", "overall"]
     limit = 300
+    fetched = []
+    timer = metrics.StageTimer("match_stage_seconds")
+
+    def on_fetched(key) -> None:
+        # Keys are ("info", username) or ("top", username, period, limit).
+        fetched.append(key)
+        publish_progress(
+            match_id, step="fetched", user=key[1], period=key[2] if key[0] == "top" else "profile", done=len(fetched)
+        )
+
+    try:
+        publish_progress(match_id, step="fetching")
+        with timer.stage("fetch"):
+            users, snapshots, stale = fetch_match_data(
+                client,
+                [match.user_a.username, match.user_b.username],
+                periods,
+                limit=limit,
+                max_workers=settings.LASTFM_FETCH_CONCURRENCY,
+                on_fetched=on_fetched,
+            )
+        user_a = users[match.user_a.username]
+        user_b = users[match.user_b.username]
+        snapshots_a, snapshots_b = snapshots[user_a.username], snapshots[user_b.username]
+        with timer.stage("result_cache"):
+            result = get_cached_result(user_a.username, user_b.username, snapshots_a, snapshots_b, limit)
+        if result is None:
+            publish_progress(match_id, step="scoring")
+            with timer.stage("vectors"):
+                vectors_a = {p: load_vector(s, limit) for p, s in snapshots_a.items()}
+                vectors_b = {p: load_vector(s, limit) for p, s in snapshots_b.items()}
+
+            source_period = pick_source_period(lambda p: bool(vectors_a.get(p)), settings.MATCH_SOURCE_PERIOD)
+            with timer.stage("scoring", cpu_metric="match_scoring_cpu_seconds"):
+                result = score_vectors(vectors_a, vectors_b, source_period, artist_names, top_k=settings.MATCH_TOP_K)
+            cache_result(user_a.username, user_b.username, snapshots_a, snapshots_b, result, limit)
+        match.result = {
+            "user_a": user_a.username,
+            "user_b": user_b.username,
+            **result,
+            "stale": sorted(f"{username}/{period}" for username, period in stale),
+            "refreshing": lastfm.refresh_pending(stale, limit),
+        }
+        match.status = "READY"
+        match.error_message = ""
+        match.timings = timer.finish(fetched=len(fetched), stale=len(stale))
+        match.save(update_fields=["result", "timings", "status", "error_message", "updated_at"])
+        metrics.incr("matches_total", status="READY")
+        publish_progress(match_id, status="READY")
+
+    except (LastfmRateLimitError, LastfmError) as exc:
+        _retry_or_fail(self, match, exc)
+
+    except Exception as exc:  # protective catch
+        _mark_failed(match, exc)
+
+
+@shared_task(bind=True, max_retries=len(RETRY_BACKOFFS))
+def run_group_match(self, group_id: str) -> None:
+    """
+    Score every pair in a group from one concurrent fetch of all members.
+
+    Each user's snapshots are fetched (or read from cache) and decoded once,
+    however many pairs they appear in; retries work like ``run_match``.
+    """
+    try:
+        group = GroupMatchRequest.objects.get(uuid=group_id)
+    except GroupMatchRequest.DoesNotExist:
+        return
+
+    client = LastfmClient(api_key=settings.LASTFM_API_KEY)
+    limit = 300
+    try:
+        _, snapshots, stale = fetch_match_data(
+            client,
+            group.usernames,
+            PERIODS,
+            limit=limit,
+            max_workers=settings.LASTFM_FETCH_CONCURRENCY,
+        )
+        vectors = {
+            username: {p: load_vector(s, limit) for p, s in by_period.items()}
+            for username, by_period in snapshots.items()
+        }
+        group.result = {
+            **score_group(
+                group.usernames,
+                vectors,
+                cached_names(artist_names),
+                top_k=settings.MATCH_TOP_K,
+                source_period=settings.MATCH_SOURCE_PERIOD,
+            ),
+            "stale": sorted(f"{username}/{period}" for username, period in stale),
+            "refreshing": lastfm.refresh_pending(stale, limit),
+        }
+        group.status = "READY"
+        group.error_message = ""
+        group.save(update_fields=["result", "status", "error_message", "updated_at"])
+        metrics.incr("matches_total", status="READY")
+
+    except (LastfmRateLimitError, LastfmError) as exc:
+        _retry_or_fail(self, group, exc)
+
+    except Exception as exc:  # protective catch
+        _mark_failed(group, exc)
+
+
+def _shed(task, name: str) -> None:
+    """
+    Put background work behind interactive matches while Last.fm quota is low.
+
+    Eager tasks are dropped: their retries would rerun at once, inside the
+    request that queued them.
+    """
+    metrics.incr("background_shed_total", task=name)
+    if not settings.CELERY_TASK_ALWAYS_EAGER and task.request.retries < BACKGROUND_MAX_DEFERRALS:
+        raise task.retry(countdown=settings.LASTFM_BACKGROUND_RETRY_SECONDS)
+    logger.info("Dropped %s: Last.fm quota stayed low", name)
+
+
+@shared_task(bind=True, max_retries=BACKGROUND_MAX_DEFERRALS)
+def refresh_user(self, username: str) -> None:
+    """Background refresh for a profile served stale from the cache."""
+    user = LastfmUser.objects.filter(username=username).first()
+    if user is None:
+        return
+    if admission.quota_tight():
+        return _shed(self, "refresh_user")
+    try:
+        lastfm.refresh_user(LastfmClient(api_key=settings.LASTFM_API_KEY), user)
+    except LastfmError as exc:
+        logger.warning("Background refresh of %s failed: %s", username, exc)
+
+
+@shared_task(bind=True, max_retries=BACKGROUND_MAX_DEFERRALS)
+def refresh_top_artists(self, username: str, period: str, limit: int = 300) -> None:
+    """Background refresh for a top-artists snapshot served stale from the cache."""
+    user = LastfmUser.objects.filter(username=username).first()
+    if user is None:
+        return
+    if admission.quota_tight():
+        return _shed(self, "refresh_top_artists")
+    try:
+        lastfm.refresh_top_artists(
+            LastfmClient(api_key=settings.LASTFM_API_KEY), user, period, limit=limit
+        )
+    except LastfmError as exc:
+        logger.warning("Background refresh of %s/%s failed: %s", username, period, exc)
+
 
-    backoffs = [5, 15, 45]
-
-    for attempt in range(len(backoffs) + 1):
-        try:
-            with transaction.atomic():
-                user_a = get_or_fetch_user(client, match.user_a.username)
-                user_b = get_or_fetch_user(client, match.user_b.username)
-
-            payloads_a = {}
-            payloads_b = {}
-            for period in periods:
-                payloads_a[period] = get_top_artists_with_cache(client, user_a, period, limit=limit)
-                payloads_b[period] = get_top_artists_with_cache(client, user_b, period, limit=limit)
-
-            result = compute_match(payloads_a, payloads_b)
-            match.result = {
-                "user_a": user_a.username,
-                "user_b": user_b.username,
-                **result,
-            }
-            match.status = "READY"
-            match.error_message = ""
-            match.save(update_fields=["result", "status", "error_message", "updated_at"])
-            return
-
-        except (LastfmRateLimitError, LastfmError) as exc:
-            if attempt < len(backoffs):
-                time.sleep(backoffs[attempt])
-                continue
-
-            match.status = "FAILED"
-            match.error_message = str(exc)
-            match.save(update_fields=["status", "error_message", "updated_at"])
-            return
-
-        except Exception as exc:  # protective catch
-            match.status = "FAILED"
-            match.error_message = str(exc)
-            match.save(update_fields=["status", "error_message", "updated_at"])
-            return
+@shared_task
+def warm_snapshot_cache() -> dict:
+    """Beat job: refresh popular users' snapshots before a match finds them stale."""
+    stats = warmer.warm(LastfmClient(api_key=settings.LASTFM_API_KEY))
+    logger.info(
+        "Cache warmer refreshed %(refreshed)s of %(due)s due snapshots "
+        "(hit ratio %(hit_ratio)s, warm hit ratio %(warm_hit_ratio)s)",
+        stats,
+    )
+    return stats
@@ -6,4 +6,12 @@ urlpatterns = [
     path("", views.home, name="home"),
     path("match/<uuid:match_id>/", views.match_detail, name="match_detail"),
     path("match/<uuid:match_id>/status/", views.match_status, name="match_status"),
+    path("match/<uuid:match_id>/events/", views.match_events, name="match_events"),
+    path("api/matches/<uuid:match_id>/", views.match_api, name="match_api"),
+    path("group/", views.group_match, name="group_match"),
+    path("group/<uuid:group_id>/", views.group_detail, name="group_detail"),
+    path("group/<uuid:group_id>/status/", views.group_status, name="group_status"),
+    path("users/<str:username>/matches/", views.best_matches, name="best_matches"),
+    path("api/users/<str:username>/matches/", views.best_matches_api, name="best_matches_api"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
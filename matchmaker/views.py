@@ -1,21 +1,73 @@
+import asyncio
+import hashlib
 import json
-from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+import math
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.cache import add_never_cache_headers, get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .forms import GroupMatchForm, MatchForm
+from .models import GroupMatchRequest, MatchRequest, LastfmUser
+from .services import metrics, progress
+from .services.admission import client_address, count_submission, pending_match, submission_retry_after
+from .services.breaker import get_circuit_breaker
+from .services.results import cached_match
+from .services.snapshots import load_users
+from .services.similarity import best_matches_for
+from .tasks import run_group_match, run_match
+
+BEST_MATCHES_DEFAULT_K = 20
+BEST_MATCHES_MAX_K = 100
+
+# Seconds between SSE keep-alives; each one also re-checks the match row.
+MATCH_EVENTS_HEARTBEAT = 10
+# How often the row is re-checked instead when worker events cannot arrive.
+MATCH_EVENTS_POLL_SECONDS = 1.5
+# Streams end after this long and EventSource reconnects on its own.
+MATCH_EVENTS_MAX_SECONDS = 120
+MATCH_EVENTS_RETRY_MS = 1500
+
 
-from .forms import MatchForm
-from .models import MatchRequest, LastfmUser
-from .tasks import run_match
+def _throttled(request: HttpRequest, template: str, form) -> Optional[HttpResponse]:
+    """
+    A 429 re-rendering ``form`` once the client has queued too many matches.
+
+    Checked before the submission touches the database, so a throttled
+    client cannot create rows either.
+    """
+    retry_after = submission_retry_after(client_address(request))
+    if retry_after is None:
+        return None
+    metrics.incr("match_submissions_total", outcome="throttled")
+    seconds = math.ceil(retry_after)
+    form.add_error(None, f"Too many matches from your address. Try again in {seconds} seconds.")
+    response = render(request, template, {"form": form}, status=429)
+    response["Retry-After"] = str(seconds)
+    return response
 
 
 def home(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         form = MatchForm(request.POST)
         if form.is_valid():
+            throttled = _throttled(request, "matchmaker/home.html", form)
+            if throttled is not None:
+                return throttled
             username_a = form.cleaned_data["username_a"]
             username_b = form.cleaned_data["username_b"]
-            user_a, _ = LastfmUser.objects.get_or_create(username=username_a)
-            user_b, _ = LastfmUser.objects.get_or_create(username=username_b)
+            users = load_users([username_a, username_b])
+            user_a, user_b = users[username_a], users[username_b]
+            cached = cached_match(user_a, user_b) if username_a != username_b else None
+            # Same pair already queued: follow that match rather than run it twice.
+            pending = pending_match(user_a, user_b) if username_a != username_b and cached is None else None
             if username_a == username_b:
                 match = MatchRequest.objects.create(
                     user_a=user_a,
@@ -30,10 +82,23 @@ def home(request: HttpRequest) -> HttpResponse:
                         "warning": "Comparing a user to themselves; automatically 100%.",
                     },
                 )
+            elif cached is not None:
+                metrics.incr("match_submissions_total", outcome="cached")
+                match = MatchRequest.objects.create(
+                    user_a=user_a,
+                    user_b=user_b,
+                    status="READY",
+                    result={"user_a": username_a, "user_b": username_b, **cached, "stale": []},
+                )
+            elif pending is not None:
+                metrics.incr("match_submissions_total", outcome="deduplicated")
+                match = pending
             else:
+                count_submission(client_address(request))
+                metrics.incr("match_submissions_total", outcome="queued")
                 match = MatchRequest.objects.create(user_a=user_a, user_b=user_b, status="PENDING")
                 try:
-                    run_match(str(match.uuid))
+                    run_match.delay(str(match.uuid))
                 except Exception as exc:
                     match.status = "FAILED"
                     match.error_message = str(exc)
@@ -44,10 +109,60 @@ def home(request: HttpRequest) -> HttpResponse:
     return render(request, "matchmaker/home.html", {"form": form})
 
 
-def match_detail(request: HttpRequest, match_id: str) -> HttpResponse:
-    match = get_object_or_404(MatchRequest, uuid=match_id)
-    if match.status == "PENDING":
-        return render(request, "matchmaker/match_loading.html", {"match": match})
+def _match_version(match_id: str) -> Tuple[str, datetime]:
+    """``(status, updated_at)`` of a match, without loading its result."""
+    row = MatchRequest.objects.filter(uuid=match_id).values_list("status", "updated_at").first()
+    if row is None:
+        raise Http404
+    return row
+
+
+def _pending(response: HttpResponse) -> HttpResponse:
+    add_never_cache_headers(response)
+    return response
+
+
+def _finished_response(
+    request: HttpRequest,
+    variant: str,
+    match_id: str,
+    updated_at: datetime,
+    build: Callable[[], HttpResponse],
+    revalidate: bool = False,
+) -> HttpResponse:
+    """
+    A finished match's ``variant`` (page, JSON or status), which never changes again.
+
+    Conditional requests are answered from ``updated_at`` alone; otherwise
+    the response is built once and reused from the cache. ``revalidate``
+    responses are sent with ``no-cache`` instead of a max-age, so clients
+    check their copy against the ETag on every use.
+    """
+    version = f"{variant}:{match_id}:{updated_at.timestamp():.6f}:{settings.MATCH_PAGE_VERSION}"
+    digest = hashlib.sha1(version.encode()).hexdigest()
+    etag = quote_etag(digest)
+    last_modified = int(updated_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        key = "matchmaker:page:" + digest
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = build()
+            cache.set(key, (response.content, response["Content-Type"]), timeout=settings.MATCH_PAGE_CACHE_SECONDS)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if revalidate:
+        patch_cache_control(response, public=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MATCH_PAGE_MAX_AGE)
+    return response
+
+
+def _render_match_detail(request: HttpRequest, match_id: str) -> HttpResponse:
+    match = MatchRequest.objects.select_related("user_a", "user_b").get(uuid=match_id)
     if match.status == "FAILED":
         return render(request, "matchmaker/match_detail.html", {"match": match, "error": match.error_message})
 
@@ -63,15 +178,229 @@ def match_detail(request: HttpRequest, match_id: str) -> HttpResponse:
     )
 
 
-def match_status(request: HttpRequest, match_id: str) -> JsonResponse:
-    try:
-        match = MatchRequest.objects.get(uuid=match_id)
-    except MatchRequest.DoesNotExist:
-        raise Http404
+def match_detail(request: HttpRequest, match_id: str) -> HttpResponse:
+    status, updated_at = _match_version(match_id)
+    if status == "PENDING":
+        match = get_object_or_404(MatchRequest, uuid=match_id)
+        return _pending(render(request, "matchmaker/match_loading.html", {"match": match}))
+    # The page links static files that a deploy replaces; a copy held by a
+    # browser or CDN has to be revalidated (MATCH_PAGE_VERSION is in the ETag).
+    return _finished_response(
+        request, "page", match_id, updated_at, lambda: _render_match_detail(request, match_id), revalidate=True
+    )
 
-    data = {"status": match.status}
+
+def _match_data(match: MatchRequest) -> Dict:
+    data = {
+        "uuid": str(match.uuid),
+        "status": match.status,
+        "user_a": match.user_a.username,
+        "user_b": match.user_b.username,
+    }
     if match.status == "READY":
-        data["redirect"] = reverse("match_detail", args=[match.uuid])
+        data["result"] = match.result or {}
     if match.status == "FAILED":
         data["error"] = match.error_message
+    return data
+
+
+def match_api(request: HttpRequest, match_id: str) -> HttpResponse:
+    """The match as JSON: ``result`` once READY, ``error`` once FAILED."""
+    status, updated_at = _match_version(match_id)
+    if status == "PENDING":
+        return _pending(JsonResponse({"uuid": str(match_id), "status": status}))
+    return _finished_response(
+        request,
+        "json",
+        match_id,
+        updated_at,
+        lambda: JsonResponse(_match_data(MatchRequest.objects.select_related("user_a", "user_b").get(uuid=match_id))),
+    )
+
+
+def _lastfm_state() -> Dict[str, str]:
+    """Circuit breaker state per Last.fm method, so a waiting page can tell an outage from a slow fetch."""
+    return get_circuit_breaker().states(metrics.LASTFM_METHODS)
+
+
+def match_status(request: HttpRequest, match_id: str) -> HttpResponse:
+    status, updated_at = _match_version(match_id)
+    if status == "PENDING":
+        return _pending(JsonResponse({"status": status, "lastfm": _lastfm_state()}))
+
+    def build() -> JsonResponse:
+        data = {"status": status}
+        if status == "READY":
+            data["redirect"] = reverse("match_detail", args=[match_id])
+        if status == "FAILED":
+            data["error"] = MatchRequest.objects.values_list("error_message", flat=True).get(uuid=match_id)
+        return JsonResponse(data)
+
+    return _finished_response(request, "status", match_id, updated_at, build)
+
+
+def _sse(event: Dict, retry_ms: Optional[int] = None) -> str:
+    retry = f"retry: {retry_ms}\n" if retry_ms else ""
+    return f"{retry}data: {json.dumps(event)}\n\n"
+
+
+async def _finished_event(match_id: str) -> Optional[Dict]:
+    match = await MatchRequest.objects.filter(uuid=match_id).only("status", "error_message").afirst()
+    if match is None or match.status == "PENDING":
+        return None
+    if match.status == "READY":
+        return {"status": "READY", "redirect": reverse("match_detail", args=[match_id])}
+    return {"status": "FAILED", "error": match.error_message}
+
+
+async def _current_event(match_id: str) -> Dict:
+    event = await _finished_event(match_id) or await progress.last_progress(match_id)
+    return event or {"status": "PENDING"}
+
+
+async def _match_event_stream(match_id: str) -> AsyncIterator[str]:
+    # Subscribe before reading the row so a change in between is not missed.
+    subscription = await progress.subscribe(match_id)
+    try:
+        event = await _current_event(match_id)
+        yield _sse(event, retry_ms=MATCH_EVENTS_RETRY_MS)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + MATCH_EVENTS_MAX_SECONDS
+        wait = MATCH_EVENTS_HEARTBEAT if progress.reaches_workers() else MATCH_EVENTS_POLL_SECONDS
+        while event["status"] == "PENDING" and loop.time() < deadline:
+            event = await subscription.get(timeout=wait)
+            if event is None:
+                # Nothing published, or a worker in another process without
+                # PROGRESS_REDIS_URL: fall back to the row itself.
+                event = await _finished_event(match_id)
+                if event is None:
+                    event = {"status": "PENDING"}
+                    yield ": keep-alive\n\n"
+                    continue
+            elif event["status"] != "PENDING":
+                event = await _finished_event(match_id) or event
+            yield _sse(event)
+    finally:
+        await subscription.close()
+
+
+async def match_events(request: HttpRequest, match_id: str) -> HttpResponse:
+    """Server-sent events for a pending match: progress steps, then READY or FAILED."""
+    match_id = str(match_id)
+    if not await MatchRequest.objects.filter(uuid=match_id).aexists():
+        raise Http404
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_match_event_stream(match_id), content_type="text/event-stream")
+    else:
+        # A WSGI server would buffer the whole stream, so send the current
+        # state once and let EventSource reconnect after MATCH_EVENTS_RETRY_MS.
+        event = await _current_event(match_id)
+        response = HttpResponse(_sse(event, retry_ms=MATCH_EVENTS_RETRY_MS), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _best_matches(request: HttpRequest, username: str):
+    user = get_object_or_404(LastfmUser, username=username)
+    try:
+        top_k = int(request.GET.get("k", BEST_MATCHES_DEFAULT_K))
+    except ValueError:
+        top_k = BEST_MATCHES_DEFAULT_K
+    top_k = max(1, min(top_k, BEST_MATCHES_MAX_K))
+    return user, best_matches_for(user, top_k=top_k)
+
+
+def best_matches(request: HttpRequest, username: str) -> HttpResponse:
+    user, matches = _best_matches(request, username)
+    return render(
+        request,
+        "matchmaker/best_matches.html",
+        {"profile": user, "matches": matches},
+    )
+
+
+def best_matches_api(request: HttpRequest, username: str) -> JsonResponse:
+    user, matches = _best_matches(request, username)
+    if matches is None:
+        return JsonResponse(
+            {"username": user.username, "error": "No fresh Last.fm data for this user yet."},
+            status=404,
+        )
+    return JsonResponse({"username": user.username, "matches": matches})
+
+
+def group_match(request: HttpRequest) -> HttpResponse:
+    if request.method == "POST":
+        form = GroupMatchForm(request.POST)
+        if form.is_valid():
+            throttled = _throttled(request, "matchmaker/group_form.html", form)
+            if throttled is not None:
+                return throttled
+            count_submission(client_address(request))
+            group = GroupMatchRequest.objects.create(usernames=form.cleaned_data["usernames"])
+            try:
+                run_group_match.delay(str(group.uuid))
+            except Exception as exc:
+                group.status = "FAILED"
+                group.error_message = str(exc)
+                group.save(update_fields=["status", "error_message", "updated_at"])
+            return redirect(reverse("group_detail", args=[group.uuid]))
+    else:
+        form = GroupMatchForm()
+    return render(request, "matchmaker/group_form.html", {"form": form})
+
+
+def group_detail(request: HttpRequest, group_id: str) -> HttpResponse:
+    group = get_object_or_404(GroupMatchRequest, uuid=group_id)
+    if group.status == "PENDING":
+        return render(
+            request,
+            "matchmaker/match_loading.html",
+            {"match": group, "status_url": reverse("group_status", args=[group.uuid])},
+        )
+    if group.status == "FAILED":
+        return render(request, "matchmaker/group_detail.html", {"group": group, "error": group.error_message})
+
+    result = group.result or {}
+    usernames = result.get("usernames", [])
+    rows = [
+        {"username": username, "scores": scores}
+        for username, scores in zip(usernames, result.get("matrix", []))
+    ]
+    return render(
+        request,
+        "matchmaker/group_detail.html",
+        {"group": group, "result": result, "usernames": usernames, "rows": rows},
+    )
+
+
+def group_status(request: HttpRequest, group_id: str) -> JsonResponse:
+    try:
+        group = GroupMatchRequest.objects.get(uuid=group_id)
+    except GroupMatchRequest.DoesNotExist:
+        raise Http404
+
+    data = {"status": group.status, "usernames": group.usernames}
+    if group.status == "PENDING":
+        data["lastfm"] = _lastfm_state()
+    if group.status == "READY":
+        data["redirect"] = reverse("group_detail", args=[group.uuid])
+        data["result"] = group.result
+    if group.status == "FAILED":
+        data["error"] = group.error_message
     return JsonResponse(data)
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Prometheus scrape endpoint; requires ``Authorization: Bearer <METRICS_TOKEN>``.
+
+    Without a token it is only served with DEBUG on, and is a 404 otherwise.
+    """
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        raise Http404
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
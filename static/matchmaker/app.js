@@ -1,4 +1,27 @@
 (() => {
+  const handleStatus = (data) => {
+    if (data.status === "READY" && data.redirect) {
+      window.location = data.redirect;
+    } else if (data.status === "FAILED") {
+      window.location.reload();
+    }
+  };
+
+  const describeProgress = (data) => {
+    switch (data.step) {
+      case "fetching":
+        return "Fetching stats from Last.fm...";
+      case "fetched":
+        return `Fetched ${data.user} · ${data.period} (${data.done} done)`;
+      case "scoring":
+        return "Comparing tastes...";
+      case "retrying":
+        return `Last.fm is busy, retrying in ${data.countdown}s...`;
+      default:
+        return null;
+    }
+  };
+
   const startMatchPolling = () => {
     const statusUrl = document.body?.dataset?.statusUrl;
     if (!statusUrl) return;
@@ -8,13 +31,7 @@
     const checkStatus = () => {
       fetch(statusUrl, { headers: { Accept: "application/json" } })
         .then((r) => r.json())
-        .then((data) => {
-          if (data.status === "READY" && data.redirect) {
-            window.location = data.redirect;
-          } else if (data.status === "FAILED") {
-            window.location.reload();
-          }
-        })
+        .then(handleStatus)
         .catch(() => {});
     };
 
@@ -22,6 +39,42 @@
     setInterval(checkStatus, refreshMs);
   };
 
+  // Server-sent events push status and progress; polling is the fallback
+  // when EventSource is missing or the stream never opens.
+  const startMatchEvents = () => {
+    const eventsUrl = document.body?.dataset?.eventsUrl;
+    if (!eventsUrl || !window.EventSource) return false;
+
+    const progressEl = document.querySelector("[data-progress]");
+    const source = new EventSource(eventsUrl);
+    let opened = false;
+
+    source.onopen = () => {
+      opened = true;
+    };
+    source.onmessage = (event) => {
+      let data;
+      try {
+        data = JSON.parse(event.data);
+      } catch (err) {
+        return;
+      }
+      const text = describeProgress(data);
+      if (text && progressEl) progressEl.textContent = text;
+      if (data.status !== "PENDING") {
+        source.close();
+        handleStatus(data);
+      }
+    };
+    source.onerror = () => {
+      if (!opened) {
+        source.close();
+        startMatchPolling();
+      }
+    };
+    return true;
+  };
+
   const setupCopyLink = () => {
     const btn = document.querySelector("[data-copy-link]");
     if (!btn || !navigator?.clipboard) return;
@@ -33,6 +86,6 @@
 
   window.addEventListener("DOMContentLoaded", () => {
     setupCopyLink();
-    startMatchPolling();
+    if (!startMatchEvents()) startMatchPolling();
   });
 })();
@@ -1,6 +1,9 @@
 import os
+import sys
 from pathlib import Path
+from urllib.parse import parse_qsl, unquote, urlparse
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -71,12 +74,58 @@ TEMPLATES = [
 WSGI_APPLICATION = "taste_matchmaker.wsgi.application"
 ASGI_APPLICATION = "taste_matchmaker.asgi.application"
 
-DATABASES = {
-    "default": {
+
+def _database_from_url(url: str) -> dict:
+    """Django DATABASES entry for a ``postgres://`` or ``sqlite:///`` URL."""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return _sqlite_database(parsed.path[1:] or "db.sqlite3")
+    if parsed.scheme not in {"postgres", "postgresql", "pgsql"}:
+        raise ImproperlyConfigured(f"Unsupported DATABASE_URL scheme: {parsed.scheme!r}")
+
+    options = dict(parse_qsl(parsed.query))
+    pool = os.environ.get("DB_POOL", "0").lower() in {"1", "true", "yes", "on"}
+    if pool:
+        # psycopg_pool keeps connections open itself; Django forbids combining
+        # it with CONN_MAX_AGE.
+        options["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+            "timeout": int(os.environ.get("DB_POOL_TIMEOUT", "10")),
+        }
+    return {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": unquote(parsed.path.lstrip("/")),
+        "USER": unquote(parsed.username or ""),
+        "PASSWORD": unquote(parsed.password or ""),
+        "HOST": parsed.hostname or "",
+        "PORT": str(parsed.port or ""),
+        "CONN_MAX_AGE": 0 if pool else int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": options,
+    }
+
+
+def _sqlite_database(name) -> dict:
+    return {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": BASE_DIR / name,
+        "OPTIONS": {
+            # WAL lets readers run alongside the single writer; NORMAL is
+            # durable across app crashes and much cheaper than FULL under WAL.
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+            # Seconds to wait on a locked database (busy_timeout) before failing.
+            "timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", "20")),
+            # Take the write lock at BEGIN so concurrent writers queue on the
+            # busy timeout instead of failing on a read-to-write upgrade.
+            "transaction_mode": "IMMEDIATE",
+        },
     }
-}
+
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+DATABASES = {"default": _database_from_url(DATABASE_URL) if DATABASE_URL else _sqlite_database("db.sqlite3")}
 
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -99,12 +148,150 @@ if whitenoise:
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Set CACHE_REDIS_URL to share caches (and fetch leases) between processes.
+# Metrics counters get their own alias so culling never drops them.
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "")
+if CACHE_REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+        },
+        "metrics": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            # LRU: least recently read entries are culled first.
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        },
+        "metrics": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "metrics",
+            # A few hundred fixed series; never culled.
+            "OPTIONS": {"MAX_ENTRIES": sys.maxsize},
+        },
+    }
+
+# Match progress events for the SSE endpoint. Without Redis they only reach
+# subscribers in the process running the task (eager mode).
+PROGRESS_REDIS_URL = os.environ.get("PROGRESS_REDIS_URL", "")
+
+# Computed match results, keyed by the snapshots they were scored from.
+MATCH_RESULT_CACHE_SECONDS = int(os.environ.get("MATCH_RESULT_CACHE_SECONDS", 12 * 3600))
+# Shared artists and recommendations listed per match, and the period they
+# are picked from (empty: overall, else 12month, else 3month).
+MATCH_TOP_K = int(os.environ.get("MATCH_TOP_K", 10))
+MATCH_SOURCE_PERIOD = os.environ.get("MATCH_SOURCE_PERIOD", "")
+
+# READY and FAILED matches never change. Their pages, JSON and status get
+# ETag/Last-Modified; JSON and status also get Cache-Control max-age
+# MATCH_PAGE_MAX_AGE, while pages are always revalidated. The rendered
+# responses are cached for MATCH_PAGE_CACHE_SECONDS. Bump MATCH_PAGE_VERSION
+# when templates or static files change.
+MATCH_PAGE_MAX_AGE = int(os.environ.get("MATCH_PAGE_MAX_AGE", 24 * 3600))
+MATCH_PAGE_CACHE_SECONDS = int(os.environ.get("MATCH_PAGE_CACHE_SECONDS", 24 * 3600))
+MATCH_PAGE_VERSION = os.environ.get("MATCH_PAGE_VERSION", "1")
+
+# Admission control for match submissions: at most MATCH_SUBMIT_LIMIT
+# queued matches per client IP per window (0 disables), and a pair already
+# PENDING for less than MATCH_DEDUPE_SECONDS is handed out again instead of
+# queued twice. Set TRUSTED_PROXY_COUNT to the number of reverse proxies in
+# front of the app so the client IP is read from X-Forwarded-For.
+MATCH_SUBMIT_LIMIT = int(os.environ.get("MATCH_SUBMIT_LIMIT", "10"))
+MATCH_SUBMIT_WINDOW_SECONDS = int(os.environ.get("MATCH_SUBMIT_WINDOW_SECONDS", "60"))
+MATCH_DEDUPE_SECONDS = int(os.environ.get("MATCH_DEDUPE_SECONDS", "600"))
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "0"))
+
+# Bearer token required by /metrics; without one it is only served with DEBUG on.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 CELERY_TASK_DEFAULT_QUEUE = "matchmaker"
+# One queue per kind of work: matches someone is waiting on (interactive),
+# stale-data refreshes and the cache warmer (background), and group matches
+# (bulk). A worker consuming only `interactive` is never stuck behind the
+# others. Unrouted tasks use the default queue.
+CELERY_TASK_ROUTES = {
+    "matchmaker.tasks.run_match": {"queue": "interactive"},
+    "matchmaker.tasks.refresh_user": {"queue": "background"},
+    "matchmaker.tasks.refresh_top_artists": {"queue": "background"},
+    "matchmaker.tasks.warm_snapshot_cache": {"queue": "background"},
+    "matchmaker.tasks.run_group_match": {"queue": "bulk"},
+}
+# Reserve one task at a time, so a long task does not hold others back.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 CELERY_TASK_ALWAYS_EAGER = os.environ.get(
     "CELERY_TASK_ALWAYS_EAGER", "1" if DEBUG else "0"
 ).lower() in {"1", "true", "yes", "on"}
-CELERY_TASK_EAGER_PROPAGATES = CELERY_TASK_ALWAYS_EAGER
+# run_match records its own failures; propagating in eager mode would also
+# surface celery's Retry out of the inline countdown retries.
+CELERY_TASK_EAGER_PROPAGATES = False
+
+# Cache warmer (run by `celery -A taste_matchmaker beat`): every interval,
+# refresh snapshots due within CACHE_WARM_HORIZON_HOURS of going stale for
+# users in at least CACHE_WARM_MIN_MATCHES matches over the lookback window,
+# spending at most CACHE_WARM_API_BUDGET Last.fm calls. 0 disables it.
+CACHE_WARM_INTERVAL_SECONDS = int(os.environ.get("CACHE_WARM_INTERVAL_SECONDS", "900"))
+CACHE_WARM_API_BUDGET = int(os.environ.get("CACHE_WARM_API_BUDGET", "60"))
+CACHE_WARM_HORIZON_HOURS = float(os.environ.get("CACHE_WARM_HORIZON_HOURS", "1"))
+CACHE_WARM_LOOKBACK_HOURS = int(os.environ.get("CACHE_WARM_LOOKBACK_HOURS", "72"))
+CACHE_WARM_MIN_MATCHES = int(os.environ.get("CACHE_WARM_MIN_MATCHES", "2"))
+CELERY_BEAT_SCHEDULE = (
+    {
+        "warm-snapshot-cache": {
+            "task": "matchmaker.tasks.warm_snapshot_cache",
+            "schedule": CACHE_WARM_INTERVAL_SECONDS,
+        }
+    }
+    if CACHE_WARM_INTERVAL_SECONDS
+    else {}
+)
 
 LASTFM_API_KEY = os.environ.get("LASTFM_API_KEY", "")
+LASTFM_BASE_URL = os.environ.get("LASTFM_BASE_URL", "https://ws.audioscrobbler.com/2.0/")
+# Shared keep-alive pools for the sync and async Last.fm clients.
+LASTFM_CONNECT_TIMEOUT = float(os.environ.get("LASTFM_CONNECT_TIMEOUT", "3.05"))
+LASTFM_READ_TIMEOUT = float(os.environ.get("LASTFM_READ_TIMEOUT", "15"))
+LASTFM_HTTP_POOL_SIZE = int(os.environ.get("LASTFM_HTTP_POOL_SIZE", "16"))
+# HTTP/2 for AsyncLastfmClient; needs the h2 package (httpx[http2]).
+LASTFM_HTTP2 = os.environ.get("LASTFM_HTTP2", "0").lower() in {"1", "true", "yes", "on"}
+# Upper bound on parallel Last.fm requests issued for a single match.
+LASTFM_FETCH_CONCURRENCY = int(os.environ.get("LASTFM_FETCH_CONCURRENCY", "8"))
+# Client-side token bucket shared by every LastfmClient. Set
+# LASTFM_RATE_LIMIT_REDIS_URL to share it across web and worker processes.
+LASTFM_RATE_LIMIT_PER_SECOND = float(os.environ.get("LASTFM_RATE_LIMIT_PER_SECOND", "5"))
+LASTFM_RATE_LIMIT_BURST = float(os.environ.get("LASTFM_RATE_LIMIT_BURST", "5"))
+LASTFM_RATE_LIMIT_MAX_WAIT = float(os.environ.get("LASTFM_RATE_LIMIT_MAX_WAIT", "10"))
+LASTFM_RATE_LIMIT_REDIS_URL = os.environ.get("LASTFM_RATE_LIMIT_REDIS_URL", "")
+# Circuit breaker per Last.fm method: this many consecutive 5xx/network
+# failures make calls fail fast for the cooldown, then one probe is let
+# through. State lives in the cache (CACHE_REDIS_URL to share it); 0 disables.
+LASTFM_BREAKER_FAILURES = int(os.environ.get("LASTFM_BREAKER_FAILURES", "5"))
+LASTFM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LASTFM_BREAKER_COOLDOWN_SECONDS", "30"))
+# Background refreshes and the cache warmer step aside while the rate limiter
+# holds less than this share of its capacity, leaving it to interactive
+# matches; deferred refreshes are retried after LASTFM_BACKGROUND_RETRY_SECONDS.
+LASTFM_BACKGROUND_MIN_QUOTA = float(os.environ.get("LASTFM_BACKGROUND_MIN_QUOTA", "0.5"))
+LASTFM_BACKGROUND_RETRY_SECONDS = int(os.environ.get("LASTFM_BACKGROUND_RETRY_SECONDS", "60"))
+# Soft TTLs: older cached data is served while it refreshes in the background.
+LASTFM_SNAPSHOT_TTL_HOURS = int(os.environ.get("LASTFM_SNAPSHOT_TTL_HOURS", "12"))
+LASTFM_USER_TTL_HOURS = int(os.environ.get("LASTFM_USER_TTL_HOURS", "24"))
+# Past these ages cached data stops being served while it refreshes in the
+# background and callers block on Last.fm instead.
+LASTFM_SNAPSHOT_HARD_TTL_HOURS = int(os.environ.get("LASTFM_SNAPSHOT_HARD_TTL_HOURS", "72"))
+LASTFM_USER_HARD_TTL_HOURS = int(os.environ.get("LASTFM_USER_HARD_TTL_HOURS", "168"))
+# Snapshots are patched from a small Last.fm request (recent scrobbles for
+# "overall", the chart head for windowed periods) and only downloaded in full
+# this often, when the patch drifts too far, or once older than the max age.
+LASTFM_FULL_REFRESH_HOURS = int(os.environ.get("LASTFM_FULL_REFRESH_HOURS", "168"))
+LASTFM_DELTA_MAX_AGE_HOURS = int(os.environ.get("LASTFM_DELTA_MAX_AGE_HOURS", "168"))
+LASTFM_DELTA_PAGE_SIZE = int(os.environ.get("LASTFM_DELTA_PAGE_SIZE", "50"))
+LASTFM_DELTA_MAX_DRIFT = float(os.environ.get("LASTFM_DELTA_MAX_DRIFT", "0.2"))
+# Seconds a cross-process fetch lease is held in the cache; 0 disables it.
+LASTFM_FETCH_LEASE_SECONDS = float(os.environ.get("LASTFM_FETCH_LEASE_SECONDS", "0"))
@@ -0,0 +1,140 @@
+"""
+A local stand-in for the Last.fm API, served over real HTTP/1.1 keep-alive.
+
+Also holds the fixtures several test modules share: a fake clock and
+sample top-artist profiles.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def top_artists(username, period, limit):
+    return {
+        "topartists": {
+            "artist": [
+                {"name": f"{username}-{period}-{i}", "mbid": "", "playcount": str(100 - i), "url": ""}
+                for i in range(min(int(limit), 3))
+            ]
+        }
+    }
+
+
+def chart(*artists):
+    """A top-artists payload from ``(name, playcount)`` pairs."""
+    return [{"name": name, "mbid": "", "playcount": plays} for name, plays in artists]
+
+
+PROFILES = {
+    "alice": {
+        "3month": chart(("Low", 30), ("Mid", 10)),
+        "12month": chart(("Low", 50), ("High", 20)),
+        "overall": chart(("Low", 90), ("High", 40), ("Mid", 5)),
+    },
+    "bob": {
+        "3month": chart(("Low", 25), ("Mid", 12)),
+        "12month": chart(("Low", 40)),
+        "overall": chart(("Low", 70), ("High", 30)),
+    },
+    "carol": {
+        "3month": chart(("Other", 10)),
+        "12month": chart(("High", 20), ("Other", 5)),
+        "overall": chart(("High", 10), ("Other", 60)),
+    },
+    "dave": {"overall": chart(("Nobody", 3))},
+}
+
+
+class FakeClock:
+    """A ``time.time``/``time.sleep`` pair that only moves when told to."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeLastfm:
+    """
+    Threaded HTTP server answering ``user.getInfo`` and ``user.getTopArtists``.
+
+    Queue canned ``(status, body, headers)`` replies in ``responses`` to
+    override the next calls; ``connections`` counts distinct TCP connections.
+    ``latency`` delays every reply, ``rate_limit_ratio`` answers that share
+    of calls with a 429 and ``error_ratio`` with a 503 (both drawn from a
+    ``seed``-ed generator), and ``reply`` replaces the default bodies (see
+    benchmarks.payloads).
+    """
+
+    def __init__(self, latency=0.0, rate_limit_ratio=0.0, retry_after="0", seed=0, reply=None, error_ratio=0.0):
+        self.responses = []
+        self.requests = []
+        self.connections = set()
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if reply is not None:
+            self.reply = reply
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                with fake._lock:
+                    fake.requests.append(params)
+                    fake.connections.add(self.client_address)
+                    canned = fake.responses.pop(0) if fake.responses else None
+                    if canned is None and fake._random.random() < fake.rate_limit_ratio:
+                        canned = (429, {"error": 29, "message": "Rate limit exceeded"}, {"Retry-After": fake.retry_after})
+                    if canned is None and fake._random.random() < fake.error_ratio:
+                        canned = (503, {"error": 11, "message": "Service Offline"}, {})
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, body, headers = canned or (200, fake.reply(params), {})
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out waiting for ``latency``
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/2.0/"
+
+    @staticmethod
+    def reply(params):
+        if params.get("method") == "user.getInfo":
+            return {"user": {"name": params["user"], "playcount": "42"}}
+        if params.get("method") == "user.getTopArtists":
+            return top_artists(params["user"], params["period"], params.get("limit", 50))
+        return {"error": 3, "message": "Invalid Method"}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
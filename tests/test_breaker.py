@@ -0,0 +1,183 @@
+from datetime import timedelta
+
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, MatchRequest, TopArtistSnapshot
+from matchmaker.services import metrics
+from matchmaker.services.breaker import CircuitBreaker, CircuitOpenError
+from matchmaker.services.lastfm import (
+    AsyncLastfmClient,
+    LastfmClient,
+    LastfmError,
+    LastfmUnavailableError,
+    fetch_match_data,
+)
+from matchmaker.services.ratelimit import TokenBucket
+from matchmaker.services.vectors import snapshot_vector_fields
+
+from .fake_lastfm import FakeClock, FakeLastfm
+
+PERIODS = ["3month", "12month", "overall"]
+OUTAGE = (503, {"error": 11, "message": "Service Offline"}, {})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.clock = FakeClock(1000.0)
+        self.breaker = CircuitBreaker(failure_threshold=3, cooldown=30, probe_timeout=10, clock=self.clock)
+
+    def test_opens_after_consecutive_failures_only(self):
+        self.breaker.failure("m")
+        self.breaker.failure("m")
+        self.assertTrue(self.breaker.before("m"))
+        self.breaker.success("m")
+        self.assertFalse(self.breaker.before("m"))
+
+        for _ in range(3):
+            self.breaker.failure("m")
+        self.assertEqual(self.breaker.state("m"), "open")
+        with self.assertRaises(CircuitOpenError) as ctx:
+            self.breaker.before("m")
+        self.assertEqual(ctx.exception.retry_after, 30)
+        self.assertEqual(self.breaker.states(["m", "other"]), {"m": "open", "other": "closed"})
+
+    def test_half_open_lets_one_probe_through(self):
+        for _ in range(3):
+            self.breaker.failure("m")
+        self.clock.now += 31
+        self.assertEqual(self.breaker.state("m"), "half_open")
+        self.assertTrue(self.breaker.before("m"))
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before("m")
+
+        # A failed probe reopens at once; a successful one closes.
+        self.breaker.failure("m")
+        self.assertEqual(self.breaker.state("m"), "open")
+        self.clock.now += 31
+        self.assertTrue(self.breaker.before("m"))
+        self.breaker.success("m")
+        self.assertEqual(self.breaker.state("m"), "closed")
+        self.assertFalse(self.breaker.before("m"))
+
+    def test_zero_threshold_disables(self):
+        breaker = CircuitBreaker(failure_threshold=0, cooldown=30)
+        for _ in range(10):
+            breaker.failure("m")
+        self.assertFalse(breaker.before("m"))
+        self.assertEqual(breaker.state("m"), "closed")
+
+
+@override_settings(LASTFM_BREAKER_FAILURES=3, LASTFM_BREAKER_COOLDOWN_SECONDS=30)
+class LastfmClientBreakerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        caches["metrics"].clear()
+        self.addCleanup(cache.clear)
+        self.fake = FakeLastfm().__enter__()
+        self.addCleanup(self.fake.__exit__)
+
+    def _client(self, cls=LastfmClient):
+        return cls("key", rate_limiter=TokenBucket(rate=1000, capacity=1000), base_url=self.fake.url)
+
+    def test_outages_open_the_circuit_per_method(self):
+        client = self._client()
+        self.fake.responses += [OUTAGE, (500, {}, {}), (200, {"error": 8, "message": "Operation failed"}, {})]
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                client.get_user_info("alice")
+
+        with self.assertRaises(LastfmUnavailableError) as ctx:
+            client.get_user_info("alice")
+        self.assertGreater(ctx.exception.retry_after, 29)
+        self.assertEqual(len(self.fake.requests), 3)
+        self.assertEqual(metrics.total("lastfm_requests_total", method="user.getInfo", outcome="circuit_open"), 1)
+        self.assertEqual(metrics.total("lastfm_circuit_opened_total", method="user.getInfo"), 1)
+
+        # Other methods and other clients: separate circuit, shared state.
+        self.assertEqual(len(client.get_top_artists("alice", "overall")), 3)
+        with self.assertRaises(LastfmUnavailableError):
+            self._client().get_user_info("bob")
+
+    def test_api_errors_and_rate_limits_are_not_outages(self):
+        client = self._client()
+        self.fake.responses += [(200, {"error": 6, "message": "User not found"}, {}), (429, {}, {})] * 3
+        for _ in range(6):
+            with self.assertRaises(LastfmError) as ctx:
+                client.get_user_info("nobody")
+            self.assertNotIsInstance(ctx.exception, LastfmUnavailableError)
+        self.assertEqual(client.get_user_info("alice")["playcount"], "42")
+
+    @override_settings(LASTFM_READ_TIMEOUT=0.05)
+    def test_timeouts_count_as_failures(self):
+        self.fake.latency = 0.2
+        client = self._client()
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                client.get_user_info("alice")
+        with self.assertRaises(LastfmUnavailableError):
+            client.get_user_info("alice")
+        self.assertEqual(len(self.fake.requests), 3)
+
+    async def test_async_client_shares_the_circuit(self):
+        self.fake.responses += [OUTAGE] * 3
+        client = self._client(AsyncLastfmClient)
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                await client.get_top_artists("alice", "overall")
+        with self.assertRaises(LastfmUnavailableError):
+            self._client().get_top_artists("alice", "overall")
+
+
+@override_settings(LASTFM_BREAKER_FAILURES=3, LASTFM_BREAKER_COOLDOWN_SECONDS=30)
+class StaleFallbackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.fake = FakeLastfm(error_ratio=1.0).__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.client_ = LastfmClient("key", rate_limiter=TokenBucket(rate=1000, capacity=1000), base_url=self.fake.url)
+        old = timezone.now() - timedelta(days=30)
+        user = LastfmUser.objects.create(username="alice", last_synced_at=old)
+        payload = [{"name": "Low", "mbid": "", "playcount": 5, "url": ""}]
+        for period in PERIODS:
+            TopArtistSnapshot.objects.create(
+                user=user, period=period, limit=300, payload=payload, **snapshot_vector_fields(payload)
+            )
+        TopArtistSnapshot.objects.filter(user=user).update(fetched_at=old)
+
+    def _trip(self, method, user="x"):
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                if method == "user.getInfo":
+                    self.client_.get_user_info(user)
+                else:
+                    self.client_.get_top_artists(user, "overall")
+
+    def test_expired_data_is_served_stale_while_open(self):
+        self._trip("user.getInfo")
+        self._trip("user.getTopArtists")
+        calls = len(self.fake.requests)
+        users, snapshots, stale = fetch_match_data(self.client_, ["alice"], PERIODS)
+        self.assertEqual(set(snapshots["alice"]), set(PERIODS))
+        self.assertEqual(stale, {("alice", "info")} | {("alice", period) for period in PERIODS})
+        self.assertEqual(len(self.fake.requests), calls)
+
+        # Users never fetched fail fast instead of waiting on Last.fm.
+        with self.assertRaises(LastfmUnavailableError):
+            fetch_match_data(self.client_, ["alice", "bob"], PERIODS)
+        self.assertEqual(len(self.fake.requests), calls)
+
+    def test_pending_status_reports_breaker_state(self):
+        self._trip("user.getTopArtists")
+        match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.get(username="alice"), user_b=LastfmUser.objects.create(username="bob")
+        )
+        data = self.client.get(reverse("match_status", args=[match.uuid])).json()
+        self.assertEqual(
+            data["lastfm"], {"user.getInfo": "closed", "user.getTopArtists": "open", "user.getRecentTracks": "closed"}
+        )
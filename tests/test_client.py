@@ -0,0 +1,108 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from matchmaker.services.breaker import CircuitBreaker
+from matchmaker.services.lastfm import AsyncLastfmClient, LastfmClient, LastfmError, LastfmRateLimitError
+from matchmaker.services.ratelimit import TokenBucket
+
+from .fake_lastfm import FakeLastfm
+
+
+def _bucket():
+    return TokenBucket(rate=1000, capacity=1000)
+
+
+class LastfmClientHttpTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeLastfm().__enter__()
+        self.addCleanup(self.fake.__exit__)
+
+    def test_clients_share_one_keep_alive_connection(self):
+        for _ in range(3):
+            client = LastfmClient("key", rate_limiter=_bucket(), base_url=self.fake.url)
+            self.assertEqual(client.get_user_info("alice")["playcount"], "42")
+        artists = client.get_top_artists("alice", "overall", limit=2)
+        self.assertEqual(artists[0], {"name": "alice-overall-0", "mbid": "", "playcount": 100, "url": ""})
+        self.assertEqual(len(self.fake.connections), 1)
+        self.assertEqual(self.fake.requests[0]["api_key"], "key")
+
+    def test_recent_tracks_skip_now_playing(self):
+        client = LastfmClient("key", rate_limiter=_bucket(), base_url=self.fake.url)
+        track = {"artist": {"mbid": "m1", "#text": "Low"}, "name": "Lullaby"}
+        playing = dict(track, **{"@attr": {"nowplaying": "true"}})
+        body = {"recenttracks": {"track": [playing, track], "@attr": {"total": "1"}}}
+        self.fake.responses.append((200, body, {}))
+        self.assertEqual(client.get_recent_tracks("alice", since=0), ([{"name": "Low", "mbid": "m1"}], 1))
+        self.assertEqual(self.fake.requests[0]["from"], "0")
+
+    def test_errors_are_mapped(self):
+        client = LastfmClient("key", rate_limiter=_bucket(), base_url=self.fake.url)
+        self.fake.responses += [
+            (200, {"error": 6, "message": "User not found"}, {}),
+            (200, {"error": 29, "message": "Rate limit exceeded"}, {}),
+            (429, {}, {"Retry-After": "7"}),
+        ]
+        with self.assertRaises(LastfmError) as ctx:
+            client.get_user_info("nobody")
+        self.assertEqual(ctx.exception.code, 6)
+        with self.assertRaises(LastfmRateLimitError):
+            client.get_user_info("alice")
+        with self.assertRaises(LastfmRateLimitError) as ctx:
+            client.get_user_info("alice")
+        self.assertEqual(ctx.exception.retry_after, 7)
+
+
+class AsyncLastfmClientTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeLastfm().__enter__()
+        self.addCleanup(self.fake.__exit__)
+
+    async def test_same_results_as_sync_client(self):
+        sync = LastfmClient("key", rate_limiter=_bucket(), base_url=self.fake.url)
+        for _ in range(3):
+            client = AsyncLastfmClient("key", rate_limiter=_bucket(), base_url=self.fake.url)
+            self.assertEqual(
+                await client.get_top_artists("bob", "3month", limit=3), sync.get_top_artists("bob", "3month", limit=3)
+            )
+        self.assertEqual(await client.get_user_info("bob"), {"name": "bob", "playcount": "42"})
+        # One connection for the sync session, one for the shared async pool.
+        self.assertEqual(len(self.fake.connections), 2)
+
+    async def test_errors_and_rate_limits_are_mapped(self):
+        bucket = _bucket()
+        client = AsyncLastfmClient("key", rate_limiter=bucket, base_url=self.fake.url)
+        self.fake.responses += [
+            (200, {"error": 6, "message": "User not found"}, {}),
+            (429, {}, {"Retry-After": "30"}),
+        ]
+        with self.assertRaises(LastfmError) as ctx:
+            await client.get_user_info("nobody")
+        self.assertNotIsInstance(ctx.exception, LastfmRateLimitError)
+        with self.assertRaises(LastfmRateLimitError) as ctx:
+            await client.get_user_info("alice")
+        self.assertEqual(ctx.exception.retry_after, 30)
+
+        # The pause is shared: the next call is refused before any request.
+        with self.settings(LASTFM_RATE_LIMIT_MAX_WAIT=1), self.assertRaises(LastfmRateLimitError):
+            await client.get_user_info("alice")
+        self.assertEqual(len(self.fake.requests), 2)
+
+    async def test_cache_state_is_touched_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+
+        class RecordingBreaker(CircuitBreaker):
+            def before(self, name):
+                threads.append(threading.get_ident())
+                return True
+
+            def success(self, name):
+                threads.append(threading.get_ident())
+
+        client = AsyncLastfmClient(
+            "key", rate_limiter=_bucket(), base_url=self.fake.url, breaker=RecordingBreaker(3, 30)
+        )
+        await client.get_user_info("alice")
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
@@ -0,0 +1,113 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from matchmaker.models import Artist, LastfmUser, TopArtistSnapshot
+from matchmaker.services.delta import merge_head_page, merge_recent_plays
+from matchmaker.services.lastfm import _top_artists_miss, refresh_top_artists
+from matchmaker.services.vectors import snapshot_vector_fields
+
+
+def chart(*counts, prefix="a"):
+    return [{"name": f"{prefix}{i}", "mbid": "", "playcount": count, "url": ""} for i, count in enumerate(counts)]
+
+
+def scrobbles(*names):
+    return [{"name": name, "mbid": ""} for name in names]
+
+
+class MergeTests(SimpleTestCase):
+    def test_recent_plays_update_counts_and_rank(self):
+        merged = merge_recent_plays(chart(10, 8, 5), scrobbles("a2", "a2", "A2", "a2", "a2", "a2", "new"), limit=5)
+        self.assertEqual([(a["name"], a["playcount"]) for a in merged], [("a2", 11), ("a0", 10), ("a1", 8), ("new", 1)])
+
+    def test_recent_plays_drift_when_unseen_artist_must_chart(self):
+        payload = chart(10, 8, 2)
+        self.assertEqual(len(merge_recent_plays(payload, scrobbles("new", "new"), limit=3)), 3)
+        self.assertIsNone(merge_recent_plays(payload, scrobbles("new", "new", "new"), limit=3))
+
+    def test_head_page_replaces_top_and_caps_tail(self):
+        head = [dict(a, playcount=a["playcount"] - 1) for a in chart(9, 8)][::-1]
+        merged = merge_head_page(chart(9, 8, 8, 3), head, limit=4, page_size=2, max_drift=0.5)
+        self.assertEqual([(a["name"], a["playcount"]) for a in merged], [("a1", 7), ("a0", 8), ("a2", 8), ("a3", 3)])
+
+    def test_head_page_drift(self):
+        head = chart(20, 19, prefix="b")
+        self.assertIsNone(merge_head_page(chart(9, 8, 7), head, limit=3, page_size=2, max_drift=0.5))
+
+
+class RecordingClient:
+    def __init__(self, recent=(), head=()):
+        self.recent = list(recent)
+        self.head = list(head)
+        self.calls = []
+
+    def get_recent_tracks(self, username, since, limit=200):
+        self.calls.append(("recent", since))
+        return self.recent, len(self.recent)
+
+    def get_top_artists(self, username, period, limit=300):
+        self.calls.append(("top", limit))
+        return self.head[:limit] if self.head else chart(*range(limit, 0, -1))
+
+
+@override_settings(LASTFM_DELTA_PAGE_SIZE=2)
+class DeltaRefreshTests(TestCase):
+    def setUp(self):
+        self.user = LastfmUser.objects.create(username="alice")
+        refresh_top_artists(RecordingClient(), self.user, "overall", limit=3)
+        refresh_top_artists(RecordingClient(), self.user, "3month", limit=3)
+        self.full_fetched_at = TopArtistSnapshot.objects.get(period="overall").full_fetched_at
+
+    def _age(self, hours, **fields):
+        TopArtistSnapshot.objects.update(fetched_at=timezone.now() - timezone.timedelta(hours=hours), **fields)
+
+    def test_overall_is_patched_from_recent_scrobbles(self):
+        self._age(1)
+        client = RecordingClient(recent=scrobbles("a2", "a2", "a2"))
+        # The previous snapshot and its artists, then the upsert in a savepoint;
+        # the patched payload's artists are not looked up again.
+        with self.assertNumQueries(5):
+            payload = refresh_top_artists(client, self.user, "overall", limit=3)
+
+        self.assertEqual([call[0] for call in client.calls], ["recent"])
+        self.assertEqual([(a["name"], a["playcount"]) for a in payload], [("a2", 4), ("a0", 3), ("a1", 2)])
+        snapshot = TopArtistSnapshot.objects.get(period="overall")
+        self.assertEqual(snapshot.full_fetched_at, self.full_fetched_at)
+        fields = snapshot_vector_fields(payload)
+        self.assertEqual(bytes(snapshot.vector_ids), fields["vector_ids"])
+        self.assertEqual(bytes(snapshot.vector_weights), fields["vector_weights"])
+        self.assertEqual(Artist.objects.count(), 3)
+
+    def test_windowed_period_is_patched_from_head_page(self):
+        self._age(1)
+        client = RecordingClient(head=chart(5, 4))
+        payload = refresh_top_artists(client, self.user, "3month", limit=3)
+        self.assertEqual(client.calls, [("top", 2)])
+        self.assertEqual([a["playcount"] for a in payload], [5, 4, 1])
+
+    def test_full_refetch_on_drift_or_schedule(self):
+        self._age(1)
+        client = RecordingClient(recent=scrobbles(*["new"] * 5))
+        refresh_top_artists(client, self.user, "overall", limit=3)
+        self.assertEqual([call[0] for call in client.calls], ["recent", "top"])
+
+        self._age(1, full_fetched_at=timezone.now() - timezone.timedelta(days=8))
+        client = RecordingClient()
+        refresh_top_artists(client, self.user, "overall", limit=3)
+        self.assertEqual(client.calls, [("top", 3)])
+        self.assertGreater(TopArtistSnapshot.objects.get(period="overall").full_fetched_at, self.full_fetched_at)
+
+    def test_follower_without_previous_builds_from_patched_value(self):
+        # Two misses for one key share a single-flight fetch; only the
+        # leader had a snapshot to patch.
+        self._age(1)
+        previous = TopArtistSnapshot.objects.get(period="overall")
+        client = RecordingClient(recent=scrobbles("a2"))
+        leader = _top_artists_miss(client, self.user, "overall", 3, 0, previous=previous)
+        follower = _top_artists_miss(client, self.user, "overall", 3, 0)
+        self.assertEqual(leader.key, follower.key)
+
+        snapshot = follower.build(leader.fetch())
+        self.assertEqual([call[0] for call in client.calls], ["recent"])
+        self.assertEqual(snapshot.full_fetched_at, self.full_fetched_at)
+        self.assertEqual(snapshot.known_artists, previous.payload_artists)
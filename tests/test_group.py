@@ -0,0 +1,91 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from matchmaker.forms import GroupMatchForm
+from matchmaker.models import GroupMatchRequest, LastfmUser, TopArtistSnapshot
+from matchmaker.services.scoring import compute_match
+from matchmaker.services.vectors import snapshot_vector_fields
+from matchmaker.tasks import run_group_match
+
+from .fake_lastfm import PROFILES
+
+
+class GroupMatchFormTests(SimpleTestCase):
+    def test_splits_and_dedupes_usernames(self):
+        form = GroupMatchForm({"usernames": "alice, bob\ncarol  alice"})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["usernames"], ["alice", "bob", "carol"])
+
+    def test_rejects_too_few_or_too_many(self):
+        self.assertFalse(GroupMatchForm({"usernames": "alice alice"}).is_valid())
+        many = " ".join(f"user{i}" for i in range(51))
+        self.assertFalse(GroupMatchForm({"usernames": many}).is_valid())
+        self.assertFalse(GroupMatchForm({"usernames": "alice b@d"}).is_valid())
+
+
+class GroupMatchTaskTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for username, periods in PROFILES.items():
+            user = LastfmUser.objects.create(username=username, last_synced_at=now)
+            for period, payload in periods.items():
+                TopArtistSnapshot.objects.create(
+                    user=user, period=period, limit=300, payload=payload, **snapshot_vector_fields(payload)
+                )
+
+    def test_pairs_match_compute_match(self):
+        usernames = list(PROFILES)
+        group = GroupMatchRequest.objects.create(usernames=usernames)
+        # Only dave's missing periods go to Last.fm; they come back empty.
+        with mock.patch("matchmaker.services.lastfm.LastfmClient._request", return_value={}) as request:
+            run_group_match.apply(args=[str(group.uuid)])
+        self.assertEqual(request.call_count, 2)
+        group.refresh_from_db()
+        self.assertEqual(group.status, "READY")
+
+        result = group.result
+        self.assertEqual(len(result["pairs"]), len(usernames) * (len(usernames) - 1) // 2)
+        for pair in result["pairs"]:
+            expected = compute_match(PROFILES[pair["user_a"]], PROFILES[pair["user_b"]])
+            # Stored float32 weights differ in the last digits; scores and picks must not.
+            self.assertEqual(pair["scores"], expected["scores"])
+            self.assertEqual(pair["final_score"], expected["final_score"])
+            for key in ("overlap", "recs_for_a", "recs_for_b"):
+                self.assertEqual([o["artist"] for o in pair[key]], [o["artist"] for o in expected[key]])
+            i, j = usernames.index(pair["user_a"]), usernames.index(pair["user_b"])
+            self.assertEqual(result["matrix"][i][j], expected["final_score"])
+            self.assertEqual(result["matrix"][j][i], expected["final_score"])
+        self.assertEqual([result["matrix"][i][i] for i in range(len(usernames))], [100.0] * len(usernames))
+        scores = [pair["final_score"] for pair in result["pairs"]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+
+class GroupMatchViewTests(TestCase):
+    def test_post_enqueues_group_task(self):
+        with mock.patch("matchmaker.views.run_group_match") as task:
+            response = self.client.post(reverse("group_match"), {"usernames": "alice, bob, carol"})
+        group = GroupMatchRequest.objects.get()
+        self.assertRedirects(response, reverse("group_detail", args=[group.uuid]), fetch_redirect_response=False)
+        task.delay.assert_called_once_with(str(group.uuid))
+        self.assertEqual(group.usernames, ["alice", "bob", "carol"])
+
+    def test_ready_group_renders_matrix(self):
+        group = GroupMatchRequest.objects.create(
+            usernames=["alice", "bob"],
+            status="READY",
+            result={
+                "usernames": ["alice", "bob"],
+                "matrix": [[100.0, 42.5], [42.5, 100.0]],
+                "pairs": [{"user_a": "alice", "user_b": "bob", "final_score": 42.5, "overlap": []}],
+            },
+        )
+        response = self.client.get(reverse("group_detail", args=[group.uuid]))
+        self.assertContains(response, "Compatibility matrix")
+        self.assertContains(response, "42.5%")
+
+        status = self.client.get(reverse("group_status", args=[group.uuid])).json()
+        self.assertEqual(status["status"], "READY")
+        self.assertEqual(status["result"]["matrix"][0][1], 42.5)
@@ -0,0 +1,359 @@
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from matchmaker import tasks
+from matchmaker.models import LastfmUser, TopArtistSnapshot
+from matchmaker.services.lastfm import (
+    LastfmClient,
+    LastfmError,
+    LastfmRateLimitError,
+    _Miss,
+    _top_artists_miss,
+    fetch_match_data,
+    fill_misses,
+    get_top_artists_with_cache,
+    refresh_pending,
+    refresh_top_artists,
+)
+from matchmaker.services.ratelimit import TokenBucket
+from matchmaker.services.scoring import build_vector
+from matchmaker.services.singleflight import FetchLease, SingleFlight
+from matchmaker.services.vectors import load_vector
+
+from .fake_lastfm import FakeClock
+
+PERIODS = ["3month", "12month", "overall"]
+
+
+class BarrierClient:
+    """Fake client whose calls only complete once ``parties`` of them are in flight."""
+
+    def __init__(self, parties: int, fail_user: str = ""):
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.fail_user = fail_user
+
+    def get_user_info(self, username):
+        self.barrier.wait()
+        return {"playcount": "42", "realname": username.title()}
+
+    def get_top_artists(self, username, period, limit=300):
+        self.barrier.wait()
+        if username == self.fail_user:
+            raise LastfmError(8, "Operation failed")
+        return [{"name": f"{username}-{period}", "mbid": "", "playcount": 3, "url": ""}]
+
+    def get_recent_tracks(self, username, since, limit=200):
+        self.barrier.wait()
+        return [], 0
+
+
+class ChartClient:
+    def __init__(self):
+        self.limits = []
+
+    def get_top_artists(self, username, period, limit=300):
+        self.limits.append(limit)
+        return [{"name": f"a{i}", "mbid": "", "playcount": 100 - i, "url": ""} for i in range(limit)]
+
+
+class SnapshotLimitTests(TestCase):
+    def setUp(self):
+        self.user = LastfmUser.objects.create(username="alice")
+        self.client_ = ChartClient()
+        refresh_top_artists(self.client_, self.user, "3month", limit=20)
+
+    def test_smaller_limits_are_served_from_the_head(self):
+        payload = get_top_artists_with_cache(self.client_, self.user, "3month", limit=5)
+        self.assertEqual([a["name"] for a in payload], ["a0", "a1", "a2", "a3", "a4"])
+        self.assertEqual(self.client_.limits, [20])
+
+        snapshot = TopArtistSnapshot.objects.get()
+        vector = load_vector(snapshot, 5)
+        expected = build_vector(snapshot.payload[:5])
+        self.assertEqual(len(vector), 5)
+        self.assertAlmostEqual(vector.norm, expected.norm, places=5)
+
+    def test_larger_limits_upgrade_in_place_and_refreshes_never_shrink(self):
+        pk = TopArtistSnapshot.objects.get().pk
+        self.assertEqual(len(get_top_artists_with_cache(self.client_, self.user, "3month", limit=30)), 30)
+        refresh_top_artists(self.client_, self.user, "3month", limit=5)
+        self.assertEqual(self.client_.limits, [20, 30, 30])
+        snapshot = TopArtistSnapshot.objects.get()
+        self.assertEqual((snapshot.pk, snapshot.limit, len(snapshot.payload)), (pk, 30, 30))
+
+
+class FetchMatchDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_cold_match_fetches_all_misses_in_parallel(self):
+        client = BarrierClient(parties=8)
+        users, snapshots, _ = fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+
+        self.assertEqual(users["alice"].playcount, 42)
+        self.assertEqual(snapshots["bob"]["overall"].payload[0]["name"], "bob-overall")
+        self.assertEqual(TopArtistSnapshot.objects.count(), 6)
+
+    def test_fresh_cache_entries_are_not_refetched(self):
+        client = BarrierClient(parties=8)
+        fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+        # A broken barrier would raise if anything were fetched again.
+        client.barrier.abort()
+        _, snapshots, _ = fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+        self.assertEqual(snapshots["alice"]["3month"].payload[0]["name"], "alice-3month")
+
+    def test_reads_and_writes_are_batched(self):
+        client = BarrierClient(parties=8)
+        # Users (read, insert, re-read), snapshots, then one transaction with
+        # artists (insert, read), a user bulk update and a snapshot upsert.
+        with self.assertNumQueries(10):
+            _, snapshots, _ = fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+        self.assertIsNotNone(snapshots["alice"]["overall"].pk)
+        self.assertEqual(LastfmUser.objects.get(username="bob").realname, "Bob")
+
+        client.barrier.abort()
+        with self.assertNumQueries(2):
+            fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_stale_snapshots_are_served_and_refreshed_in_background(self):
+        fetch_match_data(BarrierClient(parties=8), ["alice", "bob"], PERIODS, max_workers=8)
+        TopArtistSnapshot.objects.filter(user__username="alice", period="overall").update(
+            fetched_at=timezone.now() - timezone.timedelta(hours=20)
+        )
+        client = BarrierClient(parties=1)
+        client.barrier.abort()  # nothing may block on Last.fm
+
+        with mock.patch("matchmaker.tasks.refresh_top_artists.delay") as refresh, self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            _, snapshots, stale = fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+
+        self.assertEqual(snapshots["alice"]["overall"].payload[0]["name"], "alice-overall")
+        self.assertEqual(stale, {("alice", "overall")})
+        refresh.assert_called_once_with("alice", "overall", 300)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_tasks_refresh_on_a_thread(self):
+        fetch_match_data(BarrierClient(parties=8), ["alice", "bob"], PERIODS, max_workers=8)
+        TopArtistSnapshot.objects.update(fetched_at=timezone.now() - timezone.timedelta(hours=20))
+        LastfmUser.objects.update(last_synced_at=timezone.now() - timezone.timedelta(hours=30))
+        client = BarrierClient(parties=1)
+        client.barrier.abort()  # any Last.fm call would raise
+
+        with mock.patch("matchmaker.services.lastfm._refresh_in_thread") as refresh, mock.patch(
+            "matchmaker.tasks.refresh_top_artists.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            _, _, stale = fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+
+        self.assertEqual(len(stale), 8)
+        delay.assert_not_called()
+        self.assertEqual(refresh.call_count, 8)
+        self.assertIn((tasks.refresh_top_artists, ("alice", "overall", 300)), [c.args for c in refresh.call_args_list])
+        self.assertTrue(refresh_pending(stale, 300))
+        self.assertFalse(refresh_pending({("carol", "overall")}, 300))
+
+    def test_snapshots_past_hard_ttl_block_on_fetch(self):
+        fetch_match_data(BarrierClient(parties=8), ["alice", "bob"], PERIODS, max_workers=8)
+        TopArtistSnapshot.objects.filter(user__username="alice", period="overall").update(
+            fetched_at=timezone.now() - timezone.timedelta(hours=100)
+        )
+        _, _, stale = fetch_match_data(BarrierClient(parties=1), ["alice", "bob"], PERIODS, max_workers=8)
+        self.assertEqual(stale, set())
+        snapshot = TopArtistSnapshot.objects.get(user__username="alice", period="overall")
+        self.assertTrue(snapshot.is_fresh())
+
+    def test_successful_fetches_are_stored_before_error_is_raised(self):
+        client = BarrierClient(parties=8, fail_user="bob")
+        with self.assertRaises(LastfmError):
+            fetch_match_data(client, ["alice", "bob"], PERIODS, max_workers=8)
+        alice = LastfmUser.objects.get(username="alice")
+        self.assertEqual(TopArtistSnapshot.objects.filter(user=alice).count(), 3)
+        self.assertFalse(TopArtistSnapshot.objects.filter(user__username="bob").exists())
+
+
+class SharedFetchTests(TransactionTestCase):
+    def test_followers_get_the_stored_row(self):
+        LastfmUser.objects.create(username="alice")
+        started, release = threading.Event(), threading.Event()
+        client = ChartClient()
+        fetch_chart = client.get_top_artists
+
+        def slow_chart(username, period, limit=300):
+            started.set()
+            release.wait(5)
+            return fetch_chart(username, period, limit)
+
+        client.get_top_artists = slow_chart
+        results = []
+
+        def fetch():
+            try:
+                user = LastfmUser.objects.get(username="alice")
+                miss = _top_artists_miss(client, user, "overall", 10, ttl_hours=12)
+                results.append(fill_misses([miss])[miss.key])
+            finally:
+                connection.close()
+
+        leader = threading.Thread(target=fetch)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=fetch)
+        follower.start()
+        threading.Timer(0.2, release.set).start()
+        for thread in [leader, follower]:
+            thread.join(10)
+
+        self.assertEqual(client.limits, [10])
+        pk = TopArtistSnapshot.objects.get().pk
+        self.assertEqual([snapshot.pk for snapshot in results], [pk, pk])
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data or {}
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_paced_at_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=5, capacity=2, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            bucket.acquire()
+        # Two tokens of burst, then two more at 0.2s each.
+        self.assertAlmostEqual(clock.now, 0.4)
+
+    def test_refuses_reservation_beyond_max_wait(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=1, clock=clock, sleep=clock.sleep)
+        self.assertTrue(bucket.acquire(max_wait=0))
+        self.assertFalse(bucket.acquire(max_wait=0.5))
+        self.assertEqual(clock.now, 0)
+
+    def test_pause_holds_back_callers(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, capacity=10, clock=clock, sleep=clock.sleep)
+        bucket.pause(30)
+        self.assertEqual(bucket.available(), 0.0)
+        bucket.acquire()
+        self.assertAlmostEqual(clock.now, 30)
+
+
+class LastfmClientRateLimitTests(SimpleTestCase):
+    def test_retry_after_header_pauses_shared_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=100, capacity=100, clock=clock, sleep=clock.sleep)
+        session = FakeSession(
+            FakeResponse(429, headers={"Retry-After": "12"}),
+            FakeResponse(200, {"user": {"name": "alice"}}),
+        )
+        client = LastfmClient("key", session=session, rate_limiter=bucket)
+        with self.assertRaises(LastfmRateLimitError) as ctx:
+            client.get_user_info("alice")
+        self.assertEqual(ctx.exception.retry_after, 12)
+
+        # Other clients sharing the bucket back off instead of hitting Last.fm.
+        other = LastfmClient("key", session=session, rate_limiter=bucket)
+        with self.assertRaises(LastfmRateLimitError) as ctx:
+            other.get_user_info("alice")
+        self.assertAlmostEqual(ctx.exception.retry_after, 12)
+        self.assertEqual(session.calls, 1)
+
+        clock.sleep(5)
+        self.assertEqual(other.get_user_info("alice"), {"name": "alice"})
+        self.assertAlmostEqual(clock.now, 12)
+
+    def test_api_error_29_is_a_rate_limit(self):
+        session = FakeSession(FakeResponse(200, {"error": 29, "message": "Rate limit exceeded"}))
+        client = LastfmClient("key", session=session, rate_limiter=TokenBucket(rate=100))
+        with self.assertRaises(LastfmRateLimitError):
+            client.get_user_info("alice")
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ["payload"]
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do("k", slow_fetch)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(flights.do("k", slow_fetch)))
+            for _ in range(3)
+        ]
+        for thread in followers:
+            thread.start()
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True])
+        self.assertTrue(all(value == ["payload"] for value, _ in results))
+
+    def test_errors_are_shared_and_not_cached(self):
+        flights = SingleFlight()
+        with self.assertRaises(LastfmError):
+            flights.do("k", lambda: (_ for _ in ()).throw(LastfmError(8, "boom")))
+        self.assertEqual(flights.do("k", lambda: 1), (1, False))
+
+
+@override_settings(LASTFM_FETCH_LEASE_SECONDS=5)
+class FetchLeaseTests(TestCase):
+    def test_waits_for_other_process_and_reuses_its_result(self):
+        key = ("top", "alice", "overall", 300)
+        holder = FetchLease(key, timeout=5)
+        self.assertTrue(holder.acquire())
+        stored = {}
+        threading.Timer(0.2, holder.release).start()
+
+        def fetch():
+            raise AssertionError("should reuse the other process's fetch")
+
+        miss = _Miss(key, fetch, lambda value: value, lambda: stored.get("payload"))
+        stored["payload"] = ["from elsewhere"]
+        self.assertEqual(fill_misses([miss])[key], ["from elsewhere"])
+
+    def test_fetches_itself_if_holder_stored_nothing(self):
+        key = ("info", "alice")
+        holder = FetchLease(key, timeout=5)
+        holder.acquire()
+        threading.Timer(0.1, holder.release).start()
+        builds = []
+        miss = _Miss(key, lambda: {"name": "alice"}, lambda v: builds.append(v) or v, lambda: None)
+        self.assertEqual(fill_misses([miss])[key], {"name": "alice"})
+        self.assertEqual(builds, [{"name": "alice"}])
@@ -0,0 +1,112 @@
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, MatchRequest, TopArtistSnapshot
+from matchmaker.services import metrics
+from matchmaker.services.lastfm import LastfmClient, LastfmError, LastfmRateLimitError
+from matchmaker.services.ratelimit import TokenBucket
+from matchmaker.services.vectors import snapshot_vector_fields
+from matchmaker.tasks import run_match
+
+from .fake_lastfm import PROFILES, FakeLastfm
+
+
+class LastfmCallMetricsTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        caches["metrics"].clear()
+        self.fake = FakeLastfm().__enter__()
+        self.addCleanup(self.fake.__exit__)
+
+    def test_calls_are_counted_and_timed_by_method_and_outcome(self):
+        client = LastfmClient("key", rate_limiter=TokenBucket(rate=1000, capacity=1000), base_url=self.fake.url)
+        self.fake.responses += [(200, {"error": 6, "message": "User not found"}, {}), (429, {}, {})]
+        with self.assertRaises(LastfmError):
+            client.get_user_info("nobody")
+        with self.assertRaises(LastfmRateLimitError):
+            client.get_user_info("alice")
+        client.get_top_artists("alice", "overall")
+
+        def calls(method, outcome):
+            return metrics.total("lastfm_requests_total", method=method, outcome=outcome)
+
+        self.assertEqual(calls("user.getInfo", "error"), 1)
+        self.assertEqual(calls("user.getInfo", "rate_limited"), 1)
+        self.assertEqual(calls("user.getTopArtists", "ok"), 1)
+        self.assertIn('lastfm_request_seconds_count{method="user.getInfo"} 2', metrics.render_prometheus())
+
+
+class MetricsCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches["metrics"].clear()
+
+    def test_counters_outlive_the_default_cache(self):
+        metrics.incr("matches_total", status="READY")
+        cache.clear()
+        self.assertEqual(metrics.total("matches_total", status="READY"), 1)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "metrics": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://localhost:1"},
+        }
+    )
+    def test_redis_histogram_updates_take_one_round_trip(self):
+        with mock.patch("django.core.cache.backends.redis.RedisCacheClient.get_client") as get_client:
+            metrics.observe("lastfm_request_seconds", 0.2, method="user.getInfo")
+        pipeline = get_client.return_value.pipeline.return_value
+        self.assertEqual(pipeline.incrby.call_count, 3)
+        pipeline.execute.assert_called_once_with()
+
+
+class MatchTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["metrics"].clear()
+        now = timezone.now()
+        for username in ("alice", "bob"):
+            user = LastfmUser.objects.create(username=username, last_synced_at=now)
+            for period, payload in PROFILES[username].items():
+                TopArtistSnapshot.objects.create(
+                    user=user, period=period, limit=300, payload=payload, **snapshot_vector_fields(payload)
+                )
+
+    def _run(self) -> MatchRequest:
+        match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.get(username="alice"), user_b=LastfmUser.objects.get(username="bob")
+        )
+        run_match.apply(args=[str(match.uuid)])
+        match.refresh_from_db()
+        return match
+
+    def test_stage_timings_are_stored_and_exported(self):
+        scored, cached = self._run(), self._run()
+        self.assertEqual(
+            set(scored.timings),
+            {"fetch_ms", "result_cache_ms", "vectors_ms", "scoring_ms", "scoring_cpu_ms", "total_ms", "fetched", "stale"},
+        )
+        self.assertEqual(set(cached.timings), {"fetch_ms", "result_cache_ms", "total_ms", "fetched", "stale"})
+        self.assertEqual(metrics.total("cache_lookups_total", state="fresh"), 16)
+        self.assertEqual(metrics.total("matches_total", status="READY"), 2)
+
+        with self.settings(DEBUG=True):
+            body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('match_stage_seconds_count{stage="total"} 2', body)
+        self.assertIn('match_stage_seconds_bucket{le="+Inf",stage="scoring"} 1', body)
+        self.assertIn('cache_lookups_total{period="profile",state="fresh"} 4', body)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+    def test_metrics_are_hidden_without_a_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, MatchRequest, TopArtistSnapshot
+from matchmaker.services.scoring import compute_match, score_vectors
+from matchmaker.services.vectors import snapshot_vector_fields
+from matchmaker.tasks import run_match
+
+from .fake_lastfm import PROFILES
+
+
+class MatchResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        for username in ("alice", "bob"):
+            user = LastfmUser.objects.create(username=username, last_synced_at=now)
+            for period, payload in PROFILES[username].items():
+                TopArtistSnapshot.objects.create(
+                    user=user, period=period, limit=300, payload=payload, **snapshot_vector_fields(payload)
+                )
+
+    def _run(self, username_a: str, username_b: str) -> MatchRequest:
+        match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.get(username=username_a),
+            user_b=LastfmUser.objects.get(username=username_b),
+        )
+        run_match.apply(args=[str(match.uuid)])
+        match.refresh_from_db()
+        return match
+
+    def test_repeat_and_reversed_pairs_skip_scoring(self):
+        first = self._run("alice", "bob")
+        with mock.patch("matchmaker.tasks.score_vectors") as score:
+            again = self._run("alice", "bob")
+            reversed_ = self._run("bob", "alice")
+        score.assert_not_called()
+
+        self.assertEqual(again.result, first.result)
+        expected = compute_match(PROFILES["bob"], PROFILES["alice"])
+        self.assertEqual(reversed_.result["final_score"], expected["final_score"])
+        self.assertEqual(reversed_.result["user_a"], "bob")
+        for key in ("overlap", "recs_for_a", "recs_for_b"):
+            self.assertEqual(
+                [item["artist"] for item in reversed_.result[key]], [item["artist"] for item in expected[key]]
+            )
+        self.assertEqual(reversed_.result["overlap"][0]["a_weight"], first.result["overlap"][0]["b_weight"])
+
+    def test_changed_snapshot_invalidates(self):
+        self._run("alice", "bob")
+        snapshot = TopArtistSnapshot.objects.get(user__username="bob", period="3month")
+        snapshot.save()  # bumps fetched_at
+        with mock.patch("matchmaker.tasks.score_vectors", wraps=score_vectors) as score:
+            self._run("alice", "bob")
+        score.assert_called_once()
+
+    def test_home_serves_cached_result_without_enqueueing(self):
+        self._run("alice", "bob")
+        with mock.patch("matchmaker.views.run_match") as task:
+            self.client.post(reverse("home"), {"username_a": "bob", "username_b": "alice"})
+        task.delay.assert_not_called()
+        match = MatchRequest.objects.latest("created_at")
+        self.assertEqual(match.status, "READY")
+        self.assertEqual(match.result["user_a"], "bob")
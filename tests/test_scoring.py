@@ -1,8 +1,9 @@
 import math
+import random
 
 from django.test import SimpleTestCase
 
-from matchmaker.services.scoring import compute_match, cosine_similarity
+from matchmaker.services.scoring import ArtistInterner, ArtistVector, build_vector, compute_match, cosine_similarity, top_missing, top_overlap
 
 
 class ScoringTests(SimpleTestCase):
@@ -32,3 +33,67 @@ class ScoringTests(SimpleTestCase):
         self.assertEqual(result["scores"]["overall"], 1.0)
         self.assertEqual(result["scores"]["12month"], 1.0)
         self.assertEqual(result["scores"]["3month"], 0.0)
+
+    def test_build_vector_interns_ids_and_caches_norm(self):
+        payload = [
+            {"name": "Beta", "mbid": "", "playcount": 8},
+            {"name": "Alpha", "mbid": "abc", "playcount": 3},
+            {"name": "Silent", "mbid": "", "playcount": 0},
+        ]
+        interner = ArtistInterner()
+        vec = build_vector(payload, interner)
+        self.assertIsInstance(vec, ArtistVector)
+        self.assertEqual(len(vec), 2)
+        self.assertEqual(list(vec.ids), sorted(vec.ids))
+        self.assertTrue(math.isclose(vec.norm, math.sqrt(math.log(9) ** 2 + math.log(4) ** 2)))
+
+        same_names = build_vector([{"name": "beta", "mbid": "", "playcount": 1}], interner)
+        self.assertEqual(list(same_names.ids), [vec.ids[list(vec.weights).index(math.log(9))]])
+
+    def test_recommendations_keep_rank_order_for_equal_weights(self):
+        payload_a = {"overall": [{"name": "Shared", "mbid": "", "playcount": 5}]}
+        payload_b = {
+            "overall": [
+                {"name": "Shared", "mbid": "", "playcount": 5},
+                {"name": "Zed", "mbid": "", "playcount": 4},
+                {"name": "Abe", "mbid": "", "playcount": 4},
+            ]
+        }
+        result = compute_match(payload_a, payload_b)
+        self.assertEqual([r["artist"] for r in result["recs_for_a"]], ["Zed", "Abe"])
+        self.assertEqual(result["overlap"][0]["artist"], "Shared")
+
+    def test_top_k_matches_a_full_sort(self):
+        rng = random.Random(7)
+        weights_a = {rng.randrange(200): float(rng.randint(1, 5)) for _ in range(120)}
+        weights_b = {rng.randrange(200): float(rng.randint(1, 5)) for _ in range(120)}
+        vec_a, vec_b = ArtistVector.from_weights(weights_a), ArtistVector.from_weights(weights_b)
+
+        overlap, shared = top_overlap(vec_a, vec_b, 10)
+        expected = sorted(vec_a.intersect(vec_b), key=lambda x: x[1] + x[2], reverse=True)
+        self.assertEqual(overlap, expected[:10])
+        self.assertEqual(shared, set(weights_a) & set(weights_b))
+
+        recs = top_missing(vec_b, shared, 10)
+        expected = sorted(((a, w) for a, w in weights_b.items() if a not in shared), key=lambda x: x[1], reverse=True)
+        self.assertEqual(recs, expected[:10])
+
+    def test_top_k_and_source_period(self):
+        payload_a = {
+            "overall": [{"name": f"A{i}", "mbid": "", "playcount": 20 - i} for i in range(15)],
+            "3month": [{"name": "Fresh", "mbid": "", "playcount": 3}],
+        }
+        payload_b = {
+            "overall": [{"name": f"A{i}", "mbid": "", "playcount": 20 - i} for i in range(5, 20)],
+            "3month": [{"name": "Fresh", "mbid": "", "playcount": 1}, {"name": "New", "mbid": "", "playcount": 2}],
+        }
+        result = compute_match(payload_a, payload_b, top_k=3)
+        self.assertEqual([o["artist"] for o in result["overlap"]], ["A5", "A6", "A7"])
+        self.assertEqual([r["artist"] for r in result["recs_for_b"]], ["A0", "A1", "A2"])
+
+        result = compute_match(payload_a, payload_b, source_period="3month")
+        self.assertEqual([o["artist"] for o in result["overlap"]], ["Fresh"])
+        self.assertEqual([r["artist"] for r in result["recs_for_a"]], ["New"])
+        # A preferred period without data falls back to the default order.
+        result = compute_match(payload_a, payload_b, source_period="12month")
+        self.assertEqual(len(result["overlap"]), 10)
@@ -0,0 +1,119 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, TopArtistSnapshot
+from matchmaker.services.scoring import compute_match
+from matchmaker.services.similarity import (
+    SimilarityIndex,
+    best_matches_for,
+    clear_similarity_index,
+    get_similarity_index,
+)
+from matchmaker.services.vectors import encode_vector, snapshot_vector_fields
+
+from .fake_lastfm import PROFILES, chart
+
+
+class BestMatchesTests(TestCase):
+    def setUp(self):
+        clear_similarity_index()
+        for username, periods in PROFILES.items():
+            user = LastfmUser.objects.create(username=username)
+            for period, payload in periods.items():
+                TopArtistSnapshot.objects.create(
+                    user=user, period=period, limit=300, payload=payload, **snapshot_vector_fields(payload)
+                )
+
+    def test_ranks_overlapping_users_with_compute_match_blend(self):
+        alice = LastfmUser.objects.get(username="alice")
+        matches = best_matches_for(alice, top_k=10)
+
+        # dave shares no artist with alice, so he is never a candidate.
+        self.assertEqual([m["username"] for m in matches], ["bob", "carol"])
+        for match in matches:
+            expected = compute_match(PROFILES["alice"], PROFILES[match["username"]])
+            self.assertEqual(match["final_score"], expected["final_score"])
+            self.assertEqual(match["scores"], expected["scores"])
+
+    def test_new_snapshots_show_up_without_rebuild(self):
+        alice = LastfmUser.objects.get(username="alice")
+        best_matches_for(alice)
+        payload = chart(("Low", 90), ("High", 40), ("Mid", 5))
+        snapshot = TopArtistSnapshot.objects.get(user__username="dave")
+        snapshot.payload = payload
+        for name, value in snapshot_vector_fields(payload).items():
+            setattr(snapshot, name, value)
+        snapshot.save()  # fetched_at is auto_now
+        matches = best_matches_for(alice)
+        self.assertIn("dave", [m["username"] for m in matches])
+        dave = next(m for m in matches if m["username"] == "dave")
+        self.assertEqual(dave["scores"]["overall"], 1.0)
+
+    def test_top_k_and_unknown_users(self):
+        alice = LastfmUser.objects.get(username="alice")
+        self.assertEqual(len(best_matches_for(alice, top_k=1)), 1)
+        newcomer = LastfmUser.objects.create(username="newcomer")
+        self.assertIsNone(best_matches_for(newcomer))
+
+    def test_api_returns_ranked_json(self):
+        response = self.client.get(reverse("best_matches_api", args=["alice"]), {"k": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["username"] for m in response.json()["matches"]], ["bob", "carol"])
+
+        page = self.client.get(reverse("best_matches", args=["alice"]))
+        self.assertContains(page, "Best matches for alice")
+
+    def test_index_is_kept_per_limit(self):
+        # Only dave is within the watermark overlap, so later calls overlay
+        # one row instead of rebuilding.
+        TopArtistSnapshot.objects.update(fetched_at=timezone.now() - timezone.timedelta(hours=2))
+        TopArtistSnapshot.objects.filter(user__username="dave").update(
+            fetched_at=timezone.now() - timezone.timedelta(hours=1)
+        )
+        alice = LastfmUser.objects.get(username="alice")
+        best_matches_for(alice)
+        matches = best_matches_for(alice, limit=1)
+        head = {user: {period: payload[:1] for period, payload in periods.items()} for user, periods in PROFILES.items()}
+        self.assertEqual([m["username"] for m in matches], ["bob"])
+        self.assertEqual(matches[0]["scores"], compute_match(head["alice"], head["bob"])["scores"])
+
+
+@mock.patch("matchmaker.services.similarity.load_vector_rows", return_value=[])
+class SimilarityIndexCacheTests(SimpleTestCase):
+    def setUp(self):
+        clear_similarity_index()
+        self.addCleanup(clear_similarity_index)
+
+    def test_readers_keep_the_old_index_during_a_rebuild(self, _):
+        old = get_similarity_index()
+        started, release = threading.Event(), threading.Event()
+        build = SimilarityIndex.from_vector_rows
+
+        def slow_build(rows):
+            started.set()
+            release.wait(5)
+            return build(rows)
+
+        with mock.patch.object(SimilarityIndex, "from_vector_rows", side_effect=slow_build):
+            rebuilder = threading.Thread(target=get_similarity_index, kwargs={"max_age": 0})
+            rebuilder.start()
+            started.wait(5)
+            self.assertIs(get_similarity_index(max_age=0), old)
+            release.set()
+            rebuilder.join(5)
+        self.assertIsNot(get_similarity_index(), old)
+
+    def test_overlay_drops_entries_past_the_ttl(self, _):
+        index = SimilarityIndex.from_vector_rows([])
+        now = timezone.now()
+        vector = encode_vector([7], [1.0])
+        row = (vector["vector_ids"], vector["vector_weights"], vector["vector_norm"])
+        index.apply([(1, "overall", *row, now - timezone.timedelta(hours=13))])
+        index.apply([(2, "overall", *row, now)])
+        self.assertEqual(index.overlay_size, 2)
+        index.apply([], fresh_after=(now - timezone.timedelta(hours=12)).timestamp())
+        self.assertEqual(list(index.overlay["overall"]), [2])
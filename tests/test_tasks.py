@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+
+from matchmaker.models import LastfmUser, MatchRequest
+from matchmaker.services import metrics
+from matchmaker.services.lastfm import LastfmRateLimitError
+from matchmaker.services.ratelimit import TokenBucket
+from matchmaker.tasks import BACKGROUND_MAX_DEFERRALS, RETRY_BACKOFFS, refresh_top_artists, run_match
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+class RunMatchTaskTests(TestCase):
+    def setUp(self):
+        self.match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.create(username="alice"),
+            user_b=LastfmUser.objects.create(username="bob"),
+        )
+
+    def _run(self, fail_times: int) -> dict:
+        calls = {"n": 0}
+
+        def flaky_fetch(client, usernames, periods, **kwargs):
+            calls["n"] += 1
+            if calls["n"] <= fail_times:
+                raise LastfmRateLimitError(429, "Rate limited by Last.fm")
+            users = {u.username: u for u in LastfmUser.objects.filter(username__in=usernames)}
+            return users, {username: {} for username in usernames}, set()
+
+        with mock.patch("matchmaker.tasks.fetch_match_data", side_effect=flaky_fetch), mock.patch(
+            "time.sleep"
+        ) as sleep:
+            run_match.apply(args=[str(self.match.uuid)])
+        self.match.refresh_from_db()
+        sleep.assert_not_called()
+        return calls
+
+    def test_rate_limit_is_retried_without_sleeping(self):
+        self._run(fail_times=1)
+        self.assertEqual(self.match.status, "READY")
+
+    def test_gives_up_after_backoff_schedule(self):
+        calls = self._run(fail_times=100)
+        self.assertEqual(self.match.status, "FAILED")
+        self.assertEqual(calls["n"], len(RETRY_BACKOFFS) + 1)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_match_fails_without_retrying(self):
+        calls = self._run(fail_times=1)
+        self.assertEqual(calls["n"], 1)
+        self.assertEqual(self.match.status, "FAILED")
+
+
+class BackgroundRefreshTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["metrics"].clear()
+        LastfmUser.objects.create(username="alice")
+
+    def _refresh(self, bucket):
+        with mock.patch("matchmaker.services.admission.get_rate_limiter", return_value=bucket), mock.patch(
+            "matchmaker.tasks.lastfm.refresh_top_artists"
+        ) as refresh:
+            refresh_top_artists.apply(args=["alice", "overall"])
+        return refresh
+
+    def test_runs_while_quota_is_plentiful(self):
+        self._refresh(TokenBucket(rate=5, capacity=5)).assert_called_once()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_steps_aside_while_quota_is_low(self):
+        bucket = TokenBucket(rate=5, capacity=5)
+        bucket.pause(60)
+        self._refresh(bucket).assert_not_called()
+        self.assertEqual(
+            metrics.total("background_shed_total", task="refresh_top_artists"), BACKGROUND_MAX_DEFERRALS + 1
+        )
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_refresh_is_dropped_not_retried(self):
+        bucket = TokenBucket(rate=5, capacity=5)
+        bucket.pause(60)
+        self._refresh(bucket).assert_not_called()
+        self.assertEqual(metrics.total("background_shed_total", task="refresh_top_artists"), 1)
@@ -0,0 +1,107 @@
+from django.test import TestCase
+
+from matchmaker.models import Artist, LastfmUser, TopArtistSnapshot
+from matchmaker.services.scoring import compute_match, pick_source_period, score_vectors
+from matchmaker.services.snapshots import load_payloads, load_snapshots
+from matchmaker.services.vectors import artist_names, load_vector, snapshot_vector_fields
+
+PAYLOAD_A = {
+    "overall": [
+        {"name": "Shared", "mbid": "m-1", "playcount": 120},
+        {"name": "Only A", "mbid": "", "playcount": 40},
+        {"name": "Also Shared", "mbid": "", "playcount": 7},
+    ],
+    "3month": [{"name": "Only A", "mbid": "", "playcount": 9}],
+}
+PAYLOAD_B = {
+    "overall": [
+        {"name": "Shared", "mbid": "m-1", "playcount": 80},
+        {"name": "also shared", "mbid": "", "playcount": 30},
+        {"name": "Only B", "mbid": "", "playcount": 12},
+    ],
+    "3month": [{"name": "Only A", "mbid": "", "playcount": 2}],
+}
+
+
+class PersistedVectorTests(TestCase):
+    def _snapshot(self, user, period, payload, with_vector=True):
+        fields = snapshot_vector_fields(payload) if with_vector else {}
+        return TopArtistSnapshot.objects.create(user=user, period=period, limit=300, payload=payload, **fields)
+
+    def test_stored_vectors_score_like_payloads(self):
+        alice = LastfmUser.objects.create(username="alice")
+        bob = LastfmUser.objects.create(username="bob")
+        vectors_a = {p: load_vector(self._snapshot(alice, p, payload)) for p, payload in PAYLOAD_A.items()}
+        vectors_b = {p: load_vector(self._snapshot(bob, p, payload)) for p, payload in PAYLOAD_B.items()}
+
+        result = score_vectors(
+            vectors_a, vectors_b, pick_source_period(lambda p: bool(vectors_a.get(p))), artist_names
+        )
+        expected = compute_match(PAYLOAD_A, PAYLOAD_B)
+
+        self.assertEqual(result["scores"], expected["scores"])
+        self.assertEqual(result["final_score"], expected["final_score"])
+        self.assertEqual([o["artist"] for o in result["overlap"]], [o["artist"] for o in expected["overlap"]])
+        self.assertEqual(result["recs_for_a"][0]["artist"], "Only B")
+        self.assertEqual(Artist.objects.count(), 4)
+
+    def test_missing_vector_is_computed_and_saved_on_load(self):
+        alice = LastfmUser.objects.create(username="alice")
+        snapshot = self._snapshot(alice, "overall", PAYLOAD_A["overall"], with_vector=False)
+        vector = load_vector(TopArtistSnapshot.objects.get(pk=snapshot.pk))
+        self.assertEqual(len(vector), 3)
+        self.assertIsNotNone(TopArtistSnapshot.objects.get(pk=snapshot.pk).vector_ids)
+
+    def test_limit_cuts_distinct_artists_with_plays(self):
+        alice = LastfmUser.objects.create(username="alice")
+        payload = [
+            {"name": "Shared", "mbid": "m-1", "playcount": 120},
+            {"name": "Silent", "mbid": "", "playcount": 0},
+            {"name": "Shared again", "mbid": "m-1", "playcount": 90},
+            {"name": "Only A", "mbid": "", "playcount": 40},
+            {"name": "Also Shared", "mbid": "", "playcount": 7},
+        ]
+        snapshot = self._snapshot(alice, "overall", payload)
+
+        # Not the vector of payload[:2]: the silent and repeated entries are
+        # skipped, so the cut reaches "Only A" at chart position 4.
+        vector = load_vector(snapshot, limit=2)
+        expected = load_vector(self._snapshot(LastfmUser.objects.create(username="bob"), "overall", payload[2:4]))
+        self.assertEqual(list(vector.ranked_ids), list(expected.ranked_ids))
+        self.assertEqual(list(vector.ranked_weights), list(expected.ranked_weights))
+        self.assertAlmostEqual(vector.norm, expected.norm)
+
+
+class PackedPayloadTests(TestCase):
+    def test_payload_round_trips_through_packed_columns(self):
+        alice = LastfmUser.objects.create(username="alice")
+        bob = LastfmUser.objects.create(username="bob")
+        payload = [
+            {"name": "Sigur Rós", "mbid": "m-2", "playcount": 120, "url": "https://www.last.fm/music/Sigur+R%C3%B3s"},
+            {"name": "Also Shared", "mbid": "", "playcount": 7, "url": "https://www.last.fm/music/Also+Shared"},
+            {"name": "Odd", "mbid": "", "playcount": 0, "url": "https://example.com/odd"},
+        ]
+        TopArtistSnapshot.objects.create(user=bob, period="overall", limit=300, payload=PAYLOAD_B["overall"])
+        TopArtistSnapshot.objects.create(user=alice, period="overall", limit=300, payload=payload)
+
+        stored = TopArtistSnapshot.objects.get(user=alice)
+        self.assertEqual(len(stored.payload_ids), 12)
+        # Bob saved "also shared" first; only alice's other spelling and the odd url are kept.
+        self.assertEqual(stored.payload_extra, {"names": {"1": "Also Shared"}, "urls": {"2": "https://example.com/odd"}})
+        with self.assertNumQueries(1):
+            self.assertEqual(stored.payload, payload)
+
+    def test_deferred_payloads_load_in_two_queries(self):
+        users = [LastfmUser.objects.create(username=name) for name in ("alice", "bob")]
+        for user, payloads in zip(users, (PAYLOAD_A, PAYLOAD_B)):
+            for period, payload in payloads.items():
+                TopArtistSnapshot.objects.create(user=user, period=period, limit=300, payload=payload)
+
+        snapshots = load_snapshots(users, ["overall", "3month"])
+        with self.assertNumQueries(2):
+            load_payloads(list(snapshots.values()))
+        with self.assertNumQueries(0):
+            overall = snapshots[(users[1].pk, "overall")]
+            self.assertEqual([a["name"] for a in overall.payload], ["Shared", "also shared", "Only B"])
+            self.assertEqual(overall.payload[0]["mbid"], "m-1")
+            self.assertEqual(set(overall.payload_artists), {"m-1", "also shared", "only b"})
@@ -1,7 +1,13 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
 from matchmaker.models import LastfmUser, MatchRequest
+from matchmaker.services.progress import publish_progress
 
 
 class MatchDetailViewTests(TestCase):
@@ -24,3 +30,158 @@ class MatchDetailViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Shared obsessions")
         self.assertContains(response, "88.8")
+
+    def test_stale_notice_only_promises_queued_refreshes(self):
+        result = {"final_score": 50.0, "scores": {}, "overlap": [], "recs_for_a": [], "recs_for_b": []}
+        users = [LastfmUser.objects.create(username=name) for name in ("alice", "bob")]
+        for refreshing in (False, True):
+            match = MatchRequest.objects.create(
+                user_a=users[0],
+                user_b=users[1],
+                status="READY",
+                result={**result, "stale": ["alice/overall"], "refreshing": refreshing},
+            )
+            response = self.client.get(reverse("match_detail", args=[match.uuid]))
+            self.assertContains(response, "Some of this data came from our cache")
+            self.assertEqual("being refreshed" in response.content.decode(), refreshing)
+
+
+class FinishedMatchCachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.create(username="alice"),
+            user_b=LastfmUser.objects.create(username="bob"),
+            status="READY",
+            result={"final_score": 42.0, "scores": {}, "overlap": [], "recs_for_a": [], "recs_for_b": []},
+        )
+
+    def test_ready_page_is_cacheable_and_conditional(self):
+        url = reverse("match_detail", args=[self.match.uuid])
+        first = self.client.get(url)
+        # The HTML links static files a deploy replaces: revalidate, never keep.
+        self.assertIn("no-cache", first["Cache-Control"])
+        self.assertNotIn("max-age", first["Cache-Control"])
+
+        # Only the status row is read: the rendered page comes from the cache.
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_json_variant_and_terminal_status(self):
+        response = self.client.get(reverse("match_api", args=[self.match.uuid]))
+        self.assertIn("max-age=86400", response["Cache-Control"])
+        data = response.json()
+        self.assertEqual((data["status"], data["user_a"], data["result"]["final_score"]), ("READY", "alice", 42.0))
+
+        status = self.client.get(reverse("match_status", args=[self.match.uuid]))
+        self.assertEqual(status.json()["redirect"], reverse("match_detail", args=[self.match.uuid]))
+        self.assertIn("ETag", status)
+
+    def test_pending_matches_are_not_cached(self):
+        MatchRequest.objects.filter(pk=self.match.pk).update(status="PENDING")
+        for name in ("match_detail", "match_api", "match_status"):
+            response = self.client.get(reverse(name, args=[self.match.uuid]))
+            self.assertIn("no-cache", response["Cache-Control"])
+            self.assertNotIn("ETag", response)
+
+
+class HomeViewTests(TestCase):
+    def test_post_enqueues_match_task(self):
+        with mock.patch("matchmaker.views.run_match") as task:
+            response = self.client.post(
+                reverse("home"), {"username_a": "alice", "username_b": "bob"}
+            )
+        match = MatchRequest.objects.get()
+        self.assertRedirects(response, reverse("match_detail", args=[match.uuid]), fetch_redirect_response=False)
+        task.delay.assert_called_once_with(str(match.uuid))
+        self.assertEqual(match.status, "PENDING")
+
+    def test_pending_pair_is_not_queued_twice(self):
+        with mock.patch("matchmaker.views.run_match") as task:
+            first = self.client.post(reverse("home"), {"username_a": "alice", "username_b": "bob"})
+            second = self.client.post(reverse("home"), {"username_a": "alice", "username_b": "bob"})
+            self.client.post(reverse("home"), {"username_a": "bob", "username_b": "alice"})
+        self.assertEqual(first["Location"], second["Location"])
+        self.assertEqual(task.delay.call_count, 2)
+        self.assertEqual(MatchRequest.objects.count(), 2)
+
+
+@override_settings(MATCH_SUBMIT_LIMIT=2, MATCH_SUBMIT_WINDOW_SECONDS=60, TRUSTED_PROXY_COUNT=1)
+class SubmissionThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _submit(self, username_b, client_ip="203.0.113.7"):
+        with mock.patch("matchmaker.views.run_match"):
+            return self.client.post(
+                reverse("home"),
+                {"username_a": "alice", "username_b": username_b},
+                HTTP_X_FORWARDED_FOR=f"10.0.0.1, {client_ip}",
+            )
+
+    def test_clients_are_throttled_separately(self):
+        self.assertEqual(self._submit("bob").status_code, 302)
+        # Deduplicated submissions queue nothing and are not counted.
+        self.assertEqual(self._submit("bob").status_code, 302)
+        self.assertEqual(self._submit("carol").status_code, 302)
+
+        with self.assertNumQueries(0):
+            response = self._submit("dave")
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, "Too many matches", status_code=429)
+        self.assertLessEqual(int(response["Retry-After"]), 60)
+        self.assertEqual(MatchRequest.objects.count(), 2)
+        self.assertFalse(LastfmUser.objects.filter(username="dave").exists())
+
+        self.assertEqual(self._submit("dave", client_ip="198.51.100.2").status_code, 302)
+
+
+class MatchEventsTests(TestCase):
+    def setUp(self):
+        self.match = MatchRequest.objects.create(
+            user_a=LastfmUser.objects.create(username="alice"),
+            user_b=LastfmUser.objects.create(username="bob"),
+        )
+        self.url = reverse("match_events", args=[self.match.uuid])
+
+    def test_wsgi_gets_one_snapshot_and_a_retry_hint(self):
+        publish_progress(str(self.match.uuid), step="scoring")
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = response.content.decode()
+        self.assertTrue(body.startswith("retry: 1500\n"))
+        self.assertIn('"step": "scoring"', body)
+
+    async def test_asgi_streams_progress_until_ready(self):
+        response = await self.async_client.get(self.url)
+        stream = aiter(response.streaming_content)
+        self.assertIn('"status": "PENDING"', (await anext(stream)).decode())
+
+        match_id = str(self.match.uuid)
+        publish_progress(match_id, step="fetched", user="alice", period="3month", done=1)
+        self.assertIn('"period": "3month"', (await anext(stream)).decode())
+
+        await MatchRequest.objects.filter(uuid=match_id).aupdate(status="READY")
+        publish_progress(match_id, status="READY")
+        final = json.loads((await anext(stream)).decode().removeprefix("data: "))
+        self.assertEqual(final, {"status": "READY", "redirect": reverse("match_detail", args=[match_id])})
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    async def test_asgi_polls_the_row_when_worker_events_cannot_arrive(self):
+        response = await self.async_client.get(self.url)
+        stream = aiter(response.streaming_content)
+        self.assertIn('"status": "PENDING"', (await anext(stream)).decode())
+
+        # A worker in another process finishes without publishing here.
+        await MatchRequest.objects.filter(uuid=self.match.uuid).aupdate(status="READY")
+        with mock.patch("matchmaker.views.MATCH_EVENTS_POLL_SECONDS", 0.01):
+            final = await asyncio.wait_for(anext(stream), timeout=1)
+        self.assertIn('"status": "READY"', final.decode())
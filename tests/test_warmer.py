@@ -0,0 +1,132 @@
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from matchmaker.models import LastfmUser, MatchRequest, TopArtistSnapshot
+from matchmaker.services import metrics
+from matchmaker.services.lastfm import LastfmError, LastfmRateLimitError, cache_marker, claim_refresh, fetch_match_data
+from matchmaker.services.ratelimit import TokenBucket
+from matchmaker.services.warmer import warm, warm_candidates, warm_stats
+
+PERIODS = ["3month", "12month", "overall"]
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = []
+
+    def get_user_info(self, username):
+        self.calls.append(("info", username))
+        return {"playcount": "1"}
+
+    def get_top_artists(self, username, period, limit=300):
+        self.calls.append((username, period))
+        return [{"name": f"{username}-{period}", "mbid": "", "playcount": 3, "url": ""}]
+
+
+@override_settings(CACHE_WARM_MIN_MATCHES=2, LASTFM_SNAPSHOT_TTL_HOURS=12, CACHE_WARM_HORIZON_HOURS=1)
+class CacheWarmerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["metrics"].clear()
+        now = timezone.now()
+        users = {name: LastfmUser.objects.create(username=name, last_synced_at=now) for name in ("alice", "bob", "carol")}
+        for name, user in users.items():
+            for period in PERIODS:
+                TopArtistSnapshot.objects.create(user=user, period=period, limit=300, payload=[])
+        for a, b in [("alice", "bob")] * 2 + [("carol", "bob")]:
+            MatchRequest.objects.create(user_a=users[a], user_b=users[b])
+        # Due within the horizon, except alice's 3month which was just fetched.
+        TopArtistSnapshot.objects.update(fetched_at=now - timezone.timedelta(hours=11.5))
+        TopArtistSnapshot.objects.filter(user__username="alice", period="3month").update(fetched_at=now)
+        TopArtistSnapshot.objects.filter(user__username="bob", period="overall").update(
+            fetched_at=now - timezone.timedelta(hours=11.8)
+        )
+
+    def test_candidates_are_popular_users_due_soon(self):
+        due = [(s.user.username, s.period) for s in warm_candidates()]
+        self.assertEqual(
+            due,
+            [("bob", "overall"), ("bob", "3month"), ("bob", "12month"), ("alice", "12month"), ("alice", "overall")],
+        )
+
+    def test_budget_and_queued_refreshes_are_respected(self):
+        claim_refresh(("top", "bob", "3month", 300))  # a lazy refresh is already queued
+        client = CountingClient()
+        stats = warm(client, budget=3)
+        self.assertEqual(sorted(client.calls), [("alice", "12month"), ("bob", "12month"), ("bob", "overall")])
+        self.assertEqual((stats["due"], stats["refreshed"], stats["warm_refreshes"]), (5, 3, 3))
+        self.assertTrue(TopArtistSnapshot.objects.get(user__username="bob", period="overall").is_fresh(ttl_hours=1))
+
+    def test_warm_hits_are_counted_once(self):
+        # Larger than the 300 matches ask for: markers still line up.
+        TopArtistSnapshot.objects.update(limit=500)
+        warm(CountingClient(), budget=10)
+        client = CountingClient()
+        fetch_match_data(client, ["alice", "bob"], PERIODS)
+        fetch_match_data(client, ["alice", "bob"], PERIODS)
+        self.assertEqual(client.calls, [])
+
+        stats = warm_stats()
+        self.assertEqual((stats["snapshot_fresh"], stats["snapshot_warm_hits"]), (12, 5))
+        self.assertEqual((stats["hit_ratio"], stats["warm_hit_ratio"]), (1.0, 1.0))
+
+    @override_settings(LASTFM_BACKGROUND_MIN_QUOTA=0.5, LASTFM_FETCH_CONCURRENCY=2)
+    def test_stops_when_quota_runs_low(self):
+        bucket = TokenBucket(rate=0.001, capacity=6)
+        client = CountingClient()
+        original = client.get_top_artists
+
+        def spend(*args, **kwargs):
+            bucket.reserve()
+            return original(*args, **kwargs)
+
+        client.get_top_artists = spend
+        with mock.patch("matchmaker.services.admission.get_rate_limiter", return_value=bucket):
+            stats = warm(client, budget=10)
+        # Two batches of two bring the bucket below half; the fifth is left.
+        self.assertEqual((stats["due"], stats["refreshed"]), (5, 4))
+        self.assertEqual(metrics.total("background_shed_total", task="warm_snapshot_cache"), 1)
+        # The snapshot left over was never claimed, so a lazy refresh may still take it.
+        self.assertTrue(claim_refresh(("top", "alice", "overall", 300)))
+
+    def test_failed_batches_release_their_claims(self):
+        client = CountingClient()
+
+        def fail(*args, **kwargs):
+            raise LastfmRateLimitError(429, "Rate limited by Last.fm")
+
+        client.get_top_artists = fail
+        self.assertEqual(warm(client, budget=10)["refreshed"], 0)
+        self.assertTrue(claim_refresh(("top", "bob", "overall", 300)))
+
+    @override_settings(LASTFM_FETCH_CONCURRENCY=5)
+    def test_snapshots_stored_before_a_failure_count_as_warmed(self):
+        client = CountingClient()
+        original = client.get_top_artists
+
+        def fail_for_alice(username, period, limit=300):
+            if username == "alice":
+                raise LastfmError(8, "Operation failed")
+            return original(username, period, limit)
+
+        client.get_top_artists = fail_for_alice
+        stats = warm(client, budget=10)
+        self.assertEqual(stats["refreshed"], 3)
+        bob = ("top", "bob", "overall", 300)
+        self.assertEqual(cache.get(cache_marker("warmed", bob)), 1)
+        self.assertFalse(claim_refresh(bob))
+        self.assertTrue(claim_refresh(("top", "alice", "overall", 300)))
+
+    @override_settings(LASTFM_FETCH_CONCURRENCY=1)
+    def test_budget_counts_calls_not_snapshots(self):
+        def drift(client, username, previous):
+            client.get_user_info(username)  # the delta request
+            return None  # drifted: fall back to the full chart
+
+        with mock.patch("matchmaker.services.delta.can_refresh", return_value=True), mock.patch(
+            "matchmaker.services.delta.refresh", side_effect=drift
+        ):
+            self.assertEqual(warm(CountingClient(), budget=4)["refreshed"], 2)